@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+import time
 import yaml
 import sqlite3
 import gzip
@@ -22,13 +23,29 @@ from .models import Device, Tag, Parent, Interface, InterfaceTag, Cache, Log_Ent
 sys.path.insert(0, "/opt")
 import ablib.utils as abutils
 import lib.base_common as base_common
-from lib.device import Device_Cache
+from lib.device import Device_Cache, Device_Store
+from lib.ip_index import IP_Index
+from lib.topology import Topology
+from lib.config_mirror import Config_Mirror, Config_Mirror_Error
 
 
 class API_Exception(Exception):
     pass
 
 
+# Address index, one per worker process. Kept up to date from the device cache
+ip_index = IP_Index()
+ip_index_checked = 0.0
+IP_INDEX_CHECK_INTERVAL = 1.0    # seconds between checks for changed devices
+
+# Parent/child topology, one per worker process. Kept up to date from the device cache
+topology = Topology()
+topology_checked = 0.0
+
+# Mirror of oxidized configuration backups, one per worker process. Index is reloaded when mirror changes
+config_mirror = None
+
+
 # ############################################################################
 #
 #  Logs
@@ -86,14 +103,30 @@ def home(request):
 def devices(request, name: str = None):
     device_cache = Device_Cache(config=config, cache_cls=Cache)
     try:
-        devices = device_cache.get_devices(name=name)
+        # The cache is already JSON, return it without decoding
+        devices = device_cache.get_devices_json(name=name)
         if devices is not None:
-            return JsonResponse(devices)
+            return HttpResponse(devices, content_type="application/json")
         raise Http404("Database does not contain devices from netbox and becs")
     except Device_Cache.exception as err:
         raise Http404(err)
 
 
+def devices_query(request):
+    """
+    Return devices from the Device-API tables, filtered on
+    name, role, tag, site, parent and src (query parameters)
+    """
+    device_store = Device_Store(device_cls=Device)
+    filters = {}
+    for key in ["name", "role", "tag", "site", "parent", "src"]:
+        value = request.GET.get(key, None)
+        if value:
+            filters[key] = value
+    devices = device_store.query(**filters)
+    return JsonResponse({"data": devices})
+
+
 def devices_refresh_cache(request, name: str = None):
     """
     Refresh all or one device from Netbox to cache
@@ -108,6 +141,117 @@ def devices_refresh_cache(request, name: str = None):
     return JsonResponse(response)
 
 
+def get_ip_index() -> IP_Index:
+    """
+    Return the address index, reindexing changed devices at most once per IP_INDEX_CHECK_INTERVAL
+    """
+    global ip_index_checked
+    now = time.monotonic()
+    if now - ip_index_checked > IP_INDEX_CHECK_INTERVAL:
+        device_cache = Device_Cache(config=config, cache_cls=Cache)
+        device_cache.update_index(ip_index)
+        ip_index_checked = now
+    return ip_index
+
+
+@csrf_exempt
+def ip_lookup(request, address: str = None):
+    """
+    Find device and interface owning an address, using longest prefix match
+    GET  /api/ip/<address>
+    POST /api/ip   body is a JSON list of addresses
+    """
+    index = get_ip_index()
+    if address:
+        try:
+            entries = index.lookup(address)
+        except ValueError:
+            return JsonResponse(dict(errno=1, msg=f"Invalid address '{address}'"), status=400)
+        return JsonResponse({"address": address, "data": entries})
+
+    if request.method != "POST":
+        return JsonResponse(dict(errno=1, msg="POST a JSON list of addresses"), status=405)
+    try:
+        addresses = json.loads(request.body)
+        if not isinstance(addresses, list):
+            raise ValueError("Expected a list")
+    except ValueError as err:
+        return JsonResponse(dict(errno=1, msg=f"Invalid request, {err}"), status=400)
+
+    response = {}
+    for address in addresses:
+        try:
+            response[address] = index.lookup(str(address))
+        except ValueError:
+            response[address] = None
+    return JsonResponse({"data": response})
+
+
+def get_topology() -> Topology:
+    """
+    Return the topology, updated with changed devices at most once per IP_INDEX_CHECK_INTERVAL
+    """
+    global topology_checked
+    now = time.monotonic()
+    if now - topology_checked > IP_INDEX_CHECK_INTERVAL:
+        device_cache = Device_Cache(config=config, cache_cls=Cache)
+        device_cache.update_index(topology)
+        topology_checked = now
+    return topology
+
+
+def topology_query(request, name: str = None):
+    """
+    GET /api/topology         roots, unknown parents and cycles
+    GET /api/topology/<name>  parents, children, ancestors and descendants of a device
+    """
+    topo = get_topology()
+    if name is None:
+        return JsonResponse({"data": topo.to_dict()})
+    n = base_common.Name(name)
+    if n.long not in topo.device_parents:
+        raise Http404(f"Unknown device '{name}'")
+    return JsonResponse({"data": topo.to_dict(name=n.long)})
+
+
+def get_config_mirror() -> Config_Mirror:
+    global config_mirror
+    if config_mirror is None:
+        config_mirror = Config_Mirror(config=config.oxidized.mirror)
+    return config_mirror
+
+
+def config_search(request):
+    """
+    Search oxidized configuration backups
+    GET /api/config/search?q=<text>&ignore_case=1
+    """
+    if not config.oxidized.get("mirror", None):
+        raise Http404("No oxidized configuration mirror configured")
+    text = request.GET.get("q", "")
+    if len(text) < 3:
+        return JsonResponse(dict(errno=1, msg="Search text must be at least 3 characters"), status=400)
+    ignore_case = request.GET.get("ignore_case", "") in ("1", "true", "yes")
+    try:
+        result = get_config_mirror().search(text, ignore_case=ignore_case)
+    except Config_Mirror_Error as err:
+        return JsonResponse(dict(errno=1, msg=str(err)), status=500)
+    return JsonResponse({"data": result})
+
+
+def config_get(request, name: str):
+    """
+    Get configuration backup for a device, from the oxidized configuration mirror
+    GET /api/config/<name>
+    """
+    if not config.oxidized.get("mirror", None):
+        raise Http404("No oxidized configuration mirror configured")
+    conf = get_config_mirror().get_device_config(name)
+    if conf is None:
+        raise Http404(f"No configuration for '{name}'")
+    return HttpResponse(conf, content_type="text/plain")
+
+
 @csrf_exempt
 def netbox(request):
     """
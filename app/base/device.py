@@ -3,15 +3,17 @@ import datetime
 import requests
 
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, Http404
 from django.contrib.auth.decorators import login_required
 
-
-import pynetbox
+from .models import Cache, Compliance
 
 if "/opt" not in sys.path:
     sys.path.insert(0, "/opt")
 import ablib.utils as abutils
+import lib.base_common as base_common
+from lib.device import Device_Cache
+from lib.compliance import get_intent, get_result
 
 try:
     import emmgr.lib.element
@@ -24,28 +26,34 @@ except ModuleNotFoundError:
 @login_required
 def verify(request, name: str = None):
     """
-    Work in progress
+    Show device, NetBox intent compared with configuration backup
+    Uses the device cache and the stored result from tools/oxidized/check_compliance.py
     """
-    # Fetch config
-
-    # We only handle devices in NetBox
-    # Fetch info from netbox
-    netbox = pynetbox.api(url=config.netbox.url, token=config.netbox.token)
-    if "." in name:
-        name = name.split(".", 1)[0]
-    device = netbox.dcim.devices.get(name=name)
-#    abutils.pprint(device, "device")
-
-    # Get interfaces for device
-    interfaces = netbox.dcim.interfaces.filter(device=name)
-    for interface in interfaces:
-        abutils.pprint(interface, "interface")
-
-    # Get configured VLANs on each interface
-
-    # Fetch live VLAN configuration from element
-
-    return render(request, 'device.html', {"name": name, "device": device, "interfaces": interfaces})
+    n = base_common.Name(name)
+    device_cache = Device_Cache(config=config, cache_cls=Cache)
+    devices = device_cache.get_devices(name=n.long)
+    if not devices:
+        raise Http404(f"Unknown device '{name}'")
+    device = next(iter(devices.values()))
+
+    compliance, result = get_result(Compliance, device.name)
+
+    # Interfaces in NetBox first, then interfaces only in configuration
+    intent = get_intent(device)
+    interfaces = []
+    for ifname, want in intent.items():
+        entry = result.get(ifname, None) or dict(want, config_enabled=None, config_addresses=[], errors=[])
+        interfaces.append(dict(entry, name=ifname))
+    for ifname, entry in result.items():
+        if ifname not in intent:
+            interfaces.append(dict(entry, name=ifname))
+
+    return render(request, 'base/device.html', {
+        "name": device.name,
+        "device": device.to_dict(),     # unset fields are missing keys, not errors, in the template
+        "compliance": compliance,
+        "interfaces": interfaces,
+    })
 
 
 def get_config(request, name=None):
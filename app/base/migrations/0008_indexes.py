@@ -0,0 +1,100 @@
+# Generated by Django 3.2.25 on 2026-10-19 07:32
+
+from django.db import migrations, models
+
+
+def delete_duplicate_devices(apps, schema_editor):
+    """
+    Keep the first device for each (name, _src), before the unique constraint is added
+    Parents, tags and interfaces of the deleted devices are deleted with them
+    """
+    Device = apps.get_model('base', 'Device')
+    seen = set()
+    duplicates = []
+    for id_, name, field_src in Device.objects.order_by('id').values_list('id', 'name', 'field_src'):
+        if (name, field_src) in seen:
+            duplicates.append(id_)
+        seen.add((name, field_src))
+    if duplicates:
+        print(f"\n  Deleting {len(duplicates)} duplicate devices")
+        Device.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_delete_keyval'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='field_src',
+            field=models.CharField(blank=True, db_column='_src', db_index=True, default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='name',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='role',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='device',
+            name='site_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='interface',
+            name='field_src',
+            field=models.CharField(blank=True, db_column='_src', db_index=True, default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='interface',
+            name='ipv4_prefix',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=18),
+        ),
+        migrations.AlterField(
+            model_name='interface',
+            name='ipv6_prefix',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=43),
+        ),
+        migrations.AlterField(
+            model_name='interfacetag',
+            name='field_src',
+            field=models.CharField(blank=True, db_column='_src', db_index=True, default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='interfacetag',
+            name='tag',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='parent',
+            name='field_src',
+            field=models.CharField(blank=True, db_column='_src', db_index=True, default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='parent',
+            name='parent',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='field_src',
+            field=models.CharField(blank=True, db_column='_src', db_index=True, default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='tag',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(delete_duplicate_devices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='device',
+            constraint=models.UniqueConstraint(fields=('name', 'field_src'), name='device_name_src_uniq'),
+        ),
+    ]
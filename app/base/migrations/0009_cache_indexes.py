@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 07:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cache',
+            name='name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='cache',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
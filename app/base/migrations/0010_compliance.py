@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_cache_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Compliance',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('status', models.CharField(blank=True, db_index=True, default='', max_length=32)),
+                ('errors', models.IntegerField(default=0)),
+                ('config_mtime', models.CharField(blank=True, default='', max_length=64)),
+                ('config_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('intent_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('data', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'db_table': 'compliance',
+            },
+        ),
+    ]
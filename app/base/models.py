@@ -11,12 +11,12 @@ from django.utils import timezone
 
 class Device(models.Model):
     id = models.AutoField(primary_key=True)
-    name = models.CharField(max_length=255, default="")
+    name = models.CharField(max_length=255, default="", db_index=True)
     manufacturer = models.CharField(max_length=255, blank=True, default="")
     model = models.CharField(max_length=255, blank=True, default="")
     comments = models.TextField(blank=True, default="")
-    role = models.CharField(max_length=255, blank=True, default="")
-    site_name = models.CharField(max_length=255, blank=True, default="")
+    role = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    site_name = models.CharField(max_length=255, blank=True, default="", db_index=True)
     platform = models.CharField(max_length=255, blank=True, default="")
     ipv4_prefix = models.CharField(max_length=18, default="", blank=True)
     ipv6_prefix = models.CharField(max_length=43, default="", blank=True)
@@ -30,10 +30,13 @@ class Device(models.Model):
     monitor_icinga = models.BooleanField(default=False)
     monitor_librenms = models.BooleanField(default=False)
     backup_oxidized = models.BooleanField(default=False)
-    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True)
+    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'device'
+        constraints = [
+            models.UniqueConstraint(fields=["name", "field_src"], name="device_name_src_uniq"),
+        ]
     
     def __str__(self):
         return f"{self.name} | {self.role}"
@@ -42,8 +45,8 @@ class Device(models.Model):
 class Parent(models.Model):
     id = models.AutoField(primary_key=True)
     device = models.ForeignKey(Device, on_delete=models.CASCADE, default=-1)
-    parent = models.CharField(max_length=255, blank=True, default="")
-    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True)
+    parent = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'parent'
@@ -55,8 +58,8 @@ class Parent(models.Model):
 class Tag(models.Model):
     id = models.AutoField(primary_key=True)
     device = models.ForeignKey(Device, on_delete=models.CASCADE, default=-1)
-    tag = models.CharField(max_length=255, blank=True, null=True)
-    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True)
+    tag = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'tag'
@@ -70,10 +73,10 @@ class Interface(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE, default=-1)
     name = models.CharField(max_length=255, default="")
     role = models.CharField(max_length=255, blank=True, default="")
-    ipv4_prefix = models.CharField(max_length=18, default="", blank=True)
-    ipv6_prefix = models.CharField(max_length=43, default="", blank=True)
+    ipv4_prefix = models.CharField(max_length=18, default="", blank=True, db_index=True)
+    ipv6_prefix = models.CharField(max_length=43, default="", blank=True, db_index=True)
     enabled = models.BooleanField(default=False)
-    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True)
+    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'interface'
@@ -85,8 +88,8 @@ class Interface(models.Model):
 class InterfaceTag(models.Model):
     id = models.AutoField(primary_key=True)
     interface = models.ForeignKey(Interface, on_delete=models.CASCADE, default=-1)
-    tag = models.CharField(max_length=255, blank=True, default="")
-    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True)
+    tag = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    field_src = models.CharField(max_length=10, db_column='_src', default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'interfacetag'
@@ -97,9 +100,9 @@ class InterfaceTag(models.Model):
 
 class Cache(models.Model):
     id = models.AutoField(primary_key=True)
-    timestamp = models.DateTimeField(default=timezone.now)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     data = models.TextField(null=False)
-    name = models.CharField(max_length=255, default="", blank=True)
+    name = models.CharField(max_length=255, default="", blank=True, db_index=True)
 
     class Meta:
         db_table = 'cache'
@@ -108,6 +111,27 @@ class Cache(models.Model):
         return f"name={self.name}, data={self.data}"
 
 
+class Compliance(models.Model):
+    """
+    Result of last compliance check for a device, NetBox intent vs configuration backup
+    """
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+    status = models.CharField(max_length=32, blank=True, default="", db_index=True)
+    errors = models.IntegerField(default=0)
+    config_mtime = models.CharField(max_length=64, blank=True, default="")
+    config_hash = models.CharField(max_length=64, blank=True, default="")
+    intent_hash = models.CharField(max_length=64, blank=True, default="")
+    data = models.TextField(blank=True, default="")
+
+    class Meta:
+        db_table = 'compliance'
+
+    def __str__(self):
+        return f"{self.name} | {self.status} | {self.errors}"
+
+
 class Control(models.Model):
     id = models.AutoField(primary_key=True)
     sync_name = models.CharField(max_length=255, blank=True, default="") 
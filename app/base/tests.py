@@ -1,3 +1,25 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from lib.ip_index import IP_Index
+
+
+class IP_Index_Test(SimpleTestCase):
+
+    def test_update_device_same_address_twice(self):
+        """
+        primary_ip4 is often also an interface address, so the device has the same keys twice
+        """
+        device = {
+            "primary_ip4": {"address": "10.9.9.1/29"},
+            "interfaces": {"lo": {"prefix4": [{"address": "10.9.9.1/29"}]}},
+        }
+        index = IP_Index()
+        index.update_device("r1", device)
+        index.update_device("r1", device)
+        self.assertEqual(sorted(e.type for e in index.lookup("10.9.9.1")), ["interface", "primary"])
+        self.assertEqual([e.match for e in index.lookup("10.9.9.2")], ["network", "network"])
+
+        index.update_device("r1", None)
+        self.assertEqual(index.lookup("10.9.9.1"), [])
+        self.assertEqual(index.tables, {4: {}, 6: {}})
+        self.assertEqual(index.prefixlens, {4: [], 6: []})
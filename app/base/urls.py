@@ -9,8 +9,15 @@ urlpatterns = [
     path('api/netbox', api.netbox),
     path('api/device/<str:name>', api.devices),
     path('api/device', api.devices),
+    path('api/devices', api.devices_query),
     path('api/device_refresh_cache/<str:name>', api.devices_refresh_cache),
     path('api/device_refresh_cache', api.devices_refresh_cache),
+    path('api/ip/<str:address>', api.ip_lookup),
+    path('api/ip', api.ip_lookup),
+    path('api/topology/<str:name>', api.topology_query),
+    path('api/topology', api.topology_query),
+    path('api/config/search', api.config_search),
+    path('api/config/<str:name>', api.config_get),
     path("api/log/<int:id_>", api.log),
     path("api/log/", api.log),
     path("api/", api.home),
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Interface alarm policy
+
+Decides if alarms should be ignored for an interface, from the device
+default (alarm_interfaces), interface tags, role and name.
+
+The policy is a list of rules, evaluated in order, the last matching rule
+decides. A rule matches on one of
+    tag      interface has the tag
+    role     regex search on interface role
+    ifname   regex search on interface name
+
+Consecutive regex rules of the same kind and result are compiled into one
+alternation regex. Decisions are memoized on (default, role, ifname, tags).
+
+The default rules are the ones used by the LibreNMS sync:
+
+    default ignore = 0 if device "alarm_interfaces" else 1
+    tag uplink                      -> ignore = 0
+    tag librenms_alarm_disable      -> ignore = 1
+    tag librenms_alarm_enable       -> ignore = 0
+    role matches roles_enabled      -> ignore = 0
+    ifname matches interfaces_disabled -> ignore = 1
+"""
+
+import re
+from typing import Dict, List
+
+DEFAULT_TAG_RULES = [
+    dict(tag="uplink", ignore=0),
+    dict(tag="librenms_alarm_disable", ignore=1),
+    dict(tag="librenms_alarm_enable", ignore=0),
+]
+
+
+class Alarm_Policy:
+
+    def __init__(self, rules: List[Dict]):
+        """
+        rules is a list of dicts, with one of the keys tag, role or ifname, and ignore
+        role and ifname values are a regex or a list of regexes
+        """
+        self.rules = []         # list of (kind, tag or compiled regex, ignore)
+        self.tags = set()       # tags used by any rule
+        for rule in rules:
+            ignore = int(rule["ignore"])
+            if "tag" in rule:
+                self.rules.append(("tag", rule["tag"], ignore))
+                self.tags.add(rule["tag"])
+                continue
+            kind = "role" if "role" in rule else "ifname"
+            patterns = rule[kind]
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            if not patterns:
+                continue
+            if self.rules and self.rules[-1][0] == kind and self.rules[-1][2] == ignore:
+                # Same kind and result as previous rule, extend its alternation
+                patterns = [self.rules.pop()[1].pattern] + list(patterns)
+            regex = re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+            self.rules.append((kind, regex, ignore))
+        self._decisions = {}
+
+    @classmethod
+    def from_config(cls, sync_config) -> "Alarm_Policy":
+        """
+        Create policy from a sync config section
+        Uses "alarm_policy" rules if set, otherwise the default rules
+        with "roles_enabled" and "interfaces_disabled"
+        """
+        rules = sync_config.get("alarm_policy", None)
+        if rules is None:
+            rules = DEFAULT_TAG_RULES + [
+                dict(role=sync_config.get("roles_enabled", None) or [], ignore=0),
+                dict(ifname=sync_config.get("interfaces_disabled", None) or [], ignore=1),
+            ]
+        return cls(rules)
+
+    def decide(self, default_ignore: int, role: str, ifname: str, tags) -> int:
+        """
+        returns ignore, 0 or 1
+        """
+        key = (default_ignore, role, ifname, frozenset(self.tags.intersection(tags or ())))
+        ignore = self._decisions.get(key, None)
+        if ignore is not None:
+            return ignore
+
+        ignore = default_ignore
+        tags = key[3]
+        for kind, match, rule_ignore in self.rules:
+            if kind == "tag":
+                if match in tags:
+                    ignore = rule_ignore
+            elif kind == "role":
+                if role and match.search(role):
+                    ignore = rule_ignore
+            elif match.search(ifname):
+                ignore = rule_ignore
+        self._decisions[key] = ignore
+        return ignore
+
+    def evaluate(self, devices: Dict) -> Dict:
+        """
+        Decide ignore for all interfaces on all devices
+        returns dict, key is (device name, interface name), value is (ignore, role)
+        """
+        index = {}
+        for name, device in devices.items():
+            default_ignore = 0 if device.alarm_interfaces else 1
+            for ifname, interface in device.interfaces.items():
+                role = interface.get("role") or ""
+                index[(name, ifname)] = (self.decide(default_ignore, role, ifname, interface.get("tags")), role)
+        return index
@@ -162,14 +162,51 @@ class Rabbitmq_Mgr:
         self.channel.basic_publish(exchange="factum", routing_key="cmd", body=json.dumps(data))
         return xid
 
-    def receive_cmd(self):
+    def receive_cmd(self, ack_batch: int = 1, inactivity_timeout: float = None, batch_cmds=()):
         """
         Receive cmd messages
         Works as a generator, this is blocking
+        Messages with a cmd in batch_cmds are acked in batches of ack_batch, with
+        one ack for all of them. They must be handled quickly.
+        Other messages are acked before they are yielded, and the consumer is
+        cancelled while they are handled, so prefetched messages are returned to
+        the queue instead of waiting unacked during a long running command.
+        If inactivity_timeout is set, None is yielded when no message has arrived
+        during that time, outstanding messages are then acked
         """
-        for method_frame, properties, body in self.channel.consume(self.cmd_queue_name):
-            self.channel.basic_ack(method_frame.delivery_tag)
-            data = json.loads(body)
+        if ack_batch > 1:
+            self.channel.basic_qos(prefetch_count=ack_batch * 2)
+        unacked = None      # delivery tag of last received, not acked, message
+        count = 0
+        while True:
+            data = None
+            for method_frame, properties, body in self.channel.consume(self.cmd_queue_name, inactivity_timeout=inactivity_timeout):
+                if method_frame is None:
+                    if unacked is not None:
+                        self.channel.basic_ack(unacked, multiple=True)
+                        unacked = None
+                        count = 0
+                    yield None
+                    continue
+                data = json.loads(body)
+                if data.get("cmd", None) not in batch_cmds:
+                    # Ack this and all outstanding messages, then handle it outside the consumer
+                    self.channel.basic_ack(method_frame.delivery_tag, multiple=True)
+                    unacked = None
+                    count = 0
+                    break
+                count += 1
+                if count >= ack_batch:
+                    self.channel.basic_ack(method_frame.delivery_tag, multiple=True)
+                    unacked = None
+                    count = 0
+                else:
+                    unacked = method_frame.delivery_tag
+                yield data
+                data = None
+            if data is None:
+                return      # Consumer was cancelled by the broker
+            self.channel.cancel()   # Requeues prefetched messages
             yield data
 
     def send_log(self, msg=None, facility=None, severity=None, hostname=None, appname=None, procid=None, msgid=None, **kwargs):
@@ -7,47 +7,150 @@ dependencies:
 """
 
 import os
+import re
 import sys
 import json
 import gzip
 import subprocess
 from collections import defaultdict
 
+import requests
 import zeep
+import zeep.cache
+import zeep.exceptions
+import zeep.transports
 from orderedattrdict import AttrDict
 
 sys.path.insert(0, "/opt")
 import ablib.utils as abutils
+from lib.device_model import Interface, Address
 
 CONFIG_FILE = "/etc/factum/factum.yaml"       # Used during functional test
 BECS_CACHE_FILE = "/var/lib/factum/becs-cache.json.gz"
+BECS_WSDL_CACHE_FILE = "/var/lib/factum/becs-wsdl-cache.sqlite3"
+BECS_SESSION_FILE = "/var/lib/factum/becs-session.json"
+BECS_WSDL_CACHE_TIMEOUT = 86400     # seconds, WSDL is refetched after this time
+BECS_CUSTOMER_CLASSES = ["service"] # object classes counted as customers below an element
+
+# Faults meaning the session is invalid or expired, only these are retried after a new login
+RE_SESSION_FAULT = re.compile(r"session|not logged in|login required|unauthori[sz]ed|authenticat", re.IGNORECASE)
 
 
 class BECS:
 
     def __init__(self, config=None):
         self.config = config
+        eapi = self.config.becs.eapi
+
+        # One pooled HTTP session for all SOAP calls, keep-alive between calls
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=eapi.get("pool_maxsize", 10),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        # Cache the WSDL and XSD documents on disk, avoids downloading them on each start
+        try:
+            cache = zeep.cache.SqliteCache(
+                path=eapi.get("wsdl_cache_file", BECS_WSDL_CACHE_FILE),
+                timeout=eapi.get("wsdl_cache_timeout", BECS_WSDL_CACHE_TIMEOUT),
+            )
+        except (OSError, RuntimeError) as err:
+            print(f"Warning: BECS, cannot use WSDL cache, err {err}")
+            cache = None
+        transport = zeep.transports.Transport(session=session, cache=cache)
+
         self.client = zeep.Client(
-            wsdl=self.config.becs.eapi.url,
+            wsdl=eapi.url,
+            transport=transport,
             settings=zeep.Settings(strict=False)
         )
 
         self.obj_cache = {}            # key is oid, value is object
         self.elements_oid = {}         # key is oid, value is object
+        self.customer_count = {}       # key is oid, value is number of customers below object
+        self.session = None
+        self._soapheaders = None
+        self.session_reuse = eapi.get("session_reuse", True)
+        self.session_file = eapi.get("session_file", BECS_SESSION_FILE)
         self.login()
 
-    def login(self):
+    def login(self, force: bool = False):
+        """
+        Login to BECS
+        If session reuse is enabled, a previously stored sessionid is used.
+        The sessionid is validated on first call, see call()
+        """
+        if not force and self.session_reuse:
+            sessionid = self._load_sessionid()
+            if sessionid:
+                self._set_sessionid(sessionid)
+                return
+
         self.session = self.client.service.sessionLogin({
             "username": self.config.becs.eapi.username,
             "password": self.config.becs.eapi.password,
             })
-        self._soapheaders = {
-            "request": {"sessionid": self.session["sessionid"]},
-        }
+        self._set_sessionid(self.session["sessionid"])
+        if self.session_reuse:
+            self._save_sessionid(self.session["sessionid"])
 
     def logout(self):
+        """
+        Logout from BECS
+        If session reuse is enabled, the session is kept open for the next tool run
+        """
+        if self.session_reuse:
+            return
         self.client.service.sessionLogout({}, _soapheaders=self._soapheaders)
 
+    def _set_sessionid(self, sessionid: str):
+        self._soapheaders = {
+            "request": {"sessionid": sessionid},
+        }
+
+    def _load_sessionid(self):
+        try:
+            with open(self.session_file, "r") as f:
+                data = json.load(f)
+            if data.get("url") == self.config.becs.eapi.url:
+                return data.get("sessionid")
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _save_sessionid(self, sessionid: str):
+        try:
+            with open(self.session_file, "w") as f:
+                json.dump({"url": self.config.becs.eapi.url, "sessionid": sessionid}, f)
+            os.chmod(self.session_file, 0o600)
+        except OSError as err:
+            print(f"Warning: BECS, cannot save session, err {err}")
+
+    def is_session_fault(self, err: zeep.exceptions.Fault) -> bool:
+        """
+        True if the fault code or message says the session is invalid or expired
+        """
+        return any(RE_SESSION_FAULT.search(str(text)) for text in (err.code, err.message) if text)
+
+    def call(self, method: str, *args, **kwargs):
+        """
+        Call a BECS ExtAPI method, using current session
+        If the session is invalid or has expired, login and retry once
+        Other faults are raised unchanged
+        """
+        func = getattr(self.client.service, method)
+        try:
+            return func(*args, _soapheaders=self._soapheaders, **kwargs)
+        except zeep.exceptions.Fault as err:
+            if not self.is_session_fault(err):
+                raise
+            print(f"BECS, call {method} failed, err '{err}', login and retry")
+            self.login(force=True)
+            return func(*args, _soapheaders=self._soapheaders, **kwargs)
+
     def get_object(self, oid):
         """
         Fetch one object, using a cache
@@ -56,13 +159,13 @@ class BECS:
         if oid in self.obj_cache:
             return self.obj_cache[oid]  # From cache
 
-        data = self.client.service.objectFind(
+        data = self.call(
+            "objectFind",
             {
                 "queries": [
                     {"queries": {"oid": oid}}
                 ] 
             },
-            _soapheaders=self._soapheaders
         )
         # print(f"Fetch object {oid} from BECS API")
         # abutils.pprint(data["objects"][0])
@@ -194,6 +297,10 @@ class BECS:
             if parent:
                 parent._childrenoid.append(oid)
 
+        # Count customers below each element, one bottom-up pass over the tree
+        print("----- BECS, count customers below each element -----")
+        self.count_customers()
+
         # Build up dictionary, to easy get get/handle parent/child relations
         # make sure name is FQDN
         print("----- BECS, build dictionary with elements -----")
@@ -201,6 +308,7 @@ class BECS:
             if element["class"] == "element-attach":
                 if element.elementtype == "ibos":
                     element.name = element.name.lower()
+                    element["_customer_count"] = self.customer_count.get(element.oid, 0)
                     self.elements_oid[element.oid] = element
 
         # For each element
@@ -227,6 +335,31 @@ class BECS:
 
         return self.elements_oid
 
+    def count_customers(self) -> None:
+        """
+        Count customer objects below every object in the object cache
+        Children are visited before their parent, so each object is summed once
+        Result in self.customer_count, key is oid, value is number of customers
+        below the object, including objects below child elements
+        """
+        classes = set(self.config.becs.get("customer_classes", BECS_CUSTOMER_CLASSES))
+        self.customer_count = {}
+        roots = [oid for oid, obj in self.obj_cache.items() if obj.parentoid not in self.obj_cache]
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                oid, visited = stack.pop()
+                obj = self.obj_cache[oid]
+                if not visited:
+                    stack.append((oid, True))
+                    for childoid in obj._childrenoid:
+                        stack.append((childoid, False))
+                    continue
+                count = 1 if obj["class"] in classes else 0
+                for childoid in obj._childrenoid:
+                    count += self.customer_count[childoid]
+                self.customer_count[oid] = count
+
     def get_rcparentoid(self, obj):
         rcparentoid = obj.resource.rcparentoid
         if rcparentoid:
@@ -237,12 +370,12 @@ class BECS:
     def get_interfaces(self, oid: int = None):
         """
         Get interfaces and their IP addresses for an element-attach
-        Returns a list of interface, each interface is an AttrDict
+        Returns a dict of interfaces, key is interface name
         """
         
         # data = self.object_tree_find(obj, walkdown=2, classmask={"interface":1, "resource-inet":1})
         data = self.object_tree_find(oid, walkdown=2)
-        res = AttrDict()  # Key is interace.name
+        res = {}  # Key is interace.name
 
         # Get IP address for each interface
         # todo: flag, use parentprefixlen
@@ -268,18 +401,19 @@ class BECS:
                                 prefixlen = rcobj.resource.prefixlen
 
                         prefix = f"{obj.resource.address}/{prefixlen}"
-                        addr = AttrDict(
+                        addr = Address(
                             address=prefix,
                             oid=obj.oid)
                         prefix4.append(addr)
 
-                d = AttrDict()
-                d.oid = interface["oid"]
-                d.name = interface["name"]
-                d.role = interface["role"]
-                d.prefix4 = prefix4
-                d.prefix6 = prefix6
-                d.enabled = enabled
+                d = Interface(
+                    oid=interface["oid"],
+                    name=interface["name"],
+                    role=interface["role"],
+                    prefix4=prefix4,
+                    prefix6=prefix6,
+                    enabled=enabled,
+                )
                 res[d.name] = d
         return res
 
@@ -309,7 +443,7 @@ if __name__ == "__main__":
     if args.cmd == "get_elements":
         elements = becs.get_elements(oid=args.oid, refresh=args.refresh)
         for oid, element in elements.items():
-            print(element.name)
+            print(element.name, "customers", element._customer_count)
             interfaces = becs.get_interfaces(oid=oid)
             for ifname, interface in interfaces.items():
                 if interface.prefix4:
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Compliance check, NetBox intent vs configuration backup
+
+For each device, the interfaces in the device cache (intent) are compared
+with the interfaces parsed from the last oxidized configuration backup:
+
+    missing     interface in NetBox, not in configuration
+    enabled     enabled state differs
+    address     address in NetBox, not on the interface in configuration
+    extra       address in configuration, not in NetBox
+
+Configurations are fetched concurrently in threads, and compared in a pool
+of worker processes as they arrive. A device is only fetched again if the
+oxidized mtime changed, and only compared again if the configuration or
+the intent changed, otherwise the stored result is kept.
+
+Results are stored per device in the Compliance table, one row per device,
+and shown in the device view.
+"""
+
+import json
+import hashlib
+import ipaddress
+import concurrent.futures
+from typing import Dict
+
+from django.db import transaction
+from django.utils import timezone
+
+from lib.config_parser import Config_Parser
+from lib.inventory import Inventory
+
+STATUS_OK = "ok"
+STATUS_MISMATCH = "mismatch"
+STATUS_NO_CONFIG = "no_config"
+
+config_parser = Config_Parser()
+
+
+def normalize_address(address: str) -> str:
+    try:
+        return ipaddress.ip_interface(address).with_prefixlen
+    except ValueError:
+        return address
+
+
+def is_link_local(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_interface(address).ip
+    except ValueError:
+        return False
+    return ip.version == 6 and ip.is_link_local
+
+
+def get_intent(device) -> Dict:
+    """
+    Extract intent from a cached device, as plain dicts so it can be sent to a worker process
+    returns dict, key is interface name, value is dict with enabled and addresses
+    """
+    intent = {}
+    for ifname, interface in (device.get("interfaces", None) or {}).items():
+        addresses = []
+        for key in ("prefix4", "prefix6"):
+            for address in interface.get(key, None) or []:
+                if address.get("address", None):
+                    addresses.append(address["address"])
+        intent[ifname] = dict(enabled=interface.get("enabled", None), addresses=sorted(addresses))
+    return intent
+
+
+def get_intent_hash(intent: Dict) -> str:
+    return hashlib.sha256(json.dumps(intent, sort_keys=True).encode()).hexdigest()
+
+
+def check_device(name: str, intent: Dict, conf: str) -> Dict:
+    """
+    Compare intent with configuration, runs in a worker process
+    returns dict with
+        errors       number of differences
+        interfaces   dict, key is interface name, value is dict with intent, config and errors
+    """
+    parsed = config_parser.parse_interfaces(conf)
+    parsed_lower = {ifname.lower(): interface for ifname, interface in parsed.items()}
+    interfaces = {}
+    for ifname, want in intent.items():
+        have = parsed_lower.get(ifname.lower(), None)
+        result = dict(enabled=want["enabled"], addresses=want["addresses"],
+                      config_enabled=None, config_addresses=[], errors=[])
+        interfaces[ifname] = result
+        if have is None:
+            if want["enabled"] or want["addresses"]:
+                result["errors"].append("Missing in configuration")
+            continue
+        result["config_enabled"] = have["enabled"]
+        result["config_addresses"] = have["addresses"]
+        if want["enabled"] is not None and want["enabled"] != have["enabled"]:
+            result["errors"].append("Enabled in NetBox, shutdown in configuration" if want["enabled"]
+                                    else "Disabled in NetBox, enabled in configuration")
+        want_addresses = set(normalize_address(a) for a in want["addresses"])
+        # IPv6 link-local addresses are only configured on the device
+        have_addresses = set(normalize_address(a) for a in have["addresses"] if not is_link_local(a))
+        for address in sorted(want_addresses - have_addresses):
+            result["errors"].append(f"Address {address} missing in configuration")
+        for address in sorted(have_addresses - want_addresses):
+            result["errors"].append(f"Address {address} not in NetBox")
+
+    # Interfaces with addresses in configuration, not in NetBox. Juniper units are
+    # accepted if the physical interface is in NetBox
+    intent_lower = set(ifname.lower() for ifname in intent)
+    for ifname, have in parsed.items():
+        if not any(not is_link_local(a) for a in have["addresses"]) or ifname.lower() in intent_lower or \
+                ifname.split(".", 1)[0].lower() in intent_lower:
+            continue
+        interfaces[ifname] = dict(enabled=None, addresses=[],
+                                  config_enabled=have["enabled"], config_addresses=have["addresses"],
+                                  errors=["Not in NetBox"])
+    errors = sum(len(result["errors"]) for result in interfaces.values())
+    return dict(errors=errors, interfaces=interfaces)
+
+
+class Compliance_Checker:
+
+    def __init__(self, compliance_cls=None, oxidized=None, jobs: int = None, fetch_jobs: int = 10):
+        """
+        compliance_cls is the Compliance model
+        oxidized is an Oxidized or Config_Mirror instance
+        """
+        self.compliance_cls = compliance_cls
+        self.oxidized = oxidized
+        self.jobs = jobs
+        self.fetch_jobs = fetch_jobs
+
+    def get_mtimes(self) -> Dict:
+        """
+        returns dict, key is hostname, value is mtime. Empty if oxidized can't tell
+        """
+        try:
+            nodes = self.oxidized.get_nodes()
+        except Exception as err:
+            print(f"Warning: Cannot get node list from oxidized, err {err}")
+            return {}
+        mtimes = {}
+        for name, node in nodes.items():
+            mtime = node.get("mtime", None)
+            if mtime and mtime != "unknown":
+                mtimes[name] = str(mtime)
+        return mtimes
+
+    def get_devices(self, devices: Dict) -> Dict:
+        """
+        Devices to check, enabled and with configuration backup
+        """
+        inventory = Inventory(devices)
+        return inventory.select(inventory.true("enabled") & ~inventory.false("backup_oxidized"))
+
+    def run(self, devices: Dict, refresh: bool = False) -> Dict:
+        """
+        Check all devices, store results
+        refresh, fetch and check all devices, ignoring stored results
+        returns dict, key is status, value is number of devices
+        """
+        devices = self.get_devices(devices)
+        stored = {c.name: c for c in self.compliance_cls.objects.filter(name__in=list(devices))}
+        mtimes = self.get_mtimes()
+
+        intents = {}
+        fetch_names = []
+        results = {}        # name -> Compliance, changed or new
+        for name, device in devices.items():
+            intent = get_intent(device)
+            intent_hash = get_intent_hash(intent)
+            intents[name] = (intent, intent_hash)
+            entry = stored.get(name, None)
+            mtime = mtimes.get(name, None)
+            if not refresh and entry and mtime and entry.status != STATUS_NO_CONFIG and \
+                    entry.config_mtime == mtime and entry.intent_hash == intent_hash:
+                continue    # Unchanged, keep stored result
+            fetch_names.append(name)
+
+        checks = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.fetch_jobs) as fetcher:
+            fetches = {fetcher.submit(self.oxidized.get_device_config, name): name for name in fetch_names}
+            for fetch in concurrent.futures.as_completed(fetches):
+                name = fetches[fetch]
+                intent, intent_hash = intents[name]
+                entry = stored.get(name, None) or self.compliance_cls(name=name)
+                unchanged_intent = not refresh and entry.pk is not None and entry.intent_hash == intent_hash
+                entry.config_mtime = mtimes.get(name, "")
+                entry.intent_hash = intent_hash
+                results[name] = entry
+                conf = fetch.result()
+                if conf is None:
+                    # No mtime, so the next run fetches again, the error may be transient
+                    entry.config_mtime = ""
+                    entry.status = STATUS_NO_CONFIG
+                    entry.errors = 0
+                    entry.config_hash = ""
+                    entry.data = ""
+                    entry.timestamp = timezone.now()
+                    continue
+                config_hash = hashlib.sha256(conf.encode()).hexdigest()
+                if unchanged_intent and entry.status != STATUS_NO_CONFIG and entry.config_hash == config_hash:
+                    continue    # Only mtime changed, keep result
+                entry.config_hash = config_hash
+                checks[name] = executor.submit(check_device, name, intent, conf)
+
+            for name, future in checks.items():
+                entry = results[name]
+                result = future.result()
+                entry.status = STATUS_MISMATCH if result["errors"] else STATUS_OK
+                entry.errors = result["errors"]
+                entry.data = json.dumps(result["interfaces"])
+                entry.timestamp = timezone.now()
+
+        self.save(results, devices)
+        print(f"{len(devices)} devices, fetched {len(fetch_names)}, checked {len(checks)}")
+
+        status = {}
+        for s in self.compliance_cls.objects.values_list("status", flat=True):
+            status[s] = status.get(s, 0) + 1
+        return status
+
+    def save(self, results: Dict, devices: Dict) -> None:
+        """
+        Store changed results, remove results for devices no longer checked
+        """
+        fields = ["timestamp", "status", "errors", "config_mtime", "config_hash", "intent_hash", "data"]
+        with transaction.atomic():
+            self.compliance_cls.objects.exclude(name__in=list(devices)).delete()
+            self.compliance_cls.objects.bulk_create([e for e in results.values() if not e.pk], batch_size=500)
+            self.compliance_cls.objects.bulk_update([e for e in results.values() if e.pk], fields, batch_size=500)
+
+
+def get_result(compliance_cls, name: str):
+    """
+    Get stored result for a device
+    returns (Compliance, interfaces dict), (None, {}) if never checked
+    """
+    entry = compliance_cls.objects.filter(name=name).first()
+    if entry is None:
+        return None, {}
+    interfaces = json.loads(entry.data) if entry.data else {}
+    return entry, interfaces
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Local mirror of the oxidized configuration backups, with a search index
+
+The mirror is a clone of the oxidized git output repository, updated with
+git pull. Configurations are read with mmap, one file per node, the file
+name is the node name. Nodes in groups are stored in a subdirectory per group.
+
+The index is a trigram index, for each three byte sequence (lowercase) a
+sorted list of the configurations containing it. The index is case
+insensitive, so it serves both case sensitive and insensitive searches. A search for a text looks
+up the trigrams of the text, intersects the lists, and only the remaining
+configurations are read to verify and find the matching lines.
+
+The index is rebuilt by build_index() when the mirror HEAD changes, only
+from "config_mirror.py update", and stored on disk. Searches, for example
+in the web API worker processes, only load the stored index, and reload it
+when the file changes.
+
+Config_Mirror has get_nodes() and get_device_config() with the same
+signatures as lib.oxidized.Oxidized, so it can be used instead of it.
+The "mtime" of a node is the git blob id, changes when the config changes.
+
+dependencies:
+    apt install git
+    sudo pip3 install numpy
+"""
+
+import os
+import re
+import mmap
+import subprocess
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+MIRROR_DIR = "/var/lib/factum/oxidized-mirror"
+INDEX_FILE = "/var/lib/factum/oxidized-mirror-index.npz"
+INDEX_VERSION = 1
+MAX_LINES = 20          # matching lines returned per configuration
+
+
+class Config_Mirror_Error(Exception):
+    pass
+
+
+def get_trigrams(data) -> np.ndarray:
+    """
+    returns sorted unique trigrams in data, lowercase, each trigram as uint32
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    if len(b) < 3:
+        return np.zeros(0, dtype=np.uint32)
+    b = b.copy()
+    upper = (b >= 0x41) & (b <= 0x5a)
+    b[upper] += 0x20
+    b = b.astype(np.uint32)
+    return np.unique((b[:-2] << 16) | (b[1:-1] << 8) | b[2:])
+
+
+class Config_Index:
+    """
+    Trigram index, posting lists stored as one array of doc numbers
+    keys[i] is a trigram, docs[offsets[i]:offsets[i+1]] are the docs containing it
+    """
+
+    def __init__(self):
+        self.head = None
+        self.names = []
+        self.keys = np.zeros(0, dtype=np.uint32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int32)
+
+    def build(self, head: str, docs: Iterable[Tuple[str, bytes]]) -> None:
+        self.head = head
+        self.names = []
+        keys = []
+        doc_ids = []
+        for name, data in docs:
+            trigrams = get_trigrams(data)
+            keys.append(trigrams)
+            doc_ids.append(np.full(len(trigrams), len(self.names), dtype=np.int32))
+            self.names.append(name)
+        if not keys:
+            self.__init__()
+            self.head = head
+            return
+        keys = np.concatenate(keys)
+        doc_ids = np.concatenate(doc_ids)
+        order = np.argsort(keys, kind="stable")    # docs stay sorted within each key
+        keys = keys[order]
+        self.docs = doc_ids[order]
+        self.keys, starts = np.unique(keys, return_index=True)
+        self.offsets = np.append(starts, len(keys)).astype(np.int64)
+
+    def candidates(self, text: str) -> List[str]:
+        """
+        Names of configurations that may contain text, case insensitive
+        """
+        trigrams = get_trigrams(text.encode())
+        if len(trigrams) == 0:
+            return list(self.names)
+        result = None
+        for trigram in trigrams:
+            ix = np.searchsorted(self.keys, trigram)
+            if ix >= len(self.keys) or self.keys[ix] != trigram:
+                return []
+            docs = self.docs[self.offsets[ix]:self.offsets[ix + 1]]
+            result = docs if result is None else np.intersect1d(result, docs, assume_unique=True)
+            if len(result) == 0:
+                return []
+        return [self.names[ix] for ix in result]
+
+    def save(self, filename: str) -> None:
+        tmp = f"{filename}.{os.getpid()}.tmp.npz"    # per process, concurrent saves can't clobber each other
+        np.savez(tmp, version=INDEX_VERSION, head=self.head, names=np.array(self.names, dtype=str),
+                 keys=self.keys, offsets=self.offsets, docs=self.docs)
+        os.replace(tmp, filename)
+
+    def load(self, filename: str) -> bool:
+        """
+        returns True if index was loaded
+        """
+        try:
+            with np.load(filename) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    return False
+                self.head = str(data["head"])
+                self.names = [str(name) for name in data["names"]]
+                self.keys = data["keys"]
+                self.offsets = data["offsets"]
+                self.docs = data["docs"]
+            return True
+        except (OSError, KeyError, ValueError):
+            return False
+
+
+class Config_Mirror:
+
+    def __init__(self, config=None):
+        self.config = config
+        self.remote = config.remote
+        self.dir = config.get("dir", MIRROR_DIR)
+        self.index_file = config.get("index_file", INDEX_FILE)
+        self.index = None
+        self.index_mtime = None
+        self._files = None
+
+    def git(self, *args) -> str:
+        try:
+            p = subprocess.run(["git", "-C", self.dir] + list(args), capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as err:
+            raise Config_Mirror_Error(f"git {' '.join(args)}, err {err.stderr.strip()}")
+        return p.stdout
+
+    def update(self) -> bool:
+        """
+        Clone or pull the oxidized repository
+        returns True if the mirror changed
+        """
+        if not os.path.exists(os.path.join(self.dir, ".git")):
+            try:
+                subprocess.run(["git", "clone", "--quiet", self.remote, self.dir],
+                               capture_output=True, text=True, check=True)
+            except subprocess.CalledProcessError as err:
+                raise Config_Mirror_Error(f"git clone {self.remote}, err {err.stderr.strip()}")
+            self._files = None
+            return True
+        head = self.head()
+        self.git("pull", "--quiet", "--ff-only")
+        if self.head() != head:
+            self._files = None
+            return True
+        return False
+
+    def head(self) -> str:
+        return self.git("rev-parse", "HEAD").strip()
+
+    def get_files(self) -> Dict[str, str]:
+        """
+        returns dict, key is node name, value is file path
+        """
+        if self._files is None:
+            # Build complete dict before it is visible, get_files() is called from fetch threads
+            found = {}
+            for root, dirs, files in os.walk(self.dir):
+                dirs[:] = [d for d in dirs if d != ".git"]
+                for filename in files:
+                    found[filename] = os.path.join(root, filename)
+            self._files = found
+        return self._files
+
+    def read(self, name: str) -> bytes:
+        """
+        Read configuration, returns None if node does not exist
+        """
+        path = self.get_files().get(name, None)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m[:]
+
+    def get_nodes(self) -> Dict:
+        """
+        Same as Oxidized.get_nodes(), mtime is the git blob id
+        """
+        nodes = {}
+        for line in self.git("ls-tree", "-r", "HEAD").splitlines():
+            info, path = line.split("\t", 1)
+            name = os.path.basename(path)
+            nodes[name] = {"name": name, "mtime": info.split()[2]}
+        return nodes
+
+    def get_device_config(self, name: str):
+        """
+        Same as Oxidized.get_device_config()
+        """
+        data = self.read(name)
+        if data is None:
+            return None
+        return data.decode(errors="replace")
+
+    def build_index(self, rebuild: bool = False) -> Config_Index:
+        """
+        returns index, rebuilt and saved if the mirror has changed since it was built
+        """
+        head = self.head()
+        index = Config_Index()
+        if rebuild or not index.load(self.index_file) or index.head != head:
+            self._files = None
+            index.build(head, ((name, self.read(name)) for name in sorted(self.get_files())))
+            index.save(self.index_file)
+        self.index = index
+        return index
+
+    def get_index(self) -> Config_Index:
+        """
+        returns stored index, reloaded if the index file has changed
+        """
+        try:
+            mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            raise Config_Mirror_Error(f"No search index {self.index_file}, run config_mirror.py update")
+        if self.index is None or mtime != self.index_mtime:
+            index = Config_Index()
+            if not index.load(self.index_file):
+                raise Config_Mirror_Error(f"Cannot load search index {self.index_file}")
+            self.index = index
+            self.index_mtime = mtime
+            self._files = None      # mirror was updated with the index
+        return self.index
+
+    def search(self, text: str, ignore_case: bool = False, max_lines: int = MAX_LINES) -> List[Dict]:
+        """
+        Find configurations containing text
+        returns list of {name, lines}, lines is list of (line number, line)
+        """
+        needle = text.encode()
+        regex = re.compile(re.escape(needle), re.IGNORECASE) if ignore_case else None
+        result = []
+        for name in self.get_index().candidates(text):
+            path = self.get_files().get(name, None)
+            if path is None or os.path.getsize(path) == 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                lines = []
+                pos = 0
+                while len(lines) < max_lines:
+                    if regex:
+                        m = regex.search(data, pos)
+                        if m is None:
+                            break
+                        start, pos = m.start(), m.end()
+                    else:
+                        start = data.find(needle, pos)
+                        if start < 0:
+                            break
+                        pos = start + len(needle)
+                    line_start = data.rfind(b"\n", 0, start) + 1
+                    line_end = data.find(b"\n", pos)
+                    if line_end < 0:
+                        line_end = len(data)
+                    lineno = data[:line_start].count(b"\n") + 1
+                    if not lines or lines[-1][0] != lineno:
+                        lines.append((lineno, data[line_start:line_end].decode(errors="replace").rstrip("\r")))
+            if lines:
+                result.append({"name": name, "lines": lines})
+        return result
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Parse router/switch configurations, extract interfaces and their IP addresses
+
+The configuration is read line by line from the buffer, each line is matched
+against a small set of precompiled patterns for the configuration dialect.
+Addresses are validated without creating ipaddress objects.
+
+Dialects:
+    block   Cisco IOS, IOS-XR, Huawei VRP
+            "interface <name>" followed by its lines, ends with "!", "#", empty line
+            or the next "interface <name>"
+            " ip address <addr> <mask>", " ipv4 address <addr> <mask>", " ipv6 address <addr>/<len>"
+    set     Juniper, "display set" format
+            "set interfaces <name> unit <unit> family inet|inet6 address <addr>/<len>"
+
+parse() returns DNS records, first address per interface.
+parse_interfaces() returns all interfaces with their enabled state and all
+addresses in <addr>/<len> format, used by the compliance check.
+"""
+
+import io
+import re
+import socket
+import struct
+from typing import Dict, List, Tuple
+
+RE_IPV4 = re.compile(r"(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(?:\.(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}\Z")
+
+RE_BLOCK_INTERFACE = re.compile(r"interface (.+)")
+RE_BLOCK_ADDRESS = re.compile(r"\s*(ip|ipv4|ipv6) address ([^ /\r\n]*)")
+
+RE_SET_ADDRESS = re.compile(r"set interfaces (\S+) unit (\d+) family (inet6?) address ([^ /\r\n]*)")
+
+# Used by parse_interfaces(), also captures prefix length or netmask, and link-local/eui-64 keyword
+RE_BLOCK_PREFIX = re.compile(r"\s*(ip|ipv4|ipv6) address ([^ /\r\n]+)(?:/(\d+)| +(\d+\.\d+\.\d+\.\d+))?"
+                             r"(?: +(link-local|eui-64))?")
+RE_BLOCK_SHUTDOWN = re.compile(r"\s*((?:no |undo )?)shutdown\s*$")
+RE_SET_INTERFACE = re.compile(r"set interfaces (\S+) (?:unit (\d+) )?(disable|family (inet6?) address ([^ /\r\n]+)(?:/(\d+))?)")
+
+# IPv4 netmask -> prefix length
+NETMASK_LEN = {socket.inet_ntoa(struct.pack(">I", (0xffffffff << (32 - n)) & 0xffffffff)): n for n in range(33)}
+
+# Address keyword/family in config -> record type
+RECORD_TYPE = {
+    "ip": "A",
+    "ipv4": "A",
+    "ipv6": "AAAA",
+    "inet": "A",
+    "inet6": "AAAA",
+}
+
+
+def ifname_to_dnsname(hostname: str, ifname: str) -> str:
+    hostname = hostname.split(".")[0]
+    name = f"{hostname}.{ifname}"
+    name = name.replace("/", "-").replace(" ", "")
+    return name
+
+
+def valid_address(type_: str, addr: str) -> bool:
+    if type_ == "A":
+        return RE_IPV4.match(addr) is not None
+    try:
+        socket.inet_pton(socket.AF_INET6, addr)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+class Config_Parser:
+    """
+    Parse a router/switch config
+    Try to handle different vendors syntax; cisco, huawei, juniper etc
+    Extract all interfaces and their IP addresses
+    returns a list of records, each record is a tuple (name, type, value)
+    If an interface has multiple addresses, the first one is used
+    """
+
+    def get_dialect(self, conf: str) -> str:
+        """
+        "set" if most lines are set commands, a few set lines in for example
+        a banner or description does not change the dialect
+        """
+        set_lines = conf.count("\nset ") + conf.startswith("set ")
+        lines = conf.count("\n") + 1
+        if set_lines * 2 > lines:
+            return "set"
+        return "block"
+
+    def parse(self, hostname: str, conf: str) -> List[Tuple[str, str, str]]:
+        if self.get_dialect(conf) == "set":
+            return self.parse_set(hostname, conf)
+        return self.parse_block(hostname, conf)
+
+    def _add(self, records: List, names: set, name: str, keyword: str, addr: str) -> None:
+        if name in names:
+            return
+        type_ = RECORD_TYPE[keyword]
+        if valid_address(type_, addr):
+            names.add(name)
+            records.append((name, type_, addr))
+        else:
+            print(f"Error: host '{name}' , incorrect '{keyword} address' '{addr}'")
+
+    def parse_block(self, hostname: str, conf: str) -> List[Tuple[str, str, str]]:
+        records = []
+        names = set()
+        name = None     # DNS name of current interface, None if outside interface block
+        for line in io.StringIO(conf):
+            if name is None:
+                m = RE_BLOCK_INTERFACE.match(line)
+                if m:
+                    name = ifname_to_dnsname(hostname, m.group(1).rstrip().lower())
+                continue
+
+            c = line[:1]
+            if c in ("!", "#", "\n", "\r", ""):
+                name = None     # end of this interface config
+                continue
+            if c not in (" ", "\t"):
+                # Unindented line, a new interface starts a new block, other lines belong to this one
+                m = RE_BLOCK_INTERFACE.match(line)
+                if m:
+                    name = ifname_to_dnsname(hostname, m.group(1).rstrip().lower())
+                    continue
+
+            m = RE_BLOCK_ADDRESS.match(line)
+            if m:
+                self._add(records, names, name, m.group(1), m.group(2))
+        return records
+
+    def parse_set(self, hostname: str, conf: str) -> List[Tuple[str, str, str]]:
+        records = []
+        names = set()
+        for line in io.StringIO(conf):
+            if not line.startswith("set interfaces "):
+                continue
+            m = RE_SET_ADDRESS.match(line)
+            if m:
+                ifname = f"{m.group(1)}.{m.group(2)}".lower()
+                name = ifname_to_dnsname(hostname, ifname)
+                self._add(records, names, name, m.group(3), m.group(4))
+        return records
+
+    def parse_interfaces(self, conf: str) -> Dict[str, Dict]:
+        """
+        Extract all interfaces, their enabled state and addresses
+        returns dict, key is interface name as in config, value is dict with
+            enabled     False if shut down/disabled
+            addresses   list of "<addr>/<len>", IPv4 and IPv6
+        Juniper units are returned as <name>.<unit>, addresses on unit 0
+        are also added to the physical interface
+        """
+        if self.get_dialect(conf) == "set":
+            return self.parse_interfaces_set(conf)
+        return self.parse_interfaces_block(conf)
+
+    def parse_interfaces_block(self, conf: str) -> Dict[str, Dict]:
+        interfaces = {}
+        interface = None    # current interface, None if outside interface block
+        for line in io.StringIO(conf):
+            c = line[:1]
+            if c not in (" ", "\t"):
+                # Unindented line, a new interface starts a new block, other lines belong to this one
+                m = RE_BLOCK_INTERFACE.match(line)
+                if m:
+                    interface = interfaces.setdefault(m.group(1).rstrip(), dict(enabled=True, addresses=[]))
+                    continue
+            if interface is None:
+                continue
+            if c in ("!", "#", "\n", "\r", ""):
+                interface = None    # end of this interface config
+                continue
+
+            m = RE_BLOCK_SHUTDOWN.match(line)
+            if m:
+                interface["enabled"] = m.group(1) != ""
+                continue
+            m = RE_BLOCK_PREFIX.match(line)
+            if m:
+                keyword, addr, length, netmask, option = m.groups()
+                if option or not valid_address(RECORD_TYPE[keyword], addr):
+                    continue    # link-local and eui-64 addresses are not in NetBox
+                if netmask is not None:
+                    length = NETMASK_LEN.get(netmask, None)
+                if length is None:
+                    length = 32 if RECORD_TYPE[keyword] == "A" else 128
+                interface["addresses"].append(f"{addr}/{length}")
+        return interfaces
+
+    def parse_interfaces_set(self, conf: str) -> Dict[str, Dict]:
+        interfaces = {}
+        disabled = set()
+        for line in io.StringIO(conf):
+            if not line.startswith("set interfaces "):
+                continue
+            m = RE_SET_INTERFACE.match(line)
+            if not m:
+                continue
+            ifname, unit, action, family, addr, length = m.groups()
+            names = [ifname]
+            if unit is not None:
+                names = [f"{ifname}.{unit}", ifname] if unit == "0" else [f"{ifname}.{unit}"]
+            for name in names:
+                interfaces.setdefault(name, dict(enabled=True, addresses=[]))
+            if action == "disable":
+                disabled.add(names[0])
+                continue
+            if not valid_address(RECORD_TYPE[family], addr):
+                continue
+            if length is None:
+                length = 32 if family == "inet" else 128
+            for name in names:
+                interfaces[name]["addresses"].append(f"{addr}/{length}")
+        for name, interface in interfaces.items():
+            # A disabled physical interface disables all its units
+            if name in disabled or name.split(".", 1)[0] in disabled:
+                interface["enabled"] = False
+        return interfaces
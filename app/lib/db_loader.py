@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Bulk load devices into the Device-API database tables
+
+Rows are built in memory. All rows from one source (field_src) are then
+replaced in one transaction, using a few DELETE and bulk INSERT statements.
+Parent rows are inserted first, and their primary keys, returned by the
+database sequence, are used as foreign keys in the child rows.
+
+Databases that can't return primary keys from a bulk insert (SQLite with
+Django 3.2) get explicit primary keys instead. This is safe there since the
+DELETE has taken the database write lock, no other insert can run.
+"""
+
+# python standard modules
+from typing import List
+
+# Modules installed with pip
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+# Assumes PYTHONPATH is set
+from base.models import Device, Parent, Tag, Interface, InterfaceTag
+
+
+class Bulk_Loader:
+    """
+    Collect Device, Parent, Tag, Interface and InterfaceTag rows for one source
+    and write them to the database with bulk_create()
+    """
+
+    models = [Device, Parent, Tag, Interface, InterfaceTag]
+
+    def __init__(self, src: str = "", batch_size: int = 1000):
+        self.src = src
+        self.batch_size = batch_size
+        self.rows = {model: [] for model in self.models}
+
+    def _add(self, model, **kwargs):
+        obj = model(field_src=self.src, **kwargs)
+        self.rows[model].append(obj)
+        return obj
+
+    def add_device(self, **kwargs) -> Device:
+        return self._add(Device, **kwargs)
+
+    def add_parent(self, device: Device, parent: str) -> Parent:
+        return self._add(Parent, device=device, parent=parent)
+
+    def add_tag(self, device: Device, tag: str) -> Tag:
+        return self._add(Tag, device=device, tag=tag)
+
+    def add_interface(self, device: Device, **kwargs) -> Interface:
+        return self._add(Interface, device=device, **kwargs)
+
+    def add_interface_tag(self, interface: Interface, tag: str) -> InterfaceTag:
+        return self._add(InterfaceTag, interface=interface, tag=tag)
+
+    def count(self, model) -> int:
+        return len(self.rows[model])
+
+    def _dedupe(self) -> None:
+        """
+        Device names are unique per source. NetBox can have a device and a
+        virtual machine with the same name, keep the first one added
+        """
+        seen = set()
+        dropped = set()
+        for device in self.rows[Device]:
+            if device.name in seen:
+                print(f"Warning: Duplicate device name '{device.name}', source {self.src}, ignoring duplicate")
+                dropped.add(id(device))
+            seen.add(device.name)
+        if not dropped:
+            return
+        self.rows[Device] = [obj for obj in self.rows[Device] if id(obj) not in dropped]
+        for model in [Parent, Tag, Interface]:
+            self.rows[model] = [obj for obj in self.rows[model] if id(obj.device) not in dropped]
+        interfaces = set(id(obj) for obj in self.rows[Interface])
+        self.rows[InterfaceTag] = [obj for obj in self.rows[InterfaceTag] if id(obj.interface) in interfaces]
+
+    def _delete(self, names: List[str] = None) -> None:
+        """
+        Delete existing rows, children first so each DELETE is a single statement
+        """
+        if names is None:
+            InterfaceTag.objects.filter(field_src=self.src).delete()
+            Interface.objects.filter(field_src=self.src).delete()
+            Tag.objects.filter(field_src=self.src).delete()
+            Parent.objects.filter(field_src=self.src).delete()
+            Device.objects.filter(field_src=self.src).delete()
+        else:
+            InterfaceTag.objects.filter(interface__device__name__in=names).delete()
+            Interface.objects.filter(device__name__in=names).delete()
+            Tag.objects.filter(device__name__in=names).delete()
+            Parent.objects.filter(device__name__in=names).delete()
+            Device.objects.filter(name__in=names).delete()
+
+    def _link(self, models) -> None:
+        """
+        Foreign keys was assigned before the parent object had an id
+        """
+        for model in models:
+            if model is InterfaceTag:
+                for obj in self.rows[model]:
+                    obj.interface_id = obj.interface.id
+            else:
+                for obj in self.rows[model]:
+                    obj.device_id = obj.device.id
+
+    def _assign_ids(self) -> None:
+        """
+        Give all new rows an explicit primary key
+        Only used when the database can't return primary keys from bulk_create()
+        """
+        for model in self.models:
+            next_id = (model.objects.aggregate(max_id=Max("id"))["max_id"] or 0) + 1
+            for obj in self.rows[model]:
+                obj.id = next_id
+                next_id += 1
+
+    def _reset_sequences(self) -> None:
+        """
+        Explicit ids bypass the database sequences, move them past the new rows
+        """
+        sql_list = connection.ops.sequence_reset_sql(no_style(), self.models)
+        if sql_list:
+            with connection.cursor() as cursor:
+                for sql in sql_list:
+                    cursor.execute(sql)
+
+    def save(self, names: List[str] = None) -> None:
+        """
+        Replace rows in database
+        If names is None, all rows from this source are replaced,
+        otherwise only the devices with these names
+        """
+        self._dedupe()
+        with transaction.atomic():
+            self._delete(names=names)
+            if connection.features.can_return_rows_from_bulk_insert:
+                # Primary keys from the sequence, parents before children
+                Device.objects.bulk_create(self.rows[Device], batch_size=self.batch_size)
+                for models in ([Parent, Tag, Interface], [InterfaceTag]):
+                    self._link(models)
+                    for model in models:
+                        model.objects.bulk_create(self.rows[model], batch_size=self.batch_size)
+            else:
+                self._assign_ids()
+                self._link([Parent, Tag, Interface, InterfaceTag])
+                for model in self.models:
+                    model.objects.bulk_create(self.rows[model], batch_size=self.batch_size)
+                self._reset_sequences()
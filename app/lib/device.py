@@ -7,16 +7,21 @@ Common functions for Netbox
 import os
 import sys
 import json
+from typing import List
 
 # Modules installed with pip
 from orderedattrdict import AttrDict
 from django.utils.text import slugify
 from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.forms.models import model_to_dict
 
 # Assumes PYTHONPATH is set
 import ablib.utils as abutils
 import lib.base_common as common
 from lib.netbox import Netbox
+import lib.device_model as device_model
 
 
 class Device_Cache:
@@ -30,7 +35,7 @@ class Device_Cache:
     def __init__(self, config=None, cache_cls=None):
         self.config = config
         self.cache_cls = cache_cls
-        self.devices = AttrDict()   # All devices, key is name, value is device data
+        self.devices = {}   # All devices, key is name, value is Device
         self.netbox = None
 
     def connect(self):
@@ -49,23 +54,33 @@ class Device_Cache:
             return self.devices     # Return copy from memory
 
         if name:
-            r = AttrDict()
+            r = {}
             n = common.Name(name)
-            c = self.cache_cls.objects.filter(name=n.long)
-            if not c:
+            data = self.cache_cls.objects.filter(name=n.long).values_list("data", flat=True).first()
+            if data is None:
                 return r
-            data = list(c.values())[0]["data"]
-            data = json.loads(data)
-            r[data["name"]] = data
+            device = device_model.Device.from_dict(json.loads(data))
+            r[device.name] = device
             return r
         else:
-            c = self.cache_cls.objects.filter(name="")
-            if not c:
+            data = self.cache_cls.objects.filter(name="").values_list("data", flat=True).first()
+            if data is None:
                 return None
-            data = list(c.values())[0]["data"]
-            data = json.loads(data, object_pairs_hook=AttrDict)
-            self.devices = data
-            return data
+            self.devices = device_model.devices_from_json(data)
+            return self.devices
+
+    def get_devices_json(self, name: str = None):
+        """
+        Get one or all devices from cache, as a JSON string, without decoding
+        Return None if nothing found
+        """
+        if name:
+            n = common.Name(name)
+            data = self.cache_cls.objects.filter(name=n.long).values_list("data", flat=True).first()
+            if data is None:
+                return "{}"
+            return '{%s: %s}' % (json.dumps(n.long), data)
+        return self.cache_cls.objects.filter(name="").values_list("data", flat=True).first()
 
     def get_device(self):
         pass
@@ -77,44 +92,81 @@ class Device_Cache:
         # self.connect()
         with transaction.atomic():
             self.cache_cls.objects.all().delete()
-            c = self.cache_cls(name="", data=json.dumps(devices))
+            c = self.cache_cls(name="", data=device_model.dumps(devices))
             c.save()
 
             for name, device in devices.items():
-                c = self.cache_cls(name=name, data=json.dumps(device))
+                c = self.cache_cls(name=name, data=device_model.dumps(device))
                 c.save()
 
     def save_device(self, name: str = None, device=None):
         """
         Save one device in cache
+        If device is None, the device is removed from the cache
         This can only be done if all devices already exist in cache
         """
         # self.connect()
         n = common.Name(name)
 
-        # ----- Update cache entry with all devices ------
-        # c = self.cache_cls.objects.filter(name="")
-        c = self.cache_cls.objects.get(name="")
-        if not c:
-            raise RuntimeError("Device cache, cannot update a device, all devices must exist in cache")
-        devices = json.loads(c.data)
-        devices[n.long] = device
-        c.data = json.dumps(devices)
-        c.save()
-
-        # ----- Update individual cache entry ------
-        c = self.cache_cls.objects.filter(name=n.long)
-        if not c:
-            c = self.cache_cls(name=n.long, data=json.dumps(device))
-        else:
-            c.data = json.dumps(device)
-        c.save()
+        with transaction.atomic():
+            # ----- Update cache entry with all devices ------
+            c = self.cache_cls.objects.filter(name="").first()
+            if not c:
+                raise RuntimeError("Device cache, cannot update a device, all devices must exist in cache")
+            devices = json.loads(c.data)
+            if device is None:
+                # Recreate the entry, a new id tells readers to reload all devices
+                devices.pop(n.long, None)
+                c.delete()
+                c = self.cache_cls(name="")
+            else:
+                devices[n.long] = device
+            c.data = device_model.dumps(devices)
+            c.timestamp = timezone.now()
+            c.save()
+
+            # ----- Update individual cache entry ------
+            if device is None:
+                self.cache_cls.objects.filter(name=n.long).delete()
+                return
+            c = self.cache_cls.objects.filter(name=n.long).first()
+            if not c:
+                c = self.cache_cls(name=n.long, data=device_model.dumps(device))
+            else:
+                c.data = device_model.dumps(device)
+                c.timestamp = timezone.now()
+            c.save()
+
+    def update_index(self, index) -> None:
+        """
+        Bring an index (IP_Index, Topology) up to date with the cache
+        If all devices has been saved, the index is rebuilt,
+        otherwise only devices changed since last update are reindexed
+        """
+        c = self.cache_cls.objects.filter(name="").values("id", "timestamp").first()
+        if c is None:
+            index.clear()
+            index.generation = None
+            return
+
+        if index.generation != c["id"]:
+            self.devices = {}
+            devices = self.get_devices()
+            index.build(devices)
+            index.generation = c["id"]
+            index.timestamp = self.cache_cls.objects.aggregate(Max("timestamp"))["timestamp__max"]
+            return
+
+        changed = self.cache_cls.objects.filter(timestamp__gt=index.timestamp).exclude(name="")
+        for c in changed.order_by("timestamp"):
+            index.update_device(c.name, device_model.Device.from_dict(json.loads(c.data)))
+            index.timestamp = c.timestamp
 
     def delete_devices(self):
         """
         Delete all devices in cache
         """
-        self.devices = AttrDict()
+        self.devices = {}
         self.cache_cls.objects.all().delete()
 
     def delete_device(self, device=None):
@@ -131,12 +183,63 @@ class Device_Cache:
         devices = self.netbox.get_devices(name=name, refresh=True)
         if name:
             n = common.Name(name)
-            self.save_device(name=n, device=devices)
+            self.save_device(name=n.long, device=devices.get(n.long, None))
         else:
             self.save_devices(devices)
         return devices
 
 
+class Device_Store:
+    """
+    Query the normalized device tables (Device, Parent, Tag, Interface, InterfaceTag)
+    All filters use indexed columns, related rows are fetched with prefetch_related()
+    """
+
+    def __init__(self, device_cls=None):
+        self.device_cls = device_cls
+
+    def query(self, name: str = None, role: str = None, tag: str = None, site: str = None,
+              parent: str = None, src: str = None) -> List:
+        """
+        Return list of devices matching all specified filters
+        """
+        qs = self.device_cls.objects.all()
+        if name:
+            qs = qs.filter(name=common.Name(name).long)
+        if role:
+            qs = qs.filter(role=role)
+        if site:
+            qs = qs.filter(site_name=site)
+        if src:
+            qs = qs.filter(field_src=src)
+        if tag:
+            qs = qs.filter(tag__tag=tag)
+        if parent:
+            qs = qs.filter(parent__parent=common.Name(parent).long)
+        if tag or parent:
+            qs = qs.distinct()
+        qs = qs.order_by("name").prefetch_related(
+            "parent_set",
+            "tag_set",
+            "interface_set__interfacetag_set",
+        )
+        return [self.to_dict(device) for device in qs]
+
+    def to_dict(self, device) -> AttrDict:
+        """
+        Assemble one device, with parents, tags and interfaces
+        """
+        d = AttrDict(model_to_dict(device, exclude=["id"]))
+        d.parents = [p.parent for p in device.parent_set.all()]
+        d.tags = [t.tag for t in device.tag_set.all()]
+        d.interfaces = AttrDict()
+        for interface in device.interface_set.all():
+            i = AttrDict(model_to_dict(interface, exclude=["id", "device"]))
+            i.tags = [t.tag for t in interface.interfacetag_set.all()]
+            d.interfaces[interface.name] = i
+        return d
+
+
 if __name__ == "__main__":
     """
     Function test
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Typed records for devices, interfaces and addresses
+
+Used by all layers instead of nested AttrDicts. Records use __slots__, so they
+are smaller and faster to build. Both attribute and dict style access works:
+
+    device.name, device["name"], device.get("name"), "name" in device
+
+Unset fields behave as missing keys, to_dict() only includes set fields so the
+JSON format of the device cache is unchanged.
+"""
+
+# python standard modules
+import json
+from typing import Dict
+
+
+class Record:
+    """
+    Base class, subclasses sets __slots__ = _fields = (...)
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key, default)
+        return default
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def keys(self):
+        return [key for key in self._fields if hasattr(self, key)]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        args = ", ".join(f"{key}={value!r}" for key, value in self.items())
+        return f"{self.__class__.__name__}({args})"
+
+    def to_dict(self) -> Dict:
+        """
+        Return a dict with all set fields, nested records are kept as is
+        Use with json.dumps(data, default=to_json)
+        """
+        d = {}
+        for key in self._fields:
+            try:
+                d[key] = getattr(self, key)
+            except AttributeError:
+                pass
+        return d
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        """
+        Create a record from a dict, unknown keys are ignored
+        """
+        obj = cls.__new__(cls)
+        fields = cls._fields
+        for key, value in data.items():
+            if key in fields:
+                setattr(obj, key, value)
+        return obj
+
+
+class Address(Record):
+    __slots__ = _fields = (
+        "address",
+        "id",
+        "oid",
+        "becs_oid",
+    )
+
+
+class Interface(Record):
+    __slots__ = _fields = (
+        "id",
+        "oid",
+        "becs_oid",
+        "enabled",
+        "name",
+        "prefix4",
+        "prefix6",
+        "role",
+        "tags",
+        "type_value",
+    )
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        obj = super().from_dict(data)
+        for key in ("prefix4", "prefix6"):
+            addresses = data.get(key, None)
+            if addresses:
+                setattr(obj, key, [Address.from_dict(a) for a in addresses])
+        return obj
+
+
+class Device(Record):
+    __slots__ = _fields = (
+        "id",
+        "oid",
+        "name",
+        "tags",
+        "manufacturer",
+        "model",
+        "comments",
+        "role",
+        "site_name",
+        "platform",
+        "primary_ip4",
+        "primary_ip6",
+        "enabled",
+        "location",
+        "alarm_timeperiod",
+        "alarm_destination",
+        "alarm_interfaces",
+        "connection_method",
+        "monitor_grafana",
+        "monitor_icinga",
+        "monitor_librenms",
+        "backup_oxidized",
+        "becs_oid",
+        "customer_count",
+        "parents",
+        "interfaces",
+        "interfaces_oid",
+    )
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        obj = super().from_dict(data)
+        for key in ("primary_ip4", "primary_ip6"):
+            address = data.get(key, None)
+            if address:
+                setattr(obj, key, Address.from_dict(address))
+        for key in ("interfaces", "interfaces_oid"):
+            interfaces = data.get(key, None)
+            if interfaces is not None:
+                setattr(obj, key, {k: Interface.from_dict(i) for k, i in interfaces.items()})
+        return obj
+
+
+def to_json(obj):
+    """
+    json.dumps() default hook, serializes records
+    """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def dumps(data) -> str:
+    return json.dumps(data, default=to_json)
+
+
+def devices_from_json(data: str) -> Dict:
+    """
+    Decode JSON with all devices, return dict, key is name, value is Device
+    """
+    return {name: Device.from_dict(d) for name, d in json.loads(data).items()}
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Manage Icinga2 objects through the REST API
+
+Objects created here are marked with vars.pe_managed, only marked objects
+are updated or deleted. Objects created through the API are active directly,
+no reload of Icinga is needed.
+
+Note: Objects created from configuration files can not be changed through
+the API, remove them from the configuration before using this.
+
+dependencies:
+    sudo pip3 install requests
+"""
+
+import datetime
+import urllib.parse
+from typing import Dict, List
+
+import requests
+from orderedattrdict import AttrDict
+
+MANAGED_VAR = "pe_managed"
+
+
+class Icinga_API_Error(Exception):
+    pass
+
+
+class Icinga_API:
+
+    def __init__(self, config=None, pool_maxsize: int = 10, timeout: int = 30):
+        self.config = config
+        self.url = config.url.rstrip("/")
+        self.timeout = config.get("timeout", timeout)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.auth = (config.username, config.password)
+        self.session.verify = config.get("verify", False)
+        self.session.headers.update({"Accept": "application/json"})
+
+    def request(self, method: str, path: str, data: Dict = None, params: Dict = None, headers: Dict = None) -> Dict:
+        try:
+            r = self.session.request(method, f"{self.url}{path}", json=data, params=params,
+                                     headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as err:
+            raise Icinga_API_Error(f"{method} {path}, err {err}")
+        if r.status_code >= 300:
+            raise Icinga_API_Error(f"{method} {path}, status {r.status_code}, {r.text[:500]}")
+        try:
+            return r.json()
+        except ValueError:
+            return {}
+
+    def _path(self, type_: str, name: str = None) -> str:
+        path = f"/v1/objects/{type_}"
+        if name is not None:
+            path += "/" + urllib.parse.quote(name, safe="")
+        return path
+
+    def get_objects(self, type_: str, attrs: List[str] = None) -> Dict:
+        """
+        Get all managed objects of a type, type_ is plural, "hosts", "users" etc
+        returns dict, key is object name, value is attrs
+        """
+        data = {"filter": f"obj.vars.{MANAGED_VAR} == true"}
+        if attrs:
+            data["attrs"] = attrs
+        # The filter is sent in the body, GET with body is done with method override
+        result = self.request("POST", self._path(type_), data=data, headers={"X-HTTP-Method-Override": "GET"})
+        return {obj["name"]: obj["attrs"] for obj in result.get("results", [])}
+
+    def get_hosts_down(self) -> List:
+        """
+        Get all hosts not up, and not acknowledged
+        returns list of AttrDict, sorted on name
+        """
+        data = {
+            "filter": "host.state != 0 && host.acknowledgement == 0",
+            "attrs": ["name", "last_hard_state_change", "notes", "vars"],
+        }
+        result = self.request("POST", self._path("hosts"), data=data, headers={"X-HTTP-Method-Override": "GET"})
+        hosts = []
+        for obj in result.get("results", []):
+            attrs = obj["attrs"]
+            v = attrs.get("vars", None) or {}
+            hosts.append(AttrDict(
+                name=attrs["name"],
+                last_hard_state_changed=datetime.datetime.fromtimestamp(attrs.get("last_hard_state_change", 0) or 0),
+                notes=attrs.get("notes", ""),
+                pe_location=v.get("pe_location", ""),
+                pe_role=v.get("pe_role", ""),
+                pe_manufacturer=v.get("pe_manufacturer", ""),
+                pe_model=v.get("pe_model", ""),
+                pe_parents=v.get("pe_parents", None) or [],
+                pe_customer_count=v.get("pe_customer_count", None),
+            ))
+        return sorted(hosts, key=lambda h: h.name)
+
+    def get_services_down(self) -> List:
+        """
+        Get all services not ok and not acknowledged, where host is up
+        returns list of AttrDict, sorted on host name and service name
+        """
+        data = {
+            "filter": "service.state != 0 && service.acknowledgement == 0 && host.state == 0",
+            "attrs": ["name", "host_name", "last_hard_state_change", "notes", "last_check_result"],
+            "joins": ["host.state"],
+        }
+        result = self.request("POST", self._path("services"), data=data, headers={"X-HTTP-Method-Override": "GET"})
+        services = []
+        for obj in result.get("results", []):
+            attrs = obj["attrs"]
+            check_result = attrs.get("last_check_result", None) or {}
+            services.append(AttrDict(
+                name=attrs["name"],
+                host_name=attrs["host_name"],
+                last_hard_state_changed=datetime.datetime.fromtimestamp(attrs.get("last_hard_state_change", 0) or 0),
+                notes=attrs.get("notes", ""),
+                output=check_result.get("output", ""),
+            ))
+        return sorted(services, key=lambda s: (s.host_name, s.name))
+
+    def create_object(self, type_: str, name: str, attrs: Dict, templates: List[str] = None) -> None:
+        attrs = dict(attrs)
+        attrs["vars"] = dict(attrs.get("vars", None) or {}, **{MANAGED_VAR: True})
+        data = {"attrs": attrs}
+        if templates:
+            data["templates"] = templates
+        self.request("PUT", self._path(type_, name), data=data)
+
+    def update_object(self, type_: str, name: str, attrs: Dict) -> None:
+        attrs = dict(attrs)
+        if "vars" in attrs:
+            attrs["vars"] = dict(attrs["vars"] or {}, **{MANAGED_VAR: True})
+        self.request("POST", self._path(type_, name), data={"attrs": attrs})
+
+    def delete_object(self, type_: str, name: str) -> None:
+        self.request("DELETE", self._path(type_, name), params={"cascade": 1})
+
+    def process_check_result(self, host: str, service: str = None, **attrs) -> Dict:
+        """
+        Submit a passive check result for a host or service
+        attrs are exit_status, plugin_output, performance_data etc, see Icinga API documentation
+        """
+        if service:
+            data = {
+                "type": "Service",
+                "filter": "host.name == host_name && service.name == service_name",
+                "filter_vars": {"host_name": host, "service_name": service},
+            }
+        else:
+            data = {
+                "type": "Host",
+                "filter": "host.name == host_name",
+                "filter_vars": {"host_name": host},
+            }
+        data.update(attrs)
+        return self.request("POST", "/v1/actions/process-check-result", data=data)
+
+    def sync_objects(self, type_: str, objects: Dict, templates: List[str] = None, delete: bool = True) -> int:
+        """
+        Make the managed objects of a type in Icinga equal to objects
+        objects is a dict, key is object name, value is attrs
+        Only differing objects are created, updated or deleted
+        returns number of changed objects
+        """
+        attr_names = set()
+        for attrs in objects.values():
+            attr_names.update(attrs)
+        current = self.get_objects(type_, attrs=sorted(attr_names | {"vars"}))
+
+        changes = 0
+        for name, attrs in objects.items():
+            if name not in current:
+                print(f"  Create {type_} {name}")
+                self.create_object(type_, name, attrs, templates=templates)
+                changes += 1
+                continue
+            # vars also has the vars from the templates, compare and write only the vars we set,
+            # as vars.<name>, so the object keeps the others
+            cur = current[name]
+            cur_vars = cur.get("vars", None) or {}
+            modified = {}
+            for key, value in attrs.items():
+                if key == "vars":
+                    for var, var_value in (value or {}).items():
+                        if cur_vars.get(var, None) != var_value:
+                            modified[f"vars.{var}"] = var_value
+                elif cur.get(key, None) != value:
+                    modified[key] = value
+            if modified:
+                print(f"  Update {type_} {name}, {', '.join(sorted(modified))}")
+                self.update_object(type_, name, modified)
+                changes += 1
+
+        if delete:
+            changes += self.delete_objects(type_, objects, current=current)
+        return changes
+
+    def delete_objects(self, type_: str, keep: Dict, current: Dict = None) -> int:
+        """
+        Delete all managed objects of a type, that are not in keep
+        Deleting a host also deletes its services and dependencies
+        returns number of deleted objects
+        """
+        if current is None:
+            current = self.get_objects(type_, attrs=["name"])
+        changes = 0
+        for name in current:
+            if name not in keep:
+                print(f"  Delete {type_} {name}")
+                self.delete_object(type_, name)
+                changes += 1
+        return changes
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Columnar snapshot of the device inventory
+
+Each device attribute is stored as one numpy array, so device selections
+in the sync tools are done as vectorized expressions instead of per
+device loops:
+
+    inventory = Inventory(devices)
+    mask = inventory.true("enabled") & ~inventory.isin("model", ignore_models)
+    devices = inventory.select(mask)
+
+Columns
+    flags     int8, 1 true, 0 false, -1 not set
+    strings   dictionary encoded, int32 code per device, -1 not set
+    tags      bitset, one bit per tag, uint64 words per device
+
+All filter methods return a boolean mask, combine them with & | ~
+
+dependencies:
+    sudo pip3 install numpy
+"""
+
+from typing import Dict, Iterable
+
+import numpy as np
+
+FLAG_COLUMNS = (
+    "enabled",
+    "alarm_interfaces",
+    "backup_oxidized",
+    "monitor_grafana",
+    "monitor_icinga",
+    "monitor_librenms",
+)
+
+STRING_COLUMNS = (
+    "manufacturer",
+    "model",
+    "platform",
+    "role",
+    "site_name",
+    "location",
+    "connection_method",
+)
+
+
+class Inventory:
+
+    def __init__(self, devices: Dict):
+        self.devices = devices
+        self.names = np.array(list(devices), dtype=object)
+        self.name_index = {name: ix for ix, name in enumerate(devices)}
+        count = len(devices)
+        values = list(devices.values())
+
+        self.flags = {}
+        for column in FLAG_COLUMNS:
+            data = np.full(count, -1, dtype=np.int8)
+            for ix, device in enumerate(values):
+                value = device.get(column, None)
+                if value is not None:
+                    data[ix] = 1 if value else 0
+            self.flags[column] = data
+
+        self.has_primary_ip4 = np.array([bool(device.get("primary_ip4", None)) for device in values], dtype=bool)
+
+        self.strings = {}           # column -> array with codes
+        self.categories = {}        # column -> dict, value -> code
+        for column in STRING_COLUMNS:
+            categories = {}
+            data = np.full(count, -1, dtype=np.int32)
+            for ix, device in enumerate(values):
+                value = device.get(column, None)
+                if value is not None:
+                    data[ix] = categories.setdefault(value, len(categories))
+            self.strings[column] = data
+            self.categories[column] = categories
+
+        self.tag_bits = {}          # tag -> bit number
+        for device in values:
+            for tag in device.get("tags", None) or ():
+                self.tag_bits.setdefault(tag, len(self.tag_bits))
+        self.tags = np.zeros((count, max(1, (len(self.tag_bits) + 63) // 64)), dtype=np.uint64)
+        for ix, device in enumerate(values):
+            for tag in device.get("tags", None) or ():
+                bit = self.tag_bits[tag]
+                self.tags[ix, bit // 64] |= np.uint64(1 << (bit % 64))
+
+    def __len__(self):
+        return len(self.names)
+
+    def all(self) -> np.ndarray:
+        return np.ones(len(self.names), dtype=bool)
+
+    def true(self, column: str) -> np.ndarray:
+        """
+        Devices where flag is set and true
+        """
+        return self.flags[column] == 1
+
+    def false(self, column: str) -> np.ndarray:
+        """
+        Devices where flag is set and false, not set is not false
+        """
+        return self.flags[column] == 0
+
+    def isin(self, column: str, values: Iterable) -> np.ndarray:
+        """
+        Devices where string column is one of values
+        """
+        categories = self.categories[column]
+        codes = [categories[value] for value in values if value in categories]
+        return np.isin(self.strings[column], np.array(codes, dtype=np.int32))
+
+    def name_in(self, names: Iterable) -> np.ndarray:
+        mask = np.zeros(len(self.names), dtype=bool)
+        for name in names:
+            ix = self.name_index.get(name, None)
+            if ix is not None:
+                mask[ix] = True
+        return mask
+
+    def has_any_tag(self, tags: Iterable) -> np.ndarray:
+        """
+        Devices with at least one of tags
+        """
+        words = np.zeros(self.tags.shape[1], dtype=np.uint64)
+        for tag in tags:
+            bit = self.tag_bits.get(tag, None)
+            if bit is not None:
+                words[bit // 64] |= np.uint64(1 << (bit % 64))
+        return np.any(self.tags & words, axis=1)
+
+    def select(self, mask: np.ndarray) -> Dict:
+        """
+        returns dict with devices in mask, key is name, in inventory order
+        """
+        return {name: self.devices[name] for name in self.names[mask]}
+
+    def value_counts(self, column: str, mask: np.ndarray = None) -> Dict:
+        """
+        Number of devices per value in string column, for reports
+        """
+        data = self.strings[column] if mask is None else self.strings[column][mask]
+        counts = np.bincount(data[data >= 0], minlength=len(self.categories[column]))
+        return {value: int(counts[code]) for value, code in self.categories[column].items() if counts[code]}
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Index over all device addresses, answers "which device/interface owns this address"
+
+Each address family has one hash table per prefix length. A lookup tries the
+prefix lengths in use, longest first, so a lookup is at most 33 (IPv4) or 129
+(IPv6) dict lookups, and in practice only a handful.
+"""
+
+# python standard modules
+import ipaddress
+from typing import Dict, List
+
+# Modules installed with pip
+from orderedattrdict import AttrDict
+
+
+class IP_Index:
+    """
+    Longest-prefix match index over primary_ip4/6 and interface prefix4/prefix6
+    Each indexed address gives two entries, the host address and the connected network
+    """
+
+    def __init__(self):
+        self.tables = {4: {}, 6: {}}        # version -> prefixlen -> network -> list of entries
+        self.prefixlens = {4: [], 6: []}    # version -> prefixlens in use, longest first
+        self.device_keys = {}               # device name -> set of (version, prefixlen, network)
+        self.generation = None              # Set by the owner, to detect a full reload of devices
+        self.timestamp = None               # Set by the owner, last change included in index
+
+    def clear(self):
+        self.tables = {4: {}, 6: {}}
+        self.prefixlens = {4: [], 6: []}
+        self.device_keys = {}
+
+    def _insert(self, name: str, addr: ipaddress.IPv4Interface, entry: AttrDict) -> None:
+        version = addr.version
+        bits = addr.max_prefixlen
+        ip = int(addr.ip)
+        keys = self.device_keys.setdefault(name, set())
+        for prefixlen, match in [(bits, "host"), (addr.network.prefixlen, "network")]:
+            if match == "network" and prefixlen == bits:
+                continue
+            table = self.tables[version].get(prefixlen)
+            if table is None:
+                table = self.tables[version][prefixlen] = {}
+                self.prefixlens[version] = sorted(self.tables[version], reverse=True)
+            network = ip >> (bits - prefixlen)
+            e = AttrDict(entry)
+            e.match = match
+            table.setdefault(network, []).append(e)
+            keys.add((version, prefixlen, network))
+
+    def _add_address(self, name: str, address: str, interface: str, type_: str) -> None:
+        try:
+            addr = ipaddress.ip_interface(address)
+        except ValueError:
+            return
+        entry = AttrDict(device=name, interface=interface, prefix=address, type=type_)
+        self._insert(name, addr, entry)
+
+    def add_device(self, name: str, device) -> None:
+        """
+        Add all addresses for a device
+        """
+        for key in ["primary_ip4", "primary_ip6"]:
+            primary = device.get(key, None)
+            if primary:
+                self._add_address(name, primary["address"], "", "primary")
+
+        interfaces = device.get("interfaces", None) or {}
+        for ifname, interface in interfaces.items():
+            for key in ["prefix4", "prefix6"]:
+                for address in interface.get(key, None) or []:
+                    self._add_address(name, address["address"], ifname, "interface")
+
+    def remove_device(self, name: str) -> None:
+        """
+        Remove all addresses for a device
+        """
+        for version, prefixlen, network in self.device_keys.pop(name, ()):
+            table = self.tables[version].get(prefixlen)
+            if table is None:
+                continue
+            entries = [e for e in table.get(network, []) if e.device != name]
+            if entries:
+                table[network] = entries
+            else:
+                table.pop(network, None)
+                if not table:
+                    del self.tables[version][prefixlen]
+                    self.prefixlens[version] = sorted(self.tables[version], reverse=True)
+
+    def update_device(self, name: str, device) -> None:
+        self.remove_device(name)
+        if device:
+            self.add_device(name, device)
+
+    def build(self, devices: Dict) -> None:
+        """
+        Rebuild index from all devices
+        """
+        self.clear()
+        for name, device in devices.items():
+            self.add_device(name, device)
+
+    def lookup(self, address: str) -> List:
+        """
+        Return the entries with the longest matching prefix, or an empty list
+        Raises ValueError if address is not a valid IP address
+        """
+        addr = ipaddress.ip_address(address.split("/")[0])
+        ip = int(addr)
+        bits = addr.max_prefixlen
+        tables = self.tables[addr.version]
+        for prefixlen in self.prefixlens[addr.version]:
+            entries = tables[prefixlen].get(ip >> (bits - prefixlen))
+            if entries:
+                return entries
+        return []
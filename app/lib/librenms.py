@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Client for LibreNMS REST API
+
+Uses one pooled HTTP session, so it can be shared between threads
+
+Change_Queue collects changes to LibreNMS and executes them with a bounded
+number of workers, with a rate limit per endpoint and retry on transient
+errors. Changes that are not idempotent (create, delete) are added with
+retry=False, a timeout may come after LibreNMS applied the change
+
+snmp_probe() checks if a device answers SNMP with a community, read only.
+The probe runs snmpget from this host, not from the LibreNMS poller, so this
+host needs SNMP access to the devices
+
+dependencies:
+    sudo pip3 install requests
+    apt install snmp
+"""
+
+import time
+import threading
+import subprocess
+import concurrent.futures
+from typing import Callable, Dict, List
+
+import requests
+
+PORT_COLUMNS = ["port_id", "device_id", "ifName", "ifAlias", "ifDescr", "ignore"]
+
+
+class Librenms_Error(Exception):
+
+    def __init__(self, msg: str, status: int = None):
+        super().__init__(msg)
+        self.status = status    # HTTP status, None if no response
+
+
+def is_transient(err: Exception) -> bool:
+    """
+    True if err is a transport error, or a 5xx/429 response, that may succeed if retried
+    """
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    status = None
+    if isinstance(err, Librenms_Error):
+        if err.status is None:
+            return True
+        status = err.status
+    elif isinstance(err, requests.exceptions.HTTPError) and err.response is not None:
+        status = err.response.status_code
+    return status is not None and (status == 429 or status >= 500)
+
+
+def snmp_probe(host: str, community: str, version: str = "v2c", timeout: int = 2, retries: int = 1) -> bool:
+    """
+    Read sysObjectID from host with community
+    returns True if the device answered
+    """
+    version = version.lstrip("v")
+    try:
+        p = subprocess.run(["snmpget", "-v", version, "-c", community, "-t", str(timeout), "-r", str(retries),
+                            "-Oqv", host, "1.3.6.1.2.1.1.2.0"],
+                           capture_output=True, text=True, timeout=timeout * (retries + 1) + 5)
+    except OSError as err:
+        print(f"Warning: Cannot run snmpget, is package snmp installed? err {err}")
+        return False
+    except subprocess.TimeoutExpired:
+        print(f"Warning: snmpget to {host} did not finish in time")
+        return False
+    return p.returncode == 0 and p.stdout.strip() != "" and "No Such" not in p.stdout
+
+
+class Librenms:
+
+    def __init__(self, config=None, pool_maxsize: int = 10, timeout: int = 60):
+        self.config = config
+        self.url = config.url.rstrip("/")
+        self.timeout = config.get("timeout", timeout)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"X-Auth-Token": config.key})
+
+    def request(self, method: str, path: str, data: Dict = None, params: Dict = None) -> Dict:
+        try:
+            r = self.session.request(method, f"{self.url}{path}", json=data, params=params, timeout=self.timeout)
+        except requests.exceptions.RequestException as err:
+            raise Librenms_Error(f"{method} {path}, err {err}")
+        if r.status_code >= 300:
+            raise Librenms_Error(f"{method} {path}, status {r.status_code}, {r.text[:500]}", status=r.status_code)
+        try:
+            return r.json()
+        except ValueError:
+            raise Librenms_Error(f"{method} {path}, response is not JSON")
+
+    def get_ports(self, columns: List[str] = None) -> List[Dict]:
+        """
+        Get ports for all devices in one request
+        Keys are lowercased, same as the per-device interface lists, ifName -> ifname
+        returns list of ports
+        """
+        columns = columns or PORT_COLUMNS
+        result = self.request("GET", "/ports", params={"columns": ",".join(columns)})
+        return [{key.lower(): value for key, value in port.items()} for port in result.get("ports", [])]
+
+
+class Rate_Limiter:
+    """
+    Allow at most rate calls per second, shared between threads
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Change_Queue:
+    """
+    Queue of changes to LibreNMS
+    A change is a call to func, endpoint names the rate limit to use
+    Changes are executed by run(), in any order
+    """
+
+    def __init__(self, workers: int = 8, rate_limits: Dict = None, retries: int = 3, retry_delay: float = 2):
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.limiters = {endpoint: Rate_Limiter(rate) for endpoint, rate in (rate_limits or {}).items() if rate}
+        self.changes = []
+
+    def __len__(self):
+        return len(self.changes)
+
+    def add(self, endpoint: str, description: str, func: Callable, *args, retry: bool = True, **kwargs) -> None:
+        """
+        Queue a change, retry=False for changes that must not be repeated
+        """
+        self.changes.append((endpoint, description, func, args, kwargs, retry))
+
+    def _execute(self, endpoint: str, description: str, func: Callable, args, kwargs, retry: bool):
+        limiter = self.limiters.get(endpoint, None)
+        retries = self.retries if retry else 0
+        for attempt in range(retries + 1):
+            if limiter:
+                limiter.wait()
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                if attempt == retries or not is_transient(err):
+                    raise
+                print(f"    Warning: {description}, err {err}, retrying")
+                time.sleep(self.retry_delay * (2 ** attempt))
+
+    def run(self) -> int:
+        """
+        Execute all queued changes, and empty the queue
+        returns number of failed changes
+        """
+        changes, self.changes = self.changes, []
+        errors = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._execute, *change): change for change in changes}
+            for future in concurrent.futures.as_completed(futures):
+                endpoint, description, *_ = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    print(f"    Error: {description}, err {err}")
+                    errors += 1
+        return errors
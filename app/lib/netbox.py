@@ -14,6 +14,7 @@ from django.utils.text import slugify
 # Assumes PYTHONPATH is set
 import ablib.utils as abutils
 import lib.base_common as common
+from lib.device_model import Device, Interface, Address
 
 
 class NetboxException(Exception):
@@ -73,8 +74,8 @@ class Netbox:
         self.device_type_mgr = NetBox_Cache(netbox=self.netbox, netbox_obj=self.netbox.dcim.device_types)
         self.interface_templates_mgr = NetBox_Cache(netbox=self.netbox, netbox_obj=self.netbox.dcim.interface_templates)
 
-    def tags_to_dict(self, tags: List) -> AttrDict:
-        res = AttrDict()
+    def tags_to_dict(self, tags: List) -> Dict:
+        res = {}
         for tag in tags:
             res[tag.name] = tag.id
         return res
@@ -122,7 +123,7 @@ class Netbox:
             n = common.Name(name)
 
             # ----- Device -----
-            d = AttrDict()
+            d = Device()
             d.id = device.id
             d.name = n.long
             d.tags = self.tags_to_dict(device.tags)
@@ -164,12 +165,12 @@ class Netbox:
                 d.platform = ""
 
             try:
-                d.primary_ip4 = AttrDict(address=device.primary_ip4.address, id=device.primary_ip4.id)
+                d.primary_ip4 = Address(address=device.primary_ip4.address, id=device.primary_ip4.id)
             except (AttributeError, NameError, KeyError, TypeError):
                 d.primary_ip4 = ""
 
             try:
-                d.primary_ip6 = AttrDict(address=device.primary_ip6.address, id=device.primary_ip6.id)
+                d.primary_ip6 = Address(address=device.primary_ip6.address, id=device.primary_ip6.id)
             except (AttributeError, NameError, KeyError, TypeError):
                 d.primary_ip6 = ""
            
@@ -258,6 +259,11 @@ class Netbox:
             except (AttributeError, NameError):
                 d.becs_oid = None
 
+            try:
+                d.customer_count = custom_fields.get("customer_count", None)
+            except (AttributeError, NameError):
+                d.customer_count = None
+
             # ----- Parent -----
             try:
                 parents = custom_fields.get("parents", "")
@@ -267,15 +273,15 @@ class Netbox:
             d.parents = parents
 
             # ----- Interfaces, addresses -----
-            d.interfaces = AttrDict()
-            d.interfaces_oid = AttrDict()
+            d.interfaces = {}
+            d.interfaces_oid = {}
             for ifname, interface in device.interfaces.items():
                 # abutils.pprint(interface, "interface")
                 prefix4 = []
                 prefix6 = []
                 for address in interface.addresses:
                     # abutils.pprint(address, "address")
-                    addr = AttrDict(
+                    addr = Address(
                         address=address.address,
                         id=address.id,
                         becs_oid=address.custom_fields.get("becs_oid", None),
@@ -296,7 +302,7 @@ class Netbox:
                 except AttributeError:
                     type_value = ""
 
-                i = AttrDict(
+                i = Interface(
                     id=interface.id,
                     becs_oid=becs_oid,
                     enabled=interface.enabled,
@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+Email notifications for Icinga2
+
+Used by the notification daemon (tools/icinga/notification_daemon.py) and by
+mail_notification.py when the daemon is not running.
+
+The list of hosts and services down is fetched at most once per snapshot
+window and shared by all notifications in that window. Emails are sent
+over a persistent SMTP connection.
+
+With a digest window, notifications to the same recipient are collected
+and sent as one digest. Host problems are folded under their failed
+ancestor, using the parents (pe_parents) of the down hosts.
+"""
+
+import sys
+import html
+import time
+import smtplib
+import argparse
+import datetime
+import platform
+import threading
+import urllib.parse
+from email.message import EmailMessage
+from typing import List
+
+from orderedattrdict import AttrDict
+
+if "/opt" not in sys.path:
+    sys.path.insert(0, "/opt")
+import ablib.utils as abutils
+from lib.icinga_api import Icinga_API, Icinga_API_Error
+from lib.topology import Topology
+
+SOCKET_FILE = "/run/factum/notification.sock"
+SNAPSHOT_WINDOW = 10        # seconds a list of hosts/services down is reused
+SMTP_IDLE_TIMEOUT = 60      # seconds, an idle SMTP connection is closed after this time
+CUSTOMERS_PER_HOST = 20     # estimated customers behind a down host, without a customer count
+DIGEST_WINDOW = 0           # seconds notifications to a recipient are collected into one digest, 0 disables
+
+TABLE = '<TABLE style="border-collapse: collapse;">'
+TR = '<TR style="border-top: 1px solid black; vertical-align:top;">'
+
+
+def TH(s=""):
+    return f'<TH style="padding-left: 0.5em; padding-right: 0.5em">{s}</TH>'
+
+
+def TH_L(s=""):
+    return f'<TH style="padding-left: 0.5em; padding-right: 0.5em;text-align:left;">{s}</TH>'
+
+
+def TH_R(s=""):
+    return f'<TH style="padding-left: 0.5em; padding-right: 0.5em;text-align:right;">{s}</TH>'
+
+
+def TD(s=""):
+    return f'<TD style="padding-left: 0.5em; padding-right: 0.5em">{s}</TD>'
+
+
+def TD_L(s=""):
+    return f'<TD style="padding-left: 0.5em; padding-right: 0.5em;text-align:left;">{s}</TD>'
+
+
+def TD_R(s=""):
+    return f'<TD style="padding-left: 0.5em; padding-right: 0.5em;text-align:right;">{s}</TD>'
+
+
+def add_kv(msg, key, val):
+    if val:
+        msg.append(TR)
+        msg.append(TD(key))
+        msg.append(TD())
+        tmp = []
+        if isinstance(val, list):
+            tmp = val
+        else:
+            for line in val.strip().split("\\r\\n"):
+                tmp.append(line)
+        msg.append(TD("<br>".join(tmp)))
+        msg.append("</tr>")
+
+
+def format_age(delta: datetime.timedelta) -> str:
+    return str(datetime.timedelta(seconds=int(delta.total_seconds())))
+
+
+class Notification_Error(Exception):
+    pass
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    """
+    Raise exception instead of exiting, the daemon must survive incorrect arguments
+    """
+    def error(self, message):
+        raise Notification_Error(message)
+
+
+def parse_args(argv: List[str], default_sender: str = None):
+    """
+    Parse notification arguments, same as the mail notification script shipped with Icinga
+    returns args, args.host is True for host notifications, False for service notifications
+    """
+    argv = list(argv)
+    host = "--SERVICE" not in argv
+    if not host:
+        argv.remove("--SERVICE")
+
+    parser = ArgumentParser()
+
+    # Required paramets
+    parser.add_argument('-d', '--LONGDATETIME', required=True)
+    parser.add_argument('-l', '--HOSTNAME', required=True)
+    parser.add_argument('-n', '--HOSTDISPLAYNAME', required=True)
+    parser.add_argument('-r', '--USEREMAIL', required=True)
+    parser.add_argument('-t', '--NOTIFICATIONTYPE', required=True)
+
+    # Optional parameters:
+    parser.add_argument('-4', '--HOSTADDRESS')
+    parser.add_argument('-6', '--HOSTADDRESS6', default="")
+    parser.add_argument('-b', '--NOTIFICATIONAUTHORNAME')
+    parser.add_argument('-c', '--NOTIFICATIONCOMMENT')
+    parser.add_argument('-i', '--ICINGAWEB2URL')
+    parser.add_argument('-f', '--MAILFROM', default=default_sender)
+    parser.add_argument('-v', '--SYSLOG')
+    parser.add_argument('--ICINGA2HOST', default=platform.node())
+
+    # Host parameters
+    if host:
+        parser.add_argument('-o', '--HOSTOUTPUT', required=True)
+        parser.add_argument('-s', '--HOSTSTATE', required=True)
+
+    # Service parameters
+    else:
+        parser.add_argument('-e', '--SERVICENAME', required=True)
+        parser.add_argument('-o', '--SERVICEOUTPUT', required=True)
+        parser.add_argument('-s', '--SERVICESTATE', required=True)
+        parser.add_argument('-u', '--SERVICEDISPLAYNAME', required=True)
+
+    parser.add_argument("--pe_comments")
+    parser.add_argument("--pe_location")
+    parser.add_argument("--pe_manufacturer")
+    parser.add_argument("--pe_model")
+    parser.add_argument("--pe_parents")
+    parser.add_argument("--pe_platform")
+    parser.add_argument("--pe_role")
+    parser.add_argument("--pe_site_name")
+
+    args = parser.parse_args(argv)
+    args.host = host
+    return args
+
+
+def get_customers_down(hosts_down: List, customers_per_host: int = CUSTOMERS_PER_HOST):
+    """
+    Sum customers behind the hosts down
+    pe_customer_count on a host includes the customers below its child
+    devices, so only the topmost counted hosts are summed. A topmost host
+    without count and without counted hosts below it is estimated
+    returns number of customers, True if any host was estimated
+    """
+    count = {state.name: state.get("pe_customer_count", None) for state in hosts_down}
+    topology = Topology()
+    topology.build({state.name: {"parents": state.pe_parents} for state in hosts_down})
+
+    def is_top_counted(name):
+        return count[name] is not None and \
+            not any(count[ancestor] is not None for ancestor in topology.ancestors(name))
+
+    customers = 0
+    estimated = False
+    for name in count:
+        if is_top_counted(name):
+            customers += count[name]
+        elif not topology.ancestors(name) and \
+                not any(is_top_counted(descendant) for descendant in topology.descendants(name)):
+            customers += customers_per_host
+            estimated = True
+    return customers, estimated
+
+
+class Snapshot:
+    """
+    Hosts and services down, fetched from Icinga API at most once per window
+    Shared by all notifications arriving in the window
+    """
+
+    def __init__(self, icinga_api: Icinga_API, window: float = SNAPSHOT_WINDOW,
+                 customers_per_host: int = CUSTOMERS_PER_HOST):
+        self.icinga_api = icinga_api
+        self.window = window
+        self.customers_per_host = customers_per_host
+        self.lock = threading.Lock()
+        self.fetched = 0.0
+        self.data = None
+
+    def get(self) -> AttrDict:
+        with self.lock:
+            if self.data is None or time.monotonic() - self.fetched > self.window:
+                self.data = self.fetch()
+                self.fetched = time.monotonic()
+            return self.data
+
+    def fetch(self) -> AttrDict:
+        data = AttrDict(now=datetime.datetime.now(), hosts_down=[], hosts_error=None,
+                        customers_down=0, customers_estimated=False,
+                        services_down=[], services_error=None)
+        try:
+            data.hosts_down = self.icinga_api.get_hosts_down()
+            data.customers_down, data.customers_estimated = get_customers_down(
+                data.hosts_down, self.customers_per_host)
+        except Icinga_API_Error as err:
+            data.hosts_error = str(err)
+        try:
+            data.services_down = self.icinga_api.get_services_down()
+        except Icinga_API_Error as err:
+            data.services_error = str(err)
+        return data
+
+
+def build_hosts_down(msg: List[str], snapshot: AttrDict) -> None:
+    """
+    Add table with all hosts not UP, and not acknowledged
+    """
+    msg.append("<br><strong>Hosts - not Acknowledged</strong><br>")
+    if snapshot.hosts_error:
+        msg.append("Error getting list of down hosts. Err: %s" % snapshot.hosts_error)
+        return
+    state_down = snapshot.hosts_down
+    if not state_down:
+        msg.append("None")
+        return
+    msg.append("Number of hosts: %d<br>" % len(state_down))
+    if snapshot.customers_estimated:
+        msg.append("Approximately number of customers down: %d<br>" % snapshot.customers_down)
+    else:
+        msg.append("Number of customers down: %d<br>" % snapshot.customers_down)
+    msg.append(TABLE)
+    msg.append(TR)
+    msg.append(TH_L("Host"))
+    msg.append(TH("Time"))
+    msg.append(TH("Changed"))
+    msg.append(TH_L("Location"))
+    msg.append(TH_L("Role"))
+    msg.append(TH_L("Manufacturer"))
+    msg.append(TH_L("Model"))
+    msg.append(TH_R("Customers"))
+    msg.append(TH_L("Notes"))
+    msg.append("</tr>")
+    for state in state_down:
+        name = abutils.Name(state.name)
+        msg.append(TR)
+        msg.append(TD(name.short))
+        msg.append(TD_R(format_age(snapshot.now - state.last_hard_state_changed)))
+        msg.append(TD(state.last_hard_state_changed.strftime("%Y-%m-%d %H:%M:%S")))
+        msg.append(TD(state.pe_location))
+        msg.append(TD(state.pe_role))
+        msg.append(TD(state.pe_manufacturer))
+        msg.append(TD(state.pe_model))
+        customer_count = state.get("pe_customer_count", None)
+        msg.append(TD_R("" if customer_count is None else customer_count))
+        msg.append(TD(state.notes))
+        msg.append("</tr>")
+    msg.append("</table>")
+
+
+def build_services_down(msg: List[str], snapshot: AttrDict) -> None:
+    """
+    Add table with all services down (not acknowledged) where host is up
+    """
+    msg.append("<br><strong>Services - not Acknowledged</strong><br>")
+    if snapshot.services_error:
+        msg.append("Error getting list of down services. Err: %s" % snapshot.services_error)
+        return
+    state_down = snapshot.services_down
+    if not state_down:
+        msg.append("None")
+        return
+    msg.append("Number of services: %d<br>" % len(state_down))
+    msg.append(TABLE)
+    msg.append(TR)
+    msg.append(TH_L("Host"))
+    msg.append(TH_L("Service"))
+    msg.append(TH("Time"))
+    msg.append(TH("Changed"))
+    msg.append(TH_L("Output"))
+    msg.append(TH_L("Comments"))
+    msg.append("</tr>")
+    for state in state_down:
+        name = abutils.Name(state.host_name)
+        msg.append(TR)
+        msg.append(TD(name.short))
+        msg.append(TD(state.name))
+        msg.append(TD_R(format_age(snapshot.now - state.last_hard_state_changed)))
+        msg.append(TD(state.last_hard_state_changed.strftime("%Y-%m-%d %H:%M:%S")))
+        msg.append(TD(html.escape(state.output)))
+        msg.append(TD(state.notes))
+        msg.append("</tr>")
+    msg.append("</table>")
+
+
+def build_alarm(msg: List[str], args) -> None:
+    """
+    Add table with alarm, hardware and other info for one notification
+    """
+    host = args.host
+    msg.append(TABLE)
+
+    # Section Alarm
+    add_kv(msg, "<strong>Alarm:</strong>", "&nbsp;")
+    if host:
+        add_kv(msg, "Info", html.escape(args.HOSTOUTPUT))
+    else:
+        add_kv(msg, "Info", html.escape(args.SERVICEOUTPUT))
+    longdatetime = args.LONGDATETIME.split()
+    longdatetime = " ".join(longdatetime[:-1])  # remove timezone
+    add_kv(msg, "When", longdatetime)
+    add_kv(msg, "Notification comment by", args.NOTIFICATIONAUTHORNAME)
+    add_kv(msg, "Notification comment", args.NOTIFICATIONCOMMENT)
+
+    # Section Hardware
+    if host:
+        name = abutils.Name(args.HOSTNAME)
+        add_kv(msg, "<strong>Hardware:</strong>", "&nbsp;")
+        add_kv(msg, "Host", name.short)
+        if args.pe_location:
+            add_kv(msg, "Location", args.pe_location)
+        if args.pe_site_name:
+            add_kv(msg, "Site name", args.pe_site_name)
+        if args.pe_parents:
+            parents = []
+            for parent in args.pe_parents.split(","):
+                n = abutils.Name(parent.strip())
+                parents.append(n.short)
+            add_kv(msg, "Parents", parents)
+        if args.pe_role:
+            add_kv(msg, "Role", args.pe_role)
+        if args.pe_manufacturer:
+            add_kv(msg, "Manufacturer", args.pe_manufacturer)
+        if args.pe_model:
+            add_kv(msg, "Model", args.pe_model)
+        add_kv(msg, "IPv4", args.HOSTADDRESS)
+        add_kv(msg, "IPv6", args.HOSTADDRESS6)
+
+    # Section Other
+    if host:
+        add_kv(msg, "<strong>Other:</strong>", "&nbsp;")
+        if args.pe_comments:
+            tmp = ""
+            for comment in args.pe_comments.split('\n'):
+                tmp += "%s<br>\n" % html.escape(comment)
+            add_kv(msg, "Comments", tmp)
+        if args.pe_platform:
+            add_kv(msg, "Platform", args.pe_platform)
+
+    if args.ICINGAWEB2URL:
+        hostname = urllib.parse.quote(args.HOSTNAME)
+        if host:
+            val = f'<a href="{args.ICINGAWEB2URL}/monitoring/host/show?host={hostname}">Open host in Icinga</a>'
+        else:
+            servicename = urllib.parse.quote(args.SERVICENAME)
+            val = f'<a href="{args.ICINGAWEB2URL}/monitoring/list/services?service_problem=1#!/monitoring/service/show?host={hostname}&service={servicename}">Open service in Icinga</a>'
+        add_kv(msg, 'Link', val)
+
+    msg.append("</table>")
+
+
+def get_summary(args) -> str:
+    displayname = abutils.Name(args.HOSTDISPLAYNAME)
+    if args.host:
+        return f"{args.NOTIFICATIONTYPE}, Host '{displayname.short}' is in state '{args.HOSTSTATE}'"
+    return f"{args.NOTIFICATIONTYPE}, Host '{displayname.short}', Service '{args.SERVICEDISPLAYNAME}' is in state '{args.SERVICESTATE}'"
+
+
+def build_message(args, snapshot: AttrDict):
+    """
+    Build email for one notification
+    returns subject, html message
+    """
+    subject = get_summary(args) + " !"
+    displayname = abutils.Name(args.HOSTDISPLAYNAME)
+
+    msg = []
+    msg.append("<html>")
+    msg.append("  <head>")
+    msg.append('    <meta content="text/html; charset=utf-8">')
+    msg.append("  </head>")
+    msg.append("<body>")
+    if args.host:
+        msg.append(f"{args.NOTIFICATIONTYPE}, Host <strong>{displayname.short}</strong> is in state <strong>{ args.HOSTSTATE}</strong><br>")
+    else:
+        msg.append(f"{args.NOTIFICATIONTYPE}, Host <strong>{displayname.short}</strong>, Service <strong>{args.SERVICEDISPLAYNAME}</strong> is in state <strong>{args.SERVICESTATE}</strong><br>")
+    msg.append("<br>")
+
+    build_alarm(msg, args)
+    build_hosts_down(msg, snapshot)
+    build_services_down(msg, snapshot)
+
+    msg.append("</body>")
+    return subject, "\n".join(msg)
+
+
+def get_parents(args) -> List[str]:
+    if not args.pe_parents:
+        return []
+    return [parent.strip() for parent in args.pe_parents.split(",") if parent.strip()]
+
+
+def fold_hosts(host_args: List, snapshot: AttrDict) -> List:
+    """
+    Fold host problems under their failed ancestor
+    The graph contains the hosts down, so a host is folded under the topmost
+    down host above it
+    returns list of (args of failed ancestor, list of args of folded hosts)
+    """
+    devices = {}
+    for state in snapshot.hosts_down:
+        devices[state.name] = {"parents": state.pe_parents}
+    for args in host_args:
+        devices[args.HOSTNAME] = {"parents": get_parents(args)}
+    topology = Topology()
+    topology.build(devices)
+
+    by_name = {args.HOSTNAME: args for args in host_args}
+    folded = {}
+    for args in host_args:
+        ancestors = [name for name in topology.ancestors(args.HOSTNAME) if name in by_name]
+        # Topmost notified ancestor, the one without notified ancestors itself
+        top = [name for name in ancestors if not (topology.ancestors(name) & by_name.keys())]
+        if top:
+            folded.setdefault(min(top), []).append(args)
+        else:
+            folded.setdefault(args.HOSTNAME, [])
+    return [(by_name[name], children) for name, children in folded.items()]
+
+
+def build_digest(batch: List, snapshot: AttrDict):
+    """
+    Build one email for several notifications to the same recipient
+    returns subject, html message
+    """
+    host_problems = []
+    other = []
+    for args in batch:
+        if args.host and args.NOTIFICATIONTYPE != "RECOVERY":
+            host_problems.append(args)
+        else:
+            other.append(args)
+    folded = fold_hosts(host_problems, snapshot)
+
+    subject = f"Digest, {len(batch)} notifications"
+    if folded:
+        names = [abutils.Name(args.HOSTNAME).short for args, _ in folded]
+        subject += f", {len(host_problems)} hosts with problems below {', '.join(names[:3])}"
+        if len(names) > 3:
+            subject += ", ..."
+
+    msg = []
+    msg.append("<html>")
+    msg.append("  <head>")
+    msg.append('    <meta content="text/html; charset=utf-8">')
+    msg.append("  </head>")
+    msg.append("<body>")
+
+    if folded:
+        msg.append("<strong>Host problems</strong><br>")
+        msg.append(TABLE)
+        msg.append(TR)
+        msg.append(TH_L("Host"))
+        msg.append(TH_L("State"))
+        msg.append(TH_L("Location"))
+        msg.append(TH_L("Info"))
+        msg.append(TH_R("Hosts below"))
+        msg.append(TH_L("Hosts below"))
+        msg.append("</tr>")
+        for args, children in folded:
+            msg.append(TR)
+            msg.append(TD(abutils.Name(args.HOSTNAME).short))
+            msg.append(TD(args.HOSTSTATE))
+            msg.append(TD(args.pe_location or ""))
+            msg.append(TD(html.escape(args.HOSTOUTPUT)))
+            msg.append(TD_R(len(children)))
+            msg.append(TD(", ".join(sorted(abutils.Name(c.HOSTNAME).short for c in children))))
+            msg.append("</tr>")
+        msg.append("</table>")
+
+    if other:
+        msg.append("<br><strong>Other notifications</strong><br>")
+        msg.append(TABLE)
+        msg.append(TR)
+        msg.append(TH_L("Type"))
+        msg.append(TH_L("Host"))
+        msg.append(TH_L("Service"))
+        msg.append(TH_L("State"))
+        msg.append(TH_L("Info"))
+        msg.append("</tr>")
+        for args in other:
+            msg.append(TR)
+            msg.append(TD(args.NOTIFICATIONTYPE))
+            msg.append(TD(abutils.Name(args.HOSTNAME).short))
+            if args.host:
+                msg.append(TD())
+                msg.append(TD(args.HOSTSTATE))
+                msg.append(TD(html.escape(args.HOSTOUTPUT)))
+            else:
+                msg.append(TD(args.SERVICEDISPLAYNAME))
+                msg.append(TD(args.SERVICESTATE))
+                msg.append(TD(html.escape(args.SERVICEOUTPUT)))
+            msg.append("</tr>")
+        msg.append("</table>")
+
+    build_hosts_down(msg, snapshot)
+    build_services_down(msg, snapshot)
+
+    msg.append("</body>")
+    return subject, "\n".join(msg)
+
+
+class Coalescer:
+    """
+    Collect notifications per recipient
+    A batch is due when window seconds has passed since its first notification
+    """
+
+    def __init__(self, window: float = DIGEST_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {}       # (sender, recipient) -> [first arrival, list of args]
+
+    def add(self, args) -> None:
+        with self.lock:
+            key = (args.MAILFROM, args.USEREMAIL)
+            if key not in self.pending:
+                self.pending[key] = [time.monotonic(), []]
+            self.pending[key][1].append(args)
+
+    def get_due(self, flush: bool = False) -> List[List]:
+        """
+        Remove and return all due batches, each batch a list of args
+        """
+        now = time.monotonic()
+        with self.lock:
+            due = [key for key, (first, _) in self.pending.items() if flush or now - first >= self.window]
+            return [self.pending.pop(key)[1] for key in due]
+
+
+class Mailer:
+    """
+    Send emails over a persistent SMTP connection
+    The connection is reopened if the server has closed it
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 25, idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.smtp = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.smtp is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+        if self.smtp is None:
+            self.smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        return self.smtp
+
+    def send(self, sender: str, recipient: str, subject: str, msg: str) -> None:
+        email = EmailMessage()
+        email["From"] = sender
+        email["To"] = recipient
+        email["Subject"] = subject
+        email.set_content("This message is in HTML format")
+        email.add_alternative(msg, subtype="html")
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    self._connect().send_message(email)
+                    self.last_used = time.monotonic()
+                    return
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self.close()
+                    if attempt:
+                        raise
+
+
+class Notifier:
+    """
+    Handle notifications, keeps Icinga API session, snapshot and SMTP connection between notifications
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        notify = config.notify
+        self.default_sender = notify.email.sender
+        self.icinga_api = Icinga_API(config=config.icinga.api)
+        self.snapshot = Snapshot(
+            self.icinga_api,
+            window=notify.get("snapshot_window", SNAPSHOT_WINDOW),
+            customers_per_host=notify.get("customers_per_host", CUSTOMERS_PER_HOST),
+        )
+        self.digest_window = notify.get("digest_window", DIGEST_WINDOW)
+        self.mailer = Mailer(
+            host=notify.email.get("smtp_server", "localhost"),
+            port=notify.email.get("smtp_port", 25),
+        )
+
+    def parse_args(self, argv: List[str]):
+        return parse_args(argv, default_sender=self.default_sender)
+
+    def notify(self, args) -> None:
+        subject, msg = build_message(args, self.snapshot.get())
+        self.mailer.send(sender=args.MAILFROM, recipient=args.USEREMAIL, subject=subject, msg=msg)
+
+    def notify_batch(self, batch: List) -> None:
+        """
+        Send notifications to one recipient, as a digest if more than one
+        """
+        if len(batch) == 1:
+            self.notify(batch[0])
+            return
+        subject, msg = build_digest(batch, self.snapshot.get())
+        self.mailer.send(sender=batch[0].MAILFROM, recipient=batch[0].USEREMAIL, subject=subject, msg=msg)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Send record changes to a nameserver as RFC 2136 dynamic updates
+
+Changes are grouped per zone, so only the zones with changed records are
+touched. Each zone gets one update message per chunk of changes.
+
+dependencies:
+    sudo pip3 install dnspython
+"""
+
+from typing import Dict, List, Tuple
+
+import dns.name
+import dns.query
+import dns.rcode
+import dns.reversename
+import dns.tsigkeyring
+import dns.update
+
+
+class Nsupdate_Error(Exception):
+    pass
+
+
+class Nsupdate:
+    """
+    A record is a tuple (hostname, type, value, reverse)
+    hostname is relative to the forward zone. If reverse is True, a PTR record
+    is maintained in the matching reverse zone
+    """
+
+    def __init__(self, config=None, domain: str = None):
+        self.config = config
+        self.server = config.server
+        self.port = config.get("port", 53)
+        self.timeout = config.get("timeout", 10)
+        self.ttl = config.get("ttl", 3600)
+        self.chunk_size = config.get("chunk_size", 500)
+        self.forward_zone = dns.name.from_text(config.get("zone", domain))
+        self.reverse_zones = [dns.name.from_text(z) for z in config.get("reverse_zones", [])]
+        self.keyring = None
+        self.keyalgorithm = None
+        if config.get("keyname", None):
+            self.keyring = dns.tsigkeyring.from_text({config.keyname: config.keysecret})
+            self.keyalgorithm = config.get("keyalgorithm", "hmac-sha256")
+
+    def reverse_zone(self, name: dns.name.Name):
+        """
+        Return the longest configured reverse zone containing name, or None
+        """
+        zone = None
+        for z in self.reverse_zones:
+            if name.is_subdomain(z) and (zone is None or len(z) > len(zone)):
+                zone = z
+        return zone
+
+    def get_changes(self, added: List[Tuple], removed: List[Tuple]) -> Dict:
+        """
+        Convert added/removed records to per zone changes
+        returns dict, key is zone, value is list of (op, name, type, value), name relative to zone
+        Raises Nsupdate_Error if a reverse record has no configured zone
+        """
+        changes = {}
+        for op, entries in [("delete", removed), ("add", added)]:
+            for hostname, type_, value, reverse in entries:
+                name = dns.name.from_text(hostname, origin=self.forward_zone)
+                changes.setdefault(self.forward_zone, []).append(
+                    (op, name.relativize(self.forward_zone), type_, value))
+                if not reverse:
+                    continue
+                ptr = dns.reversename.from_address(value)
+                zone = self.reverse_zone(ptr)
+                if zone is None:
+                    raise Nsupdate_Error(f"No reverse zone configured for {value}")
+                changes.setdefault(zone, []).append(
+                    (op, ptr.relativize(zone), "PTR", name.to_text()))
+        return changes
+
+    def make_updates(self, zone: dns.name.Name, changes: List[Tuple]) -> List:
+        updates = []
+        for ix in range(0, len(changes), self.chunk_size):
+            update = dns.update.Update(zone, keyring=self.keyring, keyalgorithm=self.keyalgorithm)
+            for op, name, type_, value in changes[ix:ix + self.chunk_size]:
+                if op == "delete":
+                    update.delete(name, type_, value)
+                else:
+                    update.add(name, self.ttl, type_, value)
+            updates.append(update)
+        return updates
+
+    def send(self, added: List[Tuple], removed: List[Tuple]) -> None:
+        """
+        Send all changes, raises Nsupdate_Error on failure
+        """
+        for zone, changes in self.get_changes(added, removed).items():
+            print(f"  nsupdate zone {zone}, {len(changes)} changes")
+            for update in self.make_updates(zone, changes):
+                try:
+                    response = dns.query.tcp(update, self.server, port=self.port, timeout=self.timeout)
+                except Exception as err:
+                    raise Nsupdate_Error(f"zone {zone}, err {err}")
+                if response.rcode() != dns.rcode.NOERROR:
+                    raise Nsupdate_Error(f"zone {zone}, rcode {dns.rcode.to_text(response.rcode())}")
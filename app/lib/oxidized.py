@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Client for oxidized-web REST API
+
+Uses one pooled HTTP session, so it can be shared between threads
+fetching configurations concurrently
+
+reload_nodes() makes oxidized reread its node source without a restart
+
+dependencies:
+    sudo pip3 install requests
+"""
+
+from typing import Dict
+
+import requests
+
+
+class Oxidized:
+
+    def __init__(self, config=None, pool_maxsize: int = 10, timeout: int = 30):
+        self.config = config
+        self.url = config.url.rstrip("/")
+        self.timeout = config.get("timeout", timeout)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if config.get("username", None):
+            self.session.auth = (config.username, config.password)
+
+    def get_nodes(self) -> Dict:
+        """
+        Get all nodes oxidized knows about
+        returns dict, key is node name, value is node info
+        """
+        r = self.session.get(f"{self.url}/nodes.json", timeout=self.timeout)
+        r.raise_for_status()
+        return {node["name"]: node for node in r.json()}
+
+    def get_device_config(self, name: str):
+        """
+        Get last stored configuration for a device
+        returns configuration as string, or None if not found
+        """
+        try:
+            r = self.session.get(f"{self.url}/node/fetch/{name}", timeout=self.timeout)
+        except requests.exceptions.RequestException as err:
+            print(f"Error: oxidized, cannot fetch configuration for {name}, err {err}")
+            return None
+        if r.status_code != 200:
+            return None
+        return r.text
+
+    def reload_nodes(self) -> None:
+        """
+        Ask oxidized to reread its node list from the source
+        Running backup jobs are not interrupted, unlike a restart of oxidized
+        """
+        r = self.session.get(f"{self.url}/reload.json", timeout=self.timeout)
+        r.raise_for_status()
+
+    def next_node(self, name: str) -> None:
+        """
+        Move a node first in the backup queue
+        """
+        r = self.session.get(f"{self.url}/node/next/{name}.json", timeout=self.timeout)
+        r.raise_for_status()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Parent/child topology of devices, from the device parents
+
+The graph is built once, queries like "all devices downstream of X" are
+answered from precomputed ancestor/descendant sets. After a device change
+the sets are recomputed on next query.
+
+Has the same update interface as IP_Index, so it can be kept up to date
+from the device cache with Device_Cache.update_index()
+"""
+
+from typing import Dict, List, Set
+
+
+class Topology:
+    """
+    Directed graph, edges from child to parent
+    Parents that are not devices are reported in unknown_parents and not part of the graph
+    Edges closing a cycle are reported in cycles, and are excluded from ancestors/descendants
+    """
+
+    def __init__(self):
+        self.device_parents = {}    # name -> list of parents, as configured on device
+        self.generation = None      # Set by the owner, to detect a full reload of devices
+        self.timestamp = None       # Set by the owner, last change included
+        self._dirty = True
+
+    def clear(self):
+        self.device_parents = {}
+        self._dirty = True
+
+    def add_device(self, name: str, device) -> None:
+        self.device_parents[name] = list(device.get("parents", None) or [])
+        self._dirty = True
+
+    def remove_device(self, name: str) -> None:
+        self.device_parents.pop(name, None)
+        self._dirty = True
+
+    def update_device(self, name: str, device) -> None:
+        self.remove_device(name)
+        if device:
+            self.add_device(name, device)
+
+    def build(self, devices: Dict) -> None:
+        """
+        Rebuild graph from all devices
+        """
+        self.clear()
+        for name, device in devices.items():
+            self.add_device(name, device)
+        self._update()
+
+    def _update(self) -> None:
+        """
+        Calculate adjacency lists, unknown parents, cycles, ancestors and descendants
+        """
+        if not self._dirty:
+            return
+        self.parents = {}           # name -> list of known parents
+        self.children = {name: [] for name in self.device_parents}
+        self.unknown_parents = {}   # name -> list of parents that are not devices
+        for name, parents in self.device_parents.items():
+            self.parents[name] = []
+            for parent in parents:
+                if parent in self.device_parents:
+                    if parent not in self.parents[name]:
+                        self.parents[name].append(parent)
+                        self.children[parent].append(name)
+                else:
+                    self.unknown_parents.setdefault(name, []).append(parent)
+
+        self._find_cycles()
+
+        # Topological order, parents before children, without edges closing a cycle
+        order = []
+        pending = {name: len(self._acyclic_parents(name)) for name in self.parents}
+        ready = [name for name, count in pending.items() if count == 0]
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for child in self.children[name]:
+                if (child, name) in self.cycle_edges:
+                    continue
+                pending[child] -= 1
+                if pending[child] == 0:
+                    ready.append(child)
+
+        self._ancestors = {}
+        for name in order:
+            ancestors = set()
+            for parent in self._acyclic_parents(name):
+                ancestors.add(parent)
+                ancestors |= self._ancestors[parent]
+            self._ancestors[name] = ancestors
+
+        self._descendants = {}
+        for name in reversed(order):
+            descendants = set()
+            for child in self.children[name]:
+                if (child, name) in self.cycle_edges:
+                    continue
+                descendants.add(child)
+                descendants |= self._descendants[child]
+            self._descendants[name] = descendants
+        self._dirty = False
+
+    def _find_cycles(self) -> None:
+        """
+        Depth first search from each device towards its parents
+        An edge to a parent already on the search path closes a cycle
+        """
+        self.cycles = []            # list of cycles, each a list of names
+        self.cycle_edges = set()    # (child, parent) edges closing a cycle
+        state = {}                  # name -> 1 on path, 2 done
+        for start in self.parents:
+            if start in state:
+                continue
+            path = [start]
+            stack = [iter(self.parents[start])]
+            state[start] = 1
+            while stack:
+                parent = next(stack[-1], None)
+                if parent is None:
+                    state[path.pop()] = 2
+                    stack.pop()
+                    continue
+                s = state.get(parent, None)
+                if s is None:
+                    state[parent] = 1
+                    path.append(parent)
+                    stack.append(iter(self.parents[parent]))
+                elif s == 1:
+                    self.cycle_edges.add((path[-1], parent))
+                    self.cycles.append(path[path.index(parent):])
+
+    def _acyclic_parents(self, name: str) -> List[str]:
+        return [parent for parent in self.parents.get(name, []) if (name, parent) not in self.cycle_edges]
+
+    def acyclic_parents(self, name: str) -> List[str]:
+        """
+        Known parents, except a parent that would close a cycle
+        """
+        self._update()
+        return self._acyclic_parents(name)
+
+    def get_parents(self, name: str) -> List[str]:
+        self._update()
+        return self.parents.get(name, [])
+
+    def get_children(self, name: str) -> List[str]:
+        self._update()
+        return self.children.get(name, [])
+
+    def ancestors(self, name: str) -> Set[str]:
+        """
+        All devices upstream of name
+        """
+        self._update()
+        return self._ancestors.get(name, set())
+
+    def descendants(self, name: str) -> Set[str]:
+        """
+        All devices downstream of name
+        """
+        self._update()
+        return self._descendants.get(name, set())
+
+    def roots(self) -> List[str]:
+        """
+        Devices without known parents
+        """
+        self._update()
+        return [name for name, parents in self.parents.items() if not parents]
+
+    def get_problems(self) -> List[str]:
+        """
+        Return unknown parents and cycles, as printable lines
+        """
+        self._update()
+        problems = []
+        for name, parents in self.unknown_parents.items():
+            for parent in parents:
+                problems.append(f"Unknown parent '{parent}' on device '{name}'")
+        for cycle in self.cycles:
+            problems.append(f"Parent cycle {' -> '.join(cycle + [cycle[0]])}")
+        return problems
+
+    def to_dict(self, name: str = None) -> Dict:
+        self._update()
+        if name is not None:
+            return dict(
+                name=name,
+                parents=self.get_parents(name),
+                children=self.get_children(name),
+                unknown_parents=self.unknown_parents.get(name, []),
+                ancestors=sorted(self.ancestors(name)),
+                descendants=sorted(self.descendants(name)),
+            )
+        return dict(
+            devices=len(self.parents),
+            roots=sorted(self.roots()),
+            unknown_parents=self.unknown_parents,
+            cycles=self.cycles,
+        )
@@ -57,6 +57,7 @@ try:
     import lib.base_common as common
     from lib.netbox import Netbox
     from lib.becs import BECS
+    from lib.device_model import Device, Interface
 
 except:
     abutils.send_traceback()    # Error in script, send traceback to developer
@@ -214,7 +215,7 @@ class Becs:
             parents = element._parents
             if parents is None:
                 parents = ""
-            device = AttrDict(
+            device = Device(
                 oid=oid,
                 name=n.long,
                 manufacturer="Waystream",
@@ -233,14 +234,15 @@ class Becs:
                 monitor_librenms=True,
                 backup_oxidized=False,
                 parents=common.commastr_to_list(parents, add_domain=config.default_domain),
-                interfaces=AttrDict(),
-                interfaces_oid=AttrDict(),
+                customer_count=element._customer_count,
+                interfaces={},
+                interfaces_oid={},
             )
 
             for ifname, interface in interfaces.items():
                 prefix4 = interface.get("prefix4", None)
                 prefix6 = interface.get("prefix6", None)
-                i = AttrDict(
+                i = Interface(
                     oid=interface.oid,
                     name=ifname,
                     role=interface.role,
@@ -417,6 +419,10 @@ class Sync:
         if device.parents != becs_device.parents:
             custom_fields.parents = ",".join(becs_device.parents)
 
+        customer_count = becs_device.get("customer_count", None)
+        if customer_count is not None and device.get("customer_count", None) != customer_count:
+            custom_fields.customer_count = customer_count
+
         # use device_template values if None
 
         if not device.alarm_destination:
@@ -95,6 +95,17 @@ def send_json(cmd, data):
     return log_entry
 
 
+def send_nowait(cmd, data):
+    """
+    Send cmd over rabbitmq, do not wait for any response
+    data is dict, will be json formatted
+    """
+    rabbitmq = base_common.Rabbitmq_Mgr(config.rabbitmq)
+    rabbitmq.exchange_cmd_send()
+    rabbitmq.send_cmd(cmd, data)
+    rabbitmq.close()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("cmd", choices=[
@@ -128,11 +139,10 @@ def main():
 
     elif args.cmd == "icinga_process_check_result":
         data = {}
-        for attr in ["host", "service", "exit_status"]:
-            if args[attr]:
-                data[attr] = args[attr]
-        res = send_json("args.cmd", data)
-        print("res", res)
+        for attr, value in vars(args).items():
+            if attr not in ["cmd", "msg"] and value is not None:
+                data[attr] = value
+        send_nowait(args.cmd, data)
 
     else:
         print("Error: unknown cmd", args.cmd)
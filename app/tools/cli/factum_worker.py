@@ -12,11 +12,13 @@ It checks the configuration file in /etc/factum/factum.yaml for the rabbitmq mes
 import os
 import sys
 import json
+import time
 import platform
 import datetime
+import threading
 import subprocess
-import requests
 import multiprocessing
+import concurrent.futures
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
 if sys.prefix == sys.base_prefix:
@@ -47,6 +49,7 @@ try:
     django.setup()
 
     import lib.base_common as common
+    from lib.icinga_api import Icinga_API, Icinga_API_Error
 
     # Import ORM models 
     # from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
@@ -150,6 +153,8 @@ def ping(data):
         if val: roles.append(role)
     handles: str = ", ".join(roles)
     log(f"Ping response: from {platform.node()}. handles {handles}")
+    if check_result_submitter:
+        log(check_result_submitter.format_stats())
     rabbitmq.send_log("Done", msgid=data["xid"])
 
 
@@ -220,48 +225,119 @@ def update_icinga(data):
         )
 
 
+class Check_Result_Submitter:
+    """
+    Submit passive check results to the Icinga API
+    Uses one pooled keep-alive session, and a thread pool with bounded parallelism.
+    If max_pending results are waiting, submit() waits until one is done,
+    calling idle() while waiting so the rabbitmq connection is serviced
+    Keeps counters for throughput and latency
+    """
+
+    def __init__(self, workers: int = 16, max_pending: int = 1000, idle=None):
+        self.icinga_api = Icinga_API(config=config.icinga.api, pool_maxsize=workers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.received = 0
+        self.submitted = 0
+        self.failed = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def submit(self, data) -> None:
+        while not self.pending.acquire(blocking=False):
+            if self.idle:
+                self.idle()
+            else:
+                time.sleep(0.01)
+        with self.lock:
+            self.received += 1
+        self.executor.submit(self._submit, data, time.time())
+
+    def _submit(self, data, received: float) -> None:
+        try:
+            host = data.get("host", None) or data.get("hostname", None)
+            if not host:
+                raise Icinga_API_Error("no host in check result")
+            attrs = {}
+            for attr in ["exit_status", "plugin_output", "performance_data", "check_command",
+                         "check_source", "execution_start", "execution_end", "ttl"]:
+                value = data.get(attr, None)
+                if value is not None:
+                    attrs[attr] = value
+            for attr in ["exit_status", "ttl"]:
+                if attr in attrs:
+                    attrs[attr] = int(attrs[attr])
+            for attr in ["execution_start", "execution_end"]:
+                if attr in attrs:
+                    attrs[attr] = float(attrs[attr])
+            self.icinga_api.process_check_result(host=host, service=data.get("service", None), **attrs)
+            ok = True
+        except (Icinga_API_Error, ValueError) as err:
+            print(f"Error: process-check-result failed, {err}")
+            ok = False
+        finally:
+            self.pending.release()
+
+        latency = time.time() - received
+        with self.lock:
+            if ok:
+                self.submitted += 1
+            else:
+                self.failed += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def get_stats(self, reset: bool = False) -> dict:
+        with self.lock:
+            elapsed = max(time.time() - self.started, 0.001)
+            done = self.submitted + self.failed
+            stats = dict(
+                received=self.received,
+                submitted=self.submitted,
+                failed=self.failed,
+                pending=self.received - done,
+                rate=done / elapsed,
+                latency_avg=self.latency_sum / done if done else 0.0,
+                latency_max=self.latency_max,
+            )
+            if reset:
+                self.started = time.time()
+                self.received -= done
+                self.submitted = self.failed = 0
+                self.latency_sum = self.latency_max = 0.0
+        return stats
+
+    def format_stats(self, reset: bool = False) -> str:
+        s = self.get_stats(reset=reset)
+        return (f"check results: received {s['received']}, submitted {s['submitted']}, failed {s['failed']}, "
+                f"pending {s['pending']}, {s['rate']:.1f}/s, "
+                f"latency avg {s['latency_avg'] * 1000:.1f} ms, max {s['latency_max'] * 1000:.1f} ms")
+
+
+check_result_submitter = None
+
+
 def icinga_process_check_result(data):
+    """
+    Queue a passive check result for submission to Icinga
+    No response is sent, the sender does not wait
+    """
+    global check_result_submitter
     if not config.roles.get("icinga", False):
         return
 
-    try:
-        jdata = json.loads(data)
-    except json.JSONDecodeError(msg, doc, pos):
-        pass
-
-    req_url = "https://localhost:5665/v1/actions/process-check-result"
-    headers = {
-        'Accept': 'application/json',
-    }
-    res = {}
-    hostname = jdata.get("hostname")
-    service = jdata.get("service")
-    if service:
-        res["type"] = "Service"
-        res["filter"] = f"host.name=={hostname} && service.name={service}"
-    else:
-        res["type"] = "Host"
-        res["filter"] = f"host.name=={hostname}"
-
-    for attr in [
-        "exit_status", "plugin_output", "performance_data", "check_command",
-        "check_source", "execution_start", "execution_end", "ttl"
-        ]:
-        if attr in jdata:
-            res[attr] = jdata[attr]
-
-    resp = requests.post(
-        req_url,
-        headers=headers,
-        auth=(config.icinga.api.username, config.icinga.api.password),
-        data=json.dumps(res),
-        verify=False
-    )
-
-    if (resp.status_code == 200):
-        print("Result: " + json.dumps(resp.json(), indent=4, sort_keys=True))
-    else:
-        print(resp.text)
+    if check_result_submitter is None:
+        c = config.icinga.get("check_result", None) or {}
+        check_result_submitter = Check_Result_Submitter(
+            workers=c.get("workers", 16),
+            max_pending=c.get("max_pending", 1000),
+            idle=lambda: rabbitmq.connection.process_data_events(time_limit=0.05),
+        )
+    check_result_submitter.submit(data.get("data", None) or {})
 
 
 def main():
@@ -275,8 +351,19 @@ def main():
     rabbitmq.exchange_cmd_receive()
     print("Waiting for commands from Rabbitmq")
 
-    for data in rabbitmq.receive_cmd():
+    stats_interval = 60
+    stats_time = time.time()
+    for data in rabbitmq.receive_cmd(ack_batch=100, inactivity_timeout=1, batch_cmds={"icinga_process_check_result"}):
+        if check_result_submitter and time.time() - stats_time >= stats_interval:
+            print(check_result_submitter.format_stats(reset=True))
+            stats_time = time.time()
+        if data is None:
+            continue    # No message during inactivity_timeout
         cmd = data.get("cmd", None)
+        if cmd == "icinga_process_check_result":
+            # High rate, no printing per result
+            icinga_process_check_result(data)
+            continue
         print(f"Received command '{cmd}'")
 
         if cmd == "ping":
@@ -293,8 +380,6 @@ def main():
             update_icinga(data)
         elif cmd == "update_oxidized":
             update_oxidized(data)
-        elif cmd == "icinga_process_check_result":
-            icinga_process_check_result(data)
         else:
             print("Unknown cmd", cmd)
 
@@ -112,6 +112,14 @@ def main() -> None:
         print(r.text)
         # base/factum_cli.py update_oxidized
 
+        if config.oxidized.get("mirror", None):
+            print("----- Update oxidized configuration mirror -----")
+            run_cmd("tools/oxidized/config_mirror.py update")
+
+    if config.enabled_roles.get("compliance", False):
+        print("----- Check compliance -----")
+        run_cmd("tools/oxidized/check_compliance.py")
+
     timestamp = timezone.now() - datetime.timedelta(days=1)
     print("Deleting log entries older than", timestamp)
     result = Log_Entry.objects.filter(timestamp__lt=timestamp).delete()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark for lib/config_parser.py
+
+Parses a corpus of device configurations and reports throughput.
+The corpus is either all files in a directory (for example an oxidized
+output directory) or generated sample configs for each supported dialect
+
+Run from the app directory:
+    python3 tools/dns/bench_config_parser.py
+    python3 tools/dns/bench_config_parser.py --dir /var/lib/oxidized/configs
+"""
+
+# python standard modules
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.getcwd())
+
+from lib.config_parser import Config_Parser
+
+
+def sample_ios(n: int, interfaces: int) -> str:
+    lines = [f"hostname r{n}", "!"]
+    for i in range(interfaces):
+        lines += [
+            f"interface GigabitEthernet0/{i}",
+            f" description link {i}",
+            f" ip address 10.{n % 250}.{i % 250}.1 255.255.255.252",
+            f" ipv6 address 2001:db8:{n:x}:{i:x}::1/64",
+            " no shutdown",
+            "!",
+        ]
+    lines += ["router ospf 1", " network 10.0.0.0 0.255.255.255 area 0", "!", "end"]
+    return "\n".join(lines) + "\n"
+
+
+def sample_iosxr(n: int, interfaces: int) -> str:
+    lines = [f"hostname r{n}", "!"]
+    for i in range(interfaces):
+        lines += [
+            f"interface TenGigE0/0/0/{i}",
+            f" description link {i}",
+            f" ipv4 address 10.{n % 250}.{i % 250}.1 255.255.255.252",
+            f" ipv6 address 2001:db8:{n:x}:{i:x}::1/64",
+            "!",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def sample_huawei(n: int, interfaces: int) -> str:
+    lines = [f"sysname r{n}", "#"]
+    for i in range(interfaces):
+        lines += [
+            f"interface GigabitEthernet0/0/{i}",
+            " undo shutdown",
+            f" ip address 10.{n % 250}.{i % 250}.1 255.255.255.252",
+            "#",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def sample_juniper(n: int, interfaces: int) -> str:
+    lines = [f"set system host-name r{n}"]
+    for i in range(interfaces):
+        lines += [
+            f"set interfaces ge-0/0/{i} description \"link {i}\"",
+            f"set interfaces ge-0/0/{i} unit 0 family inet address 10.{n % 250}.{i % 250}.1/30",
+            f"set interfaces ge-0/0/{i} unit 0 family inet6 address 2001:db8:{n:x}:{i:x}::1/64",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def load_corpus(directory: str) -> dict:
+    corpus = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for filename in files:
+            with open(os.path.join(root, filename), errors="replace") as f:
+                corpus[filename] = f.read()
+    return corpus
+
+
+def sample_corpus(devices: int, interfaces: int) -> dict:
+    generators = [sample_ios, sample_iosxr, sample_huawei, sample_juniper]
+    corpus = {}
+    for n in range(devices):
+        corpus[f"r{n}"] = generators[n % len(generators)](n, interfaces)
+    return corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=None, help="Directory with device configurations")
+    parser.add_argument("--devices", type=int, default=1000, help="Number of generated configurations")
+    parser.add_argument("--interfaces", type=int, default=48, help="Interfaces per generated configuration")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.dir:
+        corpus = load_corpus(args.dir)
+    else:
+        corpus = sample_corpus(args.devices, args.interfaces)
+    size = sum(len(conf) for conf in corpus.values())
+    lines = sum(conf.count("\n") for conf in corpus.values())
+    print(f"Corpus: {len(corpus)} configurations, {lines} lines, {size / 1e6:.1f} MB")
+
+    config_parser = Config_Parser()
+    best = None
+    for r in range(args.rounds):
+        records = 0
+        t = time.perf_counter()
+        for hostname, conf in corpus.items():
+            records += len(config_parser.parse(hostname, conf))
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"Records: {records}")
+    print(f"Best of {args.rounds}: {best:.3f} s, "
+          f"{len(corpus) / best:.0f} configs/s, {lines / best / 1e6:.2f} Mlines/s, {size / best / 1e6:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,14 @@
 
 # python standard modules
 import os
-import re
 import sys
-import ipaddress
+import gzip
+import json
+import time
+import hashlib
+import argparse
+import concurrent.futures
+from collections import namedtuple
 
 if sys.prefix == sys.base_prefix:
     print("Error: You must run this script in a python virtual environment")
@@ -21,13 +26,13 @@ if "/opt" not in sys.path:
 try:
     import ablib.utils as abutils
     from ablib.devices import Device_Mgr
-    from ablib.oxidized import Oxidized_Mgr
 except:
     print("Error: Cannot import ablib.* check PYTHONPATH")
     sys.exit(1)
 
 try:
     # modules installed with pip
+    import requests
     from orderedattrdict import AttrDict
 
     # modules, installed with pip, django
@@ -44,101 +49,114 @@ try:
     from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
 
     import lib.base_common as common
+    from lib.oxidized import Oxidized
+    from lib.config_mirror import Config_Mirror
+    from lib.config_parser import Config_Parser, ifname_to_dnsname
+    from lib.inventory import Inventory
 
 except:
     abutils.send_traceback()    # Error in script, send traceback to developer
 
+PARSE_CACHE_FILE = "/var/lib/factum/dns-parse-cache.json.gz"
+PARSE_CACHE_VERSION = 2     # Increase when Config_Parser output changes, invalidates the cache
+DNS_STATE_FILE = "/var/lib/factum/dns-state.json.gz"
 
-def ifname_to_dnsname(hostname, ifname):
-    hostname = hostname.split(".")[0]
-    name = f"{hostname}.{ifname}"
-    name = name.replace("/", "-").replace(" ", "")
-    return name
 
+DNS_Record = namedtuple("DNS_Record", ["hostname", "type", "value", "host"])
 
-class Config_Parser:
+
+class Record_Store:
     """
-    Parse a router/switch config
-    Try to handle different vendors syntax; cisco, huawei etc
-    Extract all interfaces and their IP addresses
-    returns an dict, key is interfacename value is {hostname, type, value}
+    DNS records, indexed by name and by address
+    Each record is put in one of the records file sections when it is added:
+      hosts       device hostname, forward and reverse
+      forward     interface with same address as a hostname, forward only
+      reverse     interface, forward and reverse
+    An interface address that already has a reverse entry is a conflict, and gets forward only
     """
-  
-    def parse(self, records, hostname, conf):
-        ix = 0
-        while ix < len(conf):
-            line = conf[ix]
-            ix += 1
-            if not line.startswith("interface "):
-                continue
-            ifname = line[10:].lower()
-
-            # Shorten interface name if needed, and replace forward slash
-            name = ifname_to_dnsname(hostname, ifname)
-
-            # Loop through all config lines for this interface
-            while ix < len(conf):
-                line = conf[ix].rstrip()
-                ix += 1
-                if line == "" or line[0] == "!" or line[0] == "#":
-                    break   # end if this interface config
-                line = line.strip()
-                if line.startswith("ip address "):
-                    addr = re.split(" |/", line[11:])[0]
-                    try:
-                        tmp = ipaddress.IPv4Address(addr)
-                        record = AttrDict(hostname=name, type="A", value=addr, host=False)
-                        if name not in records:
-                            records[name] = record
-                    except ipaddress.AddressValueError as e:
-                        print(f"Error: host '{name}' , incorrect 'ip address' '{addr}', err '{e}'")
-
-                elif line.startswith("ipv4 address "):
-                    addr = re.split(" |/", line[13:])[0]
-                    try:
-                        tmp = ipaddress.IPv4Address(addr)
-                        record = AttrDict(hostname=name, type="A", value=addr, host=False)
-                        if name not in records:
-                            records[name] = record
-                    except ipaddress.AddressValueError as e:
-                        print(f"Error: host '{name}' , incorrect 'ipv4 address' '{addr}', err '{e}'")
-
-                elif line.startswith("ipv6 address "):
-                    addr = re.split(" |/", line[13:])[0]
-                    try:
-                        tmp = ipaddress.IPv6Address(addr)
-                        record = AttrDict(hostname=name, type="AAAA", value=addr, host=False)
-                        if name not in records:
-                            records[name] = record
-                    except ipaddress.AddressValueError as e:
-                        print(f"Error: host '{name}' , incorrect 'ipv6 address' '{addr}', err '{e}'")
-                        print("Error: hostname '%s', ipv6_addr '%s' incorrect" % (name, addr))
-                
-        return records
+
+    def __init__(self):
+        self.by_name = {}       # key is hostname, value is record
+        self.by_addr = {}       # key is address, value is list of records
+        self.hosts = {}         # key is hostname, value is record
+        self.forward = {}       # key is hostname, value is record
+        self.reverse = {}       # key is address, value is record
+        self.conflicts = []     # list of (reason, record, existing record)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __contains__(self, hostname):
+        return hostname in self.by_name
+
+    def add(self, hostname: str, type_: str, value: str, host: bool = False) -> bool:
+        """
+        Add a record, the first record for a name wins
+        returns False if the name already exist
+        """
+        existing = self.by_name.get(hostname, None)
+        if existing is not None:
+            if existing.type != type_ or existing.value != value:
+                self.conflicts.append(("duplicate name", DNS_Record(hostname, type_, value, host), existing))
+            return False
+
+        record = DNS_Record(hostname, type_, value, host)
+        self.by_name[hostname] = record
+        self.by_addr.setdefault(value, []).append(record)
+
+        existing = self.reverse.get(value, None)
+        if host:
+            self.hosts[hostname] = record
+            if existing is not None:
+                if existing.host:
+                    self.conflicts.append(("duplicate address", record, existing))
+                else:
+                    # Hostname owns the reverse entry, interface with this address is forward only
+                    self.forward[existing.hostname] = existing
+            self.reverse[value] = record
+        elif existing is not None:
+            if not existing.host:
+                self.conflicts.append(("duplicate address", record, existing))
+            self.forward[hostname] = record
+        else:
+            self.reverse[value] = record
+        return True
+
+    def get_sections(self):
+        """
+        returns dict, key is section, value is list of (hostname, type, value, reverse)
+        """
+        return AttrDict(
+            hosts=[(r.hostname, r.type, r.value, True) for r in self.hosts.values()],
+            interfaces_forward=[(r.hostname, r.type, r.value, False) for r in self.forward.values()],
+            interfaces=[(r.hostname, r.type, r.value, True) for r in self.reverse.values() if not r.host],
+        )
+
+    def print_conflicts(self) -> None:
+        for reason, record, existing in self.conflicts:
+            print(f"Error, {reason}, {record.hostname} {record.type} {record.value}, "
+                  f"already used by {existing.hostname} {existing.type} {existing.value}")
 
 
 def add_devices_api_hosts(devices=None, records=None) -> None:
     """
     Go through all devices from Device-API
     - Create record from hostname and management IP address
-    - Adds record to records{}
+    - Adds record to records
     """
     print("----- Adding devices API host addresses -----")
     for name, device in devices.items():
         if device["primary_ip4"]:
             n = common.Name(name)
-            if n.short in records:
-                continue
             addr = device["primary_ip4"]["address"].split("/")[0]    # Remove prefixlen
-            record = AttrDict(hostname=n.short, type="A", value=addr, host=True)
-            records[name] = record
+            records.add(n.short, "A", addr, host=True)
 
 
 def add_devices_api_interfaces(devices=None, records=None) -> None:
     """
     Go through all devices and interfaces from Device-API
     - Convert interface name to something that can be put in DNS
-    - Adds record to records{}
+    - Adds record to records
     """
     print("----- Adding Device-API interface addresses -----")
     for hostname, device in devices.items():
@@ -147,115 +165,278 @@ def add_devices_api_interfaces(devices=None, records=None) -> None:
                 if "prefix4" in interface and interface["prefix4"]:
                     name = ifname_to_dnsname(hostname, ifname)
                     addr = interface["prefix4"][0]["address"].split("/")[0]    # Remove prefixlen
-                    record = AttrDict(hostname=name, type="A", value=addr, host=False)
-                    if name not in records:
-                        records[name] = record
-                    else:
+                    if not records.add(name, "A", addr):
                         print("Error, name conflict, name %s already exist" % name)
 
 
-def parse_device_config(oxidized_mgr=None, devices=None, records=None) -> None:
+def parse_config(hostname: str, device_conf: str):
+    """
+    Parse one device configuration, runs in a worker process
+    Returns list of records
+    """
+    parser = Config_Parser()
+    return parser.parse(hostname, device_conf)
+
+
+def load_parse_cache() -> dict:
+    """
+    Load records from previous run
+    returns dict, key is hostname, value is {mtime, hash, records}
+    """
+    try:
+        with gzip.open(PARSE_CACHE_FILE, "rt") as f:
+            data = json.load(f)
+        if data.get("version") == PARSE_CACHE_VERSION:
+            return data["devices"]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as err:
+        print(f"Warning: Cannot load parse cache, err {err}")
+    return {}
+
+
+def save_parse_cache(cache: dict) -> None:
+    try:
+        with gzip.open(PARSE_CACHE_FILE, "wt") as f:
+            json.dump({"version": PARSE_CACHE_VERSION, "devices": cache}, f)
+    except OSError as err:
+        print(f"Warning: Cannot save parse cache, err {err}")
+
+
+def get_node_mtimes(oxidized=None) -> dict:
+    """
+    Get time of last configuration change for all nodes, with one request
+    returns dict, key is hostname, value is mtime. Empty if oxidized can't tell
+    """
+    try:
+        nodes = oxidized.get_nodes()
+    except (requests.exceptions.RequestException, ValueError) as err:
+        print(f"Warning: Cannot get node list from oxidized, err {err}")
+        return {}
+    mtimes = {}
+    for name, node in nodes.items():
+        mtime = node.get("mtime", None)
+        if mtime and mtime != "unknown":
+            mtimes[name] = str(mtime)
+    return mtimes
+
+
+def parse_device_config(oxidized=None, devices=None, records=None,
+                        jobs: int = None, fetch_jobs: int = 10, refresh: bool = False) -> None:
     """
     Go through all devices from Device-API
-    - fetch last running-configuration file
-    - parse each config file for interface addresses
+    - skip devices where oxidized reports the same config mtime as last run, use cached records
+    - fetch last running-configuration file, fetch_jobs concurrent requests to oxidized
+    - skip parsing if config content is unchanged since last run, use cached records
+    - as each config arrives, parse it for interface addresses in a pool of worker processes
     - Convert interface name to something that can be put in DNS
-    - Adds record to records{}
+    - Adds record to records, in device order. First record for a name wins
     """
     print("----- Parsing all devices configuration, searching for interface IP addresses -----")
-    parser = Config_Parser()
-    for hostname, device in devices.items():
-        if "backup_oxidized" in device and device["backup_oxidized"] == False:
-            # print("  Ignoring backup_oxidized' is False, hostname '%s'" % hostname)
-            continue
-        if "platform" in device and device["platform"] in config.sync_dns.ignore_platforms:
-            # print("  Ignoring platform '%s', hostname '%s'" % (device["platform"], hostname))
-            continue
-        if "model" in device and device["model"] in config.sync_dns.ignore_models:
-            # print("  Ignoring model '%s', hostname '%s'" % (device["model"], hostname))
-            continue
-
-        device_conf = oxidized_mgr.get_device_config(hostname)
-        if device_conf is not None:
-            tmp_records = parser.parse(records, hostname, device_conf.split("\n"))
+    inventory = Inventory(devices)
+    mask = ~inventory.false("backup_oxidized") & \
+        ~inventory.isin("platform", config.sync_dns.ignore_platforms) & \
+        ~inventory.isin("model", config.sync_dns.ignore_models)
+    hostnames = list(inventory.select(mask))
+
+    cache = {} if refresh else load_parse_cache()
+    mtimes = get_node_mtimes(oxidized=oxidized)
+    new_cache = {}  # key is hostname, value is {mtime, hash, records}
+    parsed = {}     # key is hostname, value is future with list of records
+    fetch_hostnames = []
+    for hostname in hostnames:
+        entry = cache.get(hostname, None)
+        mtime = mtimes.get(hostname, None)
+        if entry and mtime and entry["mtime"] == mtime:
+            new_cache[hostname] = entry
         else:
-            print("Warning: Missing configuration backup for %s" % hostname)
+            fetch_hostnames.append(hostname)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=fetch_jobs) as fetcher:
+        fetches = {fetcher.submit(oxidized.get_device_config, hostname): hostname for hostname in fetch_hostnames}
+        for fetch in concurrent.futures.as_completed(fetches):
+            hostname = fetches[fetch]
+            device_conf = fetch.result()
+            if device_conf is None:
+                print("Warning: Missing configuration backup for %s" % hostname)
+                continue
+            digest = hashlib.sha256(device_conf.encode()).hexdigest()
+            entry = cache.get(hostname, None)
+            if entry and entry["hash"] == digest:
+                entry["mtime"] = mtimes.get(hostname, None)
+                new_cache[hostname] = entry
+            else:
+                new_cache[hostname] = dict(mtime=mtimes.get(hostname, None), hash=digest, records=None)
+                parsed[hostname] = executor.submit(parse_config, hostname, device_conf)
+
+        for hostname, future in parsed.items():
+            new_cache[hostname]["records"] = future.result()
+
+    # Merge in device order, gives the same result regardless of which fetch or worker finished first
+    for hostname in hostnames:
+        if hostname in new_cache:
+            for name, type_, value in new_cache[hostname]["records"]:
+                records.add(name, type_, value)
 
+    save_parse_cache(new_cache)
+    print(f"{len(hostnames)} configurations, fetched {len(fetch_hostnames)}, parsed {len(parsed)}")
 
-def write_dnsmgr_records(devices, records) -> None:
+
+def get_dnsmgr_records_file(entries) -> str:
     """
-    Write a DnsMgr records file, and ask DnsMgr to update nameserver
+    Return DnsMgr records file content
     """
-    print("----- Writing dnsmgr records -----")
-    addr4 = {}
-
-    with open(config.sync_dns.dest_record_file, "w") as f:
-        f.write(";\n")
-        f.write("; Autogenerated from devices management address\n")
-        f.write(";\n")
-        f.write("$DOMAIN %s\n" % config.default_domain)
-
-        # Write forward entries, hostname
-        f.write(";\n")
-        f.write("; Forward entries, hostname\n")
-        f.write(";\n")
-        f.write("\n")
-        f.write("$FORWARD 1\n")
-        f.write("$REVERSE 1\n")
-        f.write("\n")
-        for record in records.values():
-            if record.host:
-                addr4[record.value] = 1
-                f.write("%-40s  %-4s   %s\n" % (record.hostname, record.type, record.value))
-
-        # Write forward entries, names that should not have reverse DNS
-        # typically loopbacks, which already have hostname entry
-        f.write(";\n")
-        f.write("; Forward entries, interfaces\n")
-        f.write(";\n")
-        f.write("\n")
-        f.write("$FORWARD 1\n")
-        f.write("$REVERSE 0\n")
-        f.write("\n")
-        for record in records.values():
-            if not record.host:
-                if record.value in addr4:
-                    f.write("%-40s  %-4s   %s\n" % (record.hostname, record.type, record.value))
-
-        # Write reverse entries
-        f.write(";\n")
-        f.write("; Reverse entries, interfaces\n")
-        f.write(";\n")
-        f.write("\n")
-        f.write("$FORWARD 1\n")
-        f.write("$REVERSE 1\n")
-        f.write("\n")
-        f.write(";\n")
-        for record in records.values():
-            if not record.host:
-                if record.value not in addr4:
-                    f.write("%-40s  %-4s   %s\n" % (record.hostname, record.type, record.value))
+    lines = [
+        ";",
+        "; Autogenerated from devices management address",
+        ";",
+        "$DOMAIN %s" % config.default_domain,
+    ]
+    for header, forward, reverse, section, extra in [
+            ("Forward entries, hostname", 1, 1, entries.hosts, []),
+            ("Forward entries, interfaces", 1, 0, entries.interfaces_forward, []),
+            ("Reverse entries, interfaces", 1, 1, entries.interfaces, [";"]),
+            ]:
+        lines += [";", f"; {header}", ";", "", f"$FORWARD {forward}", f"$REVERSE {reverse}", ""] + extra
+        for hostname, type_, value, _ in section:
+            lines.append("%-40s  %-4s   %s" % (hostname, type_, value))
+    return "\n".join(lines) + "\n"
+
+
+def load_dns_state():
+    """
+    Load records published in last run
+    returns set of (hostname, type, value, reverse), or None if unknown
+    """
+    try:
+        with gzip.open(DNS_STATE_FILE, "rt") as f:
+            return set(tuple(entry) for entry in json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as err:
+        print(f"Warning: Cannot load DNS state, err {err}")
+    return None
+
 
+def save_dns_state(state: set) -> None:
+    try:
+        with gzip.open(DNS_STATE_FILE, "wt") as f:
+            json.dump(sorted(state), f)
+    except OSError as err:
+        print(f"Warning: Cannot save DNS state, err {err}")
+
+
+def publish_nsupdate(added: list, removed: list) -> bool:
+    """
+    Publish changes as RFC 2136 dynamic updates
+    returns True if all changes was sent
+    """
+    from lib.nsupdate import Nsupdate, Nsupdate_Error
+
+    print("----- Sending dynamic updates to nameserver -----")
+    try:
+        nsupdate = Nsupdate(config=config.sync_dns.nsupdate, domain=config.default_domain)
+        nsupdate.send(added=added, removed=removed)
+    except Nsupdate_Error as err:
+        print(f"Error: nsupdate failed, {err}")
+        return False
+    return True
+
+
+def publish_dnsmgr() -> None:
     print("----- Request dnsmgr to update DNS/bind -----")
     os.system("/opt/dnsmgr/dnsmgr.py update --loglevel warning")
 
 
+def write_dnsmgr_records(devices, records, force: bool = False) -> None:
+    """
+    Write a DnsMgr records file, and publish changes since last run
+    - No changes, nothing is done
+    - If sync_dns.nsupdate is configured, changes are sent as dynamic updates to the changed zones
+    - Otherwise, or if dynamic update fails, ask DnsMgr to update nameserver
+    """
+    print("----- Writing dnsmgr records -----")
+    records.print_conflicts()
+    entries = records.get_sections()
+    content = get_dnsmgr_records_file(entries)
+    state = set(entries.hosts + entries.interfaces_forward + entries.interfaces)
+
+    try:
+        with open(config.sync_dns.dest_record_file, "r") as f:
+            old_content = f.read()
+    except FileNotFoundError:
+        old_content = None
+    old_state = None if force else load_dns_state()
+
+    if old_state is not None:
+        added = sorted(state - old_state)
+        removed = sorted(old_state - state)
+        print(f"DNS records, {len(added)} added, {len(removed)} removed")
+        if not added and not removed and content == old_content:
+            print("No DNS changes, nothing to publish")
+            return
+
+    if content != old_content:
+        with open(config.sync_dns.dest_record_file, "w") as f:
+            f.write(content)
+
+    nsupdate_config = config.sync_dns.get("nsupdate", None)
+    max_changes = nsupdate_config.get("max_changes", 1000) if nsupdate_config else 0
+    if old_state is not None and nsupdate_config and len(added) + len(removed) <= max_changes:
+        if not publish_nsupdate(added=added, removed=removed):
+            publish_dnsmgr()
+    else:
+        publish_dnsmgr()
+    save_dns_state(state)
+
+
 def main() -> None:
     # Use systems ca certificates
     # os.environ["REQUESTS_CA_BUNDLE"] = "/etc/ssl/certs/ca-certificates.crt"
 
-    records = AttrDict()
-
-    oxidized_mgr = Oxidized_Mgr(config=config.oxidized)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of processes parsing device configurations")
+    parser.add_argument("--fetch-jobs", type=int, default=config.sync_dns.get("fetch_jobs", 10),
+                        help="Number of concurrent requests fetching configurations from oxidized")
+    parser.add_argument("--refresh", action="store_true", default=False,
+                        help="Ignore cached records, fetch and parse all configurations")
+    parser.add_argument("--force", action="store_true", default=False,
+                        help="Publish all records with dnsmgr, even if nothing has changed")
+    args = parser.parse_args()
+
+    records = Record_Store()
+
+    if config.oxidized.get("mirror", None):
+        # Read configurations from the local mirror, same interface as Oxidized
+        print("----- Update oxidized configuration mirror -----")
+        t = time.time()
+        oxidized = Config_Mirror(config=config.oxidized.mirror)
+        oxidized.update()
+        print(f"Updated mirror in {time.time() - t:.1f} s")
+    else:
+        oxidized = Oxidized(config=config.oxidized, pool_maxsize=args.fetch_jobs)
 
     print("----- Get devices from Device-API -----")
+    t = time.time()
     device_mgr = Device_Mgr(config=config.api.device)
     devices = device_mgr.get_devices()
+    print(f"Got {len(devices)} devices in {time.time() - t:.1f} s")
     
+    t = time.time()
     add_devices_api_hosts(devices=devices, records=records)
     add_devices_api_interfaces(devices=devices, records=records)
-    parse_device_config(oxidized_mgr=oxidized_mgr, devices=devices, records=records)
-    write_dnsmgr_records(devices, records)
+    print(f"Added Device-API records in {time.time() - t:.1f} s")
+
+    t = time.time()
+    parse_device_config(oxidized=oxidized, devices=devices, records=records,
+                        jobs=args.jobs, fetch_jobs=args.fetch_jobs, refresh=args.refresh)
+    print(f"Fetched and parsed device configurations in {time.time() - t:.1f} s")
+
+    t = time.time()
+    write_dnsmgr_records(devices, records, force=args.force)
+    print(f"Wrote records and published DNS in {time.time() - t:.1f} s")
 
 
 if __name__ == "__main__":
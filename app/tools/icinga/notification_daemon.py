@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Notification daemon for Icinga2
+
+Receives notifications from mail_notification.py over a unix socket, and
+sends them as email. Config, Icinga API session and SMTP connection are
+kept between notifications, and the list of hosts/services down is shared
+by all notifications within notify.snapshot_window seconds.
+
+If notify.digest_window is set, notifications to the same recipient are
+collected for that many seconds and sent as one digest email.
+
+Protocol, one request per connection:
+    client sends one line, JSON {"argv": [<mail_notification.py arguments>]}
+    daemon replies one line, "OK" or "ERROR <message>"
+"""
+
+import os
+import grp
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+
+if sys.prefix == sys.base_prefix:
+    print("Error: You must run this script in a python venv")
+    sys.exit(1)
+
+if "/opt" not in sys.path:
+    sys.path.insert(0, "/opt")
+try:
+    import ablib.utils as abutils
+except:
+    print("Error: Cannot import ablib.* check PYTHONPATH")
+    sys.exit(1)
+
+try:
+    sys.path.append(os.getcwd())
+    from lib.notification import Notifier, Notification_Error, Coalescer, SOCKET_FILE
+except:
+    abutils.send_traceback()    # Error in script, send traceback to developer
+
+CONFIG_FILE = "/etc/factum/factum.yaml"
+
+# Load configuration
+config = abutils.load_config(CONFIG_FILE)
+
+abutils.Name.default_domain = config.default_domain
+
+notifier = None
+notifications = None    # queue with batches to send, each batch a list of args
+coalescer = None
+
+
+class Notification_Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            args = notifier.parse_args(request["argv"])
+        except (ValueError, KeyError, TypeError, Notification_Error) as err:
+            print(f"Error: Incorrect notification, {err}")
+            self.wfile.write(f"ERROR {err}\n".encode())
+            return
+        if coalescer:
+            coalescer.add(args)
+        else:
+            notifications.put([args])
+        self.wfile.write(b"OK\n")
+
+
+class Notification_Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def worker():
+    """
+    Send queued notifications
+    """
+    while True:
+        batch = notifications.get()
+        recipient = batch[0].USEREMAIL
+        try:
+            notifier.notify_batch(batch)
+            if len(batch) == 1:
+                print(f"Sent to {recipient}: {batch[0].NOTIFICATIONTYPE} {batch[0].HOSTNAME}")
+            else:
+                print(f"Sent to {recipient}: digest with {len(batch)} notifications")
+        except Exception as err:
+            print(f"Error: Could not send notification to {recipient}, err {err}")
+        notifications.task_done()
+
+
+def flusher():
+    """
+    Move due digest batches to the send queue
+    """
+    while True:
+        time.sleep(1)
+        for batch in coalescer.get_due():
+            notifications.put(batch)
+
+
+def main():
+    global notifier, notifications, coalescer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=config.notify.get("socket", SOCKET_FILE))
+    parser.add_argument("--socket-group", default=config.notify.get("socket_group", "nagios"),
+                        help="Group that can connect to the socket, the group Icinga runs as")
+    parser.add_argument("--workers", type=int, default=config.notify.get("workers", 2))
+    args = parser.parse_args()
+
+    notifier = Notifier(config=config)
+    notifications = queue.Queue()
+    for _ in range(args.workers):
+        threading.Thread(target=worker, daemon=True).start()
+    if notifier.digest_window > 0:
+        coalescer = Coalescer(window=notifier.digest_window)
+        threading.Thread(target=flusher, daemon=True).start()
+
+    os.makedirs(os.path.dirname(args.socket), exist_ok=True)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = Notification_Server(args.socket, Notification_Handler)
+    # Only the owner and the Icinga group may send notifications
+    try:
+        os.chown(args.socket, -1, grp.getgrnam(args.socket_group).gr_gid)
+    except (KeyError, OSError) as err:
+        print(f"Warning: Cannot set group '{args.socket_group}' on {args.socket}, err {err}")
+    os.chmod(args.socket, 0o660)
+    print(f"Listening on {args.socket}, {args.workers} workers, digest window {notifier.digest_window} seconds")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        if coalescer:
+            for batch in coalescer.get_due(flush=True):
+                notifications.put(batch)
+        notifications.join()
+        notifier.mailer.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except:
+        abutils.send_traceback()    # Error in script, send traceback to developer
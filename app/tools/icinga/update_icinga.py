@@ -7,6 +7,10 @@ Write configuration file for icinga2
 # python standard modules
 import os
 import sys
+import gzip
+import json
+import hashlib
+import argparse
 
 if "/opt" not in sys.path:
     sys.path.insert(0, "/opt")
@@ -37,14 +41,27 @@ try:
     # Import ORM models 
     from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
     import lib.base_common as common
+    from lib.icinga_api import Icinga_API
+    from lib.inventory import Inventory
+    from lib.topology import Topology
 
 except:
     abutils.send_traceback()    # Error in script, send traceback to developer
 
 
+RENDER_CACHE_FILE = "/var/lib/factum/icinga-render-cache.json.gz"
+RENDER_CACHE_VERSION = 2    # Increase when render_device() output changes, invalidates the cache
+DEFAULT_HOSTS_DIR = "/etc/icinga2/conf.d/factum-hosts"
+DEFAULT_SHARDS = 32
+OLD_HOSTS_FILE = "/etc/icinga2/conf.d/ab-devices-hosts.conf"   # Before hosts_dir, removed if it exists
+
 users = {}   # Key is email address
 
 icinga = None
+topology = None
+
+jinja_env = jinja2.Environment(loader=jinja2.BaseLoader())
+templates = {}  # Key is template name in config.icinga_sync, value is {text, template}
 
 
 def create_conf_file(filename, message=""):
@@ -61,95 +78,191 @@ def create_conf_file(filename, message=""):
     return f
 
 
-def write_devices(devices, changed=False):
+def get_template(name: str):
     """
+    Return compiled jinja2 template from config.icinga_sync, each template is compiled once
     """
-    print()
-    print("----- Writing config:", config.icinga_sync.hosts_file.tmp, "-----")
-    host_template = jinja2.Environment(
-        loader=jinja2.BaseLoader()).from_string(config.icinga_sync.host_template
-    )
+    text = config.icinga_sync[name]
+    template = templates.get(name, None)
+    if template is None or template.text != text:
+        template = AttrDict(text=text, template=jinja_env.from_string(text))
+        templates[name] = template
+    return template.template
 
-    f = create_conf_file(config.icinga_sync.hosts_file.tmp, "%s hosts" % len(devices))
 
-    # ----- write hosts -----
-    for name, device in devices.items():
-        if name in config.icinga_sync.ignore_devices:
-            continue
-        if not device.enabled:
-            print("  Ignoring %s, device is not enabled" % device["name"])
-            continue
-        if not device.primary_ip4:
-            print(f"  Ignoring device '{name}', no primary_ip4")
-            continue
-        p = AttrDict()
-        p.options = []
-        
-        if device.parents:
-            p.options.append("  vars.pe_parents = [")
-            for parent in device.parents:
-                p.options.append('    %s,' % icinga.quote(parent))
-            p.options.append("  ]")
+def load_render_cache() -> dict:
+    """
+    Load rendered host configuration and shard hashes from last run
+    returns dict, hosts: key is name, value is {hash, text}
+                  shards: key is filename, value is hash
+    """
+    try:
+        with gzip.open(RENDER_CACHE_FILE, "rt") as f:
+            data = json.load(f)
+        if data.get("version") == RENDER_CACHE_VERSION:
+            return {"hosts": data["hosts"], "shards": data["shards"]}
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as err:
+        print(f"Warning: Cannot load render cache, err {err}")
+    return {"hosts": {}, "shards": {}}
+
+
+def save_render_cache(cache: dict) -> None:
+    try:
+        with gzip.open(RENDER_CACHE_FILE, "wt") as f:
+            json.dump({"version": RENDER_CACHE_VERSION, **cache}, f)
+    except OSError as err:
+        print(f"Warning: Cannot save render cache, err {err}")
 
-        alarm_destination = device.get("alarm_destination", None)
-        if alarm_destination:
-            p.options.append("  vars.pe_alarm_destination = [%s]" % icinga.quote(alarm_destination))
-            if alarm_destination not in users:
-                users[alarm_destination] = 1
-        else:
-            p.options.append(config.icinga_sync.default_notification)
 
-        alarm_timeperiod = device.get("alarm_timeperiod", None)
-        if alarm_timeperiod:
-            p.options.append(f'  vars.pe_alarm_timeperiod = "{alarm_timeperiod}"')
+def get_shard(name: str, shards: int) -> int:
+    return int(hashlib.sha1(name.encode()).hexdigest()[:8], 16) % shards
 
-        backup_oxidized = device.get("backup_oxidized", None)
-        if backup_oxidized:
-            p.options.append("  vars.pe_backup_oxidized = true")
 
-        p.options = "\n".join(p.options)
-        device.comments = icinga.quote(device.comments) # ugly
+def install_shard(filename: str, content: str) -> None:
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, filename)
 
-        data = host_template.render(device=device, p=p)
-        f.write(data)
 
-    # ----- Write dependencies -----
-    f.write("\n")
-    f.write("\n")
-    f.write("// %s\n" % ("-"*76))
-    f.write("\n")
-    dependency_template = jinja2.Environment(
-        loader=jinja2.BaseLoader()).from_string(config.icinga_sync.dependency_template
-    )
-    for name, device in devices.items():
+def render_device(name, device, devices) -> str:
+    """
+    Render host and dependency objects for one device
+    """
+    p = AttrDict()
+    p.options = []
+    
+    if device.parents:
+        p.options.append("  vars.pe_parents = [")
+        for parent in device.parents:
+            p.options.append('    %s,' % icinga.quote(parent))
+        p.options.append("  ]")
+
+    alarm_destination = device.get("alarm_destination", None)
+    if alarm_destination:
+        p.options.append("  vars.pe_alarm_destination = [%s]" % icinga.quote(alarm_destination))
+    else:
+        p.options.append(config.icinga_sync.default_notification)
+
+    alarm_timeperiod = device.get("alarm_timeperiod", None)
+    if alarm_timeperiod:
+        p.options.append(f'  vars.pe_alarm_timeperiod = "{alarm_timeperiod}"')
+
+    backup_oxidized = device.get("backup_oxidized", None)
+    if backup_oxidized:
+        p.options.append("  vars.pe_backup_oxidized = true")
+
+    customer_count = device.get("customer_count", None)
+    if customer_count is not None:
+        p.options.append(f"  vars.pe_customer_count = {int(customer_count)}")
+
+    p.options = "\n".join(p.options)
+    device.comments = icinga.quote(device.comments) # ugly
+
+    data = [get_template("host_template").render(device=device, p=p), "\n"]
+
+    # ----- dependencies -----
+    for parent in topology.acyclic_parents(name):
+        if devices[parent].enabled:
+            p = AttrDict()
+            p.depname = f"host-{parent}_host-{name}"
+            p.parent = parent
+            data.append(get_template("dependency_template").render(device=device, p=p))
+            data.append("\n")
+    return "".join(data)
+
+
+def get_render_hash(name, device, devices) -> str:
+    """
+    Hash of everything that affects the rendered configuration for a device
+    """
+    parents = [(parent, bool(devices[parent].enabled)) for parent in topology.acyclic_parents(name)]
+    data = json.dumps([
+        device,
+        parents,
+        config.icinga_sync.host_template,
+        config.icinga_sync.dependency_template,
+        config.icinga_sync.default_notification,
+    ], sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def write_devices(devices, changed=False):
+    """
+    Write hosts and dependencies, sharded over a number of files in hosts_dir
+    Devices are only rendered if their data has changed since last run,
+    and only changed shard files are written
+    """
+    hosts_dir = config.icinga_sync.get("hosts_dir", DEFAULT_HOSTS_DIR)
+    shards = config.icinga_sync.get("shards", DEFAULT_SHARDS)
+    print()
+    print(f"----- Writing config: {hosts_dir}, {shards} files -----")
+    os.makedirs(hosts_dir, exist_ok=True)
+
+    cache = load_render_cache()
+    new_cache = {"hosts": {}, "shards": {}}
+    shard_data = [[] for i in range(shards)]    # list of (hash, text) per shard
+    rendered = 0
+    for name in sorted(devices):
+        device = devices[name]
         if name in config.icinga_sync.ignore_devices:
             continue
         if not device.enabled:
+            print("  Ignoring %s, device is not enabled" % device["name"])
             continue
-        if not device.parents:
-            continue
-        parents = device.get("parents", None)
-        if not parents:
+        if not device.primary_ip4:
+            print(f"  Ignoring device '{name}', no primary_ip4")
             continue
-        for parent in parents:
-            if parent not in devices:
-                print(f"Warning: Unknown parent '{parent}' on device '{name}'")
-                continue
-            if devices[parent].enabled:
-                p = AttrDict()
-                p.depname = f"host-{parent}_host-{name}"
-                p.parent = parent
-                data = dependency_template.render(device=device, p=p)
-                f.write(data)
-                f.write("\n")
-        f.write("\n")
-    f.close()
 
-    t = config.icinga_sync.hosts_file
-    changed = abutils.install_conf_file(src=t.tmp, 
-                                      dst=t.dst, 
-                                      changed=changed)
-    return changed
+        alarm_destination = device.get("alarm_destination", None)
+        if alarm_destination and alarm_destination not in users:
+            users[alarm_destination] = 1
+
+        digest = get_render_hash(name, device, devices)
+        entry = cache["hosts"].get(name, None)
+        if entry is None or entry["hash"] != digest:
+            entry = dict(hash=digest, text=render_device(name, device, devices))
+            rendered += 1
+        new_cache["hosts"][name] = entry
+        shard_data[get_shard(name, shards)].append(entry)
+
+    # A shard hash is calculated from its hosts hashes, unchanged shards are not written
+    installed = 0
+    filenames = set()
+    for ix, entries in enumerate(shard_data):
+        filename = os.path.join(hosts_dir, f"hosts-{ix:03d}.conf")
+        filenames.add(filename)
+        digest = hashlib.sha1("".join(entry["hash"] for entry in entries).encode()).hexdigest()
+        new_cache["shards"][filename] = digest
+        if cache["shards"].get(filename, None) == digest and os.path.exists(filename):
+            continue
+        header = "//\n// Auto-generated. Note: do not edit this file, your changes will be overwritten/lost\n"
+        header += f"// {len(entries)} hosts\n//\n\n"
+        install_shard(filename, header + "".join(entry["text"] for entry in entries))
+        installed += 1
+
+    # Remove files from an earlier, larger, number of shards
+    for filename in os.listdir(hosts_dir):
+        path = os.path.join(hosts_dir, filename)
+        if filename.endswith(".conf") and path not in filenames:
+            os.remove(path)
+            installed += 1
+
+    # Remove old single hosts file, its objects are now in hosts_dir. The hosts_file
+    # setting may already be gone from the config, so also check the old default path
+    old_hosts_files = {OLD_HOSTS_FILE}
+    if config.icinga_sync.get("hosts_file", None):
+        old_hosts_files.add(config.icinga_sync.hosts_file.dst)
+    for old_hosts_file in old_hosts_files:
+        if os.path.exists(old_hosts_file):
+            os.remove(old_hosts_file)
+            installed += 1
+
+    save_render_cache(new_cache)
+    print(f"Rendered {rendered} of {len(new_cache['hosts'])} hosts, {installed} files changed")
+    return changed or installed > 0
 
 
 def write_users(changed=False):
@@ -174,8 +287,104 @@ def write_users(changed=False):
     return changed
 
 
+def get_api_objects(devices):
+    """
+    Build desired hosts, dependencies and users, as Icinga API objects
+    returns AttrDict with hosts, dependencies and users, each a dict, key is object name, value is attrs
+    """
+    api_config = config.icinga_sync.get("api", None) or AttrDict()
+    default_vars = api_config.get("default_vars", None) or {}
+    objects = AttrDict(hosts={}, dependencies={}, users={})
+
+    for name, device in devices.items():
+        if name in config.icinga_sync.ignore_devices:
+            continue
+        if not device.enabled:
+            print("  Ignoring %s, device is not enabled" % device["name"])
+            continue
+        if not device.primary_ip4:
+            print(f"  Ignoring device '{name}', no primary_ip4")
+            continue
+
+        v = {
+            "pe_location": device.get("location", None) or "",
+            "pe_manufacturer": device.get("manufacturer", None) or "",
+            "pe_model": device.get("model", None) or "",
+            "pe_role": device.get("role", None) or "",
+            "pe_platform": device.get("platform", None) or "",
+            "pe_comments": device.get("comments", None) or "",
+            "pe_site_name": device.get("site_name", None) or "",
+        }
+        parents = device.get("parents", None) or []
+        if parents:
+            v["pe_parents"] = list(parents)
+
+        customer_count = device.get("customer_count", None)
+        if customer_count is not None:
+            v["pe_customer_count"] = int(customer_count)
+
+        alarm_destination = device.get("alarm_destination", None)
+        if alarm_destination:
+            v["pe_alarm_destination"] = [alarm_destination]
+            objects.users[alarm_destination] = {"display_name": alarm_destination, "email": alarm_destination}
+        else:
+            v.update(default_vars)
+
+        alarm_timeperiod = device.get("alarm_timeperiod", None)
+        if alarm_timeperiod:
+            v["pe_alarm_timeperiod"] = alarm_timeperiod
+
+        if device.get("backup_oxidized", None):
+            v["pe_backup_oxidized"] = True
+
+        objects.hosts[name] = {
+            "address": device.primary_ip4.address.split("/")[0],
+            "vars": v,
+        }
+
+        for parent in topology.acyclic_parents(name):
+            if devices[parent].enabled:
+                objects.dependencies[f"{name}!host-{parent}_host-{name}"] = {
+                    "parent_host_name": parent,
+                    "child_host_name": name,
+                    "ignore_soft_states": False,
+                }
+
+    # Dependencies to parents that are not monitored
+    for depname, attrs in list(objects.dependencies.items()):
+        if attrs["parent_host_name"] not in objects.hosts:
+            del objects.dependencies[depname]
+    return objects
+
+
+def sync_api(devices) -> None:
+    """
+    Create, update and delete hosts, dependencies and users through the Icinga API
+    Only differing objects are changed, no reload of Icinga is needed
+    """
+    print("\n----- Sync objects through Icinga API -----")
+    api_config = config.icinga_sync.get("api", None) or AttrDict()
+    icinga_api = Icinga_API(config=config.icinga.api)
+    objects = get_api_objects(devices)
+    templates = api_config.get("host_templates", ["generic-host"])
+
+    changes = 0
+    # Hosts must exist before their dependencies, deleting a host also deletes its dependencies
+    changes += icinga_api.sync_objects("hosts", objects.hosts, templates=templates, delete=False)
+    changes += icinga_api.sync_objects("dependencies", objects.dependencies)
+    changes += icinga_api.delete_objects("hosts", objects.hosts)
+    changes += icinga_api.sync_objects("users", objects.users)
+    print(f"{len(objects.hosts)} hosts, {len(objects.dependencies)} dependencies, "
+          f"{len(objects.users)} users, {changes} changes")
+
+
 def main():
-    global icinga
+    global icinga, topology
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["file", "api"], default=config.icinga_sync.get("mode", "file"),
+                        help="file: write configuration files and reload, api: sync objects through Icinga API")
+    args = parser.parse_args()
 
     icinga = Icinga(config=config.icinga)
 
@@ -184,16 +393,22 @@ def main():
     tmp_devices = device_mgr.get_devices()
 
     print("----- Filter devices to monitor -----")
-    devices = AttrDict()  # Key is name
-    for name, device in tmp_devices.items():
-        if not device.monitor_icinga:
-            # print(f"  Ignoring '{name}', 'monitor_icinga' is False")
-            continue
-        devices[name] = device
+    inventory = Inventory(tmp_devices)
+    devices = AttrDict(inventory.select(inventory.true("monitor_icinga")))  # Key is name
+
+    print("----- Check parents -----")
+    topology = Topology()
+    topology.build(devices)
+    for problem in topology.get_problems():
+        print(f"Warning: {problem}")
 
     print("\n----- Write /etc/hosts entries -----")
     device_mgr.write_etc_hosts()
 
+    if args.mode == "api":
+        sync_api(devices)
+        return
+
     changed = False   # Default, no changes => no reload
     changed = write_devices(devices, changed=changed)
     changed = write_users(changed=changed)
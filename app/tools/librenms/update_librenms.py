@@ -18,7 +18,7 @@ Syncs devices in librenms, based on device-api
 # python standard modules
 import os
 import sys
-import re
+import concurrent.futures
 
 # Assumes PYTHONPATH is set so ablib can be imported
 if "/opt" not in sys.path:
@@ -50,93 +50,101 @@ try:
     # from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
 
     import lib.base_common as common
+    from lib.alarm_policy import Alarm_Policy
+    from lib.inventory import Inventory
+    from lib.librenms import Librenms, Librenms_Error, Change_Queue, snmp_probe
+    from lib.topology import Topology
 
 except:
     abutils.send_traceback()    # Error in script, send traceback to developer
 
 
-roles_enabled_compiled = []
-interfaces_disabled_compiled = []
+alarm_policy = None
 
 
-def sync_interfaces(name, librenms_mgr, librenms_device, device):
-    # Get interfaces from librenms
-    librenms_interfaces = librenms_mgr.get_device_interfaces(name)
-    if librenms_interfaces is None:
-        print("  Error: No interfaces in Librenms found")
+def sync_interfaces(librenms, librenms_mgr, librenms_devices, devices, changes):
+    """
+    Set ignore flag on all ports in librenms
+    All ports are fetched in one request, and matched against device-api
+    interfaces using ifname, ifalias, ifdescr in that order
+    Changes are added to the change queue
+    """
+    try:
+        ports = librenms.get_ports()
+    except Librenms_Error as err:
+        print(f"  Error: Cannot get ports from Librenms, err {err}")
         return
-    
-    device_interfaces = device.interfaces
-
-    # Default for all ports comes from device api, "alarm_interfaces"
-    # If device is from netbox
-    #    ignore = netbox custom field "alarm_interfaces"
-    #    if interface has tag uplink or tag "librenms_alert_enable", ignore = 0
-    #    if interface has tag "librenms_alert_disabled", ignore = 1
-    # If device is from BECS
-    #    ignore = 0
-    #    if interface has role uplink.* then ignore = 1
-    for librenms_interface in librenms_interfaces.values():
-
-        if librenms_interface.ifname in device_interfaces:
-            librenms_interface_name = librenms_interface.ifname
-        elif librenms_interface.ifalias in device_interfaces:
-            librenms_interface_name = librenms_interface.ifalias
-        elif librenms_interface.ifdescr in device_interfaces:
-            librenms_interface_name = librenms_interface.ifdescr
-        else:
-            librenms_interface_name = None
+    print(f"    Got {len(ports)} ports from Librenms")
 
-        if device.alarm_interfaces:  # Default for interfaces in this device
-            ignore = 0
+    names = {}      # device_id -> device name
+    for name, librenms_device in librenms_devices.items():
+        if name in devices:
+            names[librenms_device.device_id] = name
+    index = alarm_policy.evaluate(devices)
+
+    for port in ports:
+        name = names.get(port["device_id"], None)
+        if name is None:
+            continue    # Not in device-api
+        device = devices[name]
+        decision = None
+        for key in ("ifname", "ifalias", "ifdescr"):
+            decision = index.get((name, port.get(key, None)), None)
+            if decision:
+                break
+        if decision:
+            ignore, role = decision
         else:
-            ignore = 1
-        role = ""
-
-        if librenms_interface_name:
-            device_interface = device_interfaces[librenms_interface_name]
+            ignore, role = (0 if device.alarm_interfaces else 1), ""
 
-            if "uplink" in device_interface.tags:
-                ignore = 0
-
-            if "librenms_alarm_disable" in device_interface.tags:
-                ignore = 1
-
-            if "librenms_alarm_enable" in device_interface.tags:
-                ignore = 0
-
-            role = device_interface.get("role")
-            if role:
-                for role_regex in roles_enabled_compiled:
-                    if role_regex.search(role):
-                        ignore = 0
-
-            for interface_regex in interfaces_disabled_compiled:
-                if interface_regex.search(librenms_interface_name):
-                    ignore = 1
-
-        if librenms_interface.ignore != ignore:
+        if port["ignore"] != ignore:
             if role:
                 role = f"role {role}, "
-            print(f"    Name {name}, interface {librenms_interface.ifname}, role {role}, setting ignore to {ignore}")
+            print(f"    Name {name}, interface {port['ifname']}, role {role}, setting ignore to {ignore}")
             d = AttrDict()
             d.ignore = ignore
-            librenms_mgr.update_device_interface(port_id=librenms_interface.port_id, data=d)
+            changes.add("update_device_interface", f"{name}, set ignore on interface {port['ifname']}",
+                        librenms_mgr.update_device_interface, port_id=port["port_id"], data=d)
+
+
+def create_device(librenms_mgr, name, community_list, executor, snmp_version="v2c"):
+    """
+    Create device in librenms
+    All communities are probed in parallel with a read only SNMP get, the device
+    is created once, with the first working community in list order.
+    If none works, it is created with the first community, forced
+    Raises Librenms_Error if librenms did not create the device
+    """
+    community = None
+    force_add = 1
+    if community_list:
+        community = community_list[0]
+        futures = [executor.submit(snmp_probe, name, c, snmp_version) for c in community_list]
+        for c, future in zip(community_list, futures):
+            if future.result():
+                community = c
+                force_add = 0
+                break
+        if force_add:
+            print(f"Warning: {name} does not answer SNMP from this host, adding it forced with the first community")
+    r = librenms_mgr.create_device(name=name, force_add=force_add, community=community)
+    if not r or r.get("status", None) != "ok":
+        raise Librenms_Error(f"Create device {name} failed, {r.get('message', r) if r else r}")
+    return r
 
 
 def main():
-    # Compile regex for faster search
-    for role in config.librenms_sync.roles_enabled:
-        roles_enabled_compiled.append(re.compile(role))
-
-    for interface in config.librenms_sync.interfaces_disabled:
-        interfaces_disabled_compiled.append(re.compile(interface))
+    global alarm_policy
+    alarm_policy = Alarm_Policy.from_config(config.librenms_sync)
 
     librenms_mgr = Librenms_Mgr(config=config)
     librenms_devices = librenms_mgr.get_devices()
+    librenms = Librenms(config=config.librenms.api)
     
     device_mgr = Device_Mgr(config=config.api.device)
     devices = device_mgr.get_devices()
+    topology = Topology()
+    topology.build(devices)
 
     create_in_librenms = []
     delete_in_librenms = []
@@ -157,6 +165,12 @@ def main():
     device_mgr.write_etc_hosts()
     print()
 
+    print("-" * 79)
+    print("Check parents")
+    for problem in topology.get_problems():
+        print(f"  Warning: {problem}")
+    print()
+
     #
     # Compare Devices-API with devices in Librenms
     #
@@ -164,36 +178,25 @@ def main():
     print("-" * 79)
     print("Checking")
     
+    inventory = Inventory(devices)
+    monitored = inventory.true("enabled") & inventory.true("monitor_librenms")
+
     print("  Devices that exist in device-api but not in Librenms (action: create in librenms):")
-    for name, device in devices.items():
-        if not device.enabled:
-            continue
-        if not device.monitor_librenms:
-            continue
-        if name not in librenms_devices:
-            print("   ", name)
-            create_in_librenms.append(name)
+    for name in inventory.select(monitored & ~inventory.name_in(librenms_devices)):
+        print("   ", name)
+        create_in_librenms.append(name)
 
     if len(create_in_librenms) < 1:
         print("    None")
 
     print("  Devices that exist in Librenms but not in Device-API. (action: delete from librenms)")
-    for name, device in librenms_devices.items():
+    # Delete if not in device-api, not enabled or not monitored in Librenms
+    keep = inventory.select(monitored)
+    for name in librenms_devices:
         if name in config.librenms_sync.persistent_devices:
             continue
-        device = devices.get(name, None)
-        if device is None:
-            # Does not exist in Device-API, delete
+        if name not in keep:
             delete_in_librenms.append(name)
-            continue
-        if not device.enabled:
-            # Not enabled in device-api, delete
-            delete_in_librenms.append(name)
-            continue
-        if not device.monitor_librenms:
-            # Not monitoring in Librenms
-            delete_in_librenms.append(name)
-            continue
 
     if len(delete_in_librenms) < 1:
         print("    None")
@@ -205,30 +208,30 @@ def main():
     print()
     print("-" * 79)
     print("Adjust devices in Librenms")
+    sync_config = config.librenms_sync
+    changes = Change_Queue(
+        workers=sync_config.get("workers", 8),
+        rate_limits=sync_config.get("rate_limits", None),
+        retries=sync_config.get("retries", 3),
+    )
+    try:
+        community_list = config.librenms.snmp.community
+    except KeyError:
+        community_list = None
+    try:
+        snmp_version = config.librenms.snmp.version
+    except (AttributeError, KeyError):
+        snmp_version = "v2c"
+    probe_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, len(community_list or [])) * sync_config.get("workers", 8))
+
     print("  Creating devices in Librenms")
     if len(create_in_librenms):
         for name in create_in_librenms:
             print("   ", name)
-            try:
-                community_list = config.librenms.snmp.community
-            except KeyError:
-                community_list = None
-            created = False
-            if community_list:
-                for community in community_list:
-                    r = librenms_mgr.create_device(name=name, force_add=0, community=community)
-                    if r["status"] == "ok":
-                        created = True
-                        break
-            if not created:
-                # No community, or all communities we tried failed
-                # Create, with default community, force
-                if community_list:
-                    community = community_list[0]
-                else:
-                    community = None
-                r = librenms_mgr.create_device(name=name, force_add=1, community=community)
-
+            changes.add("create_device", f"{name}, create device",
+                        create_device, librenms_mgr, name, community_list, probe_executor, snmp_version,
+                        retry=False)
     else:
         print("    None")
     
@@ -236,13 +239,17 @@ def main():
     if len(delete_in_librenms):
         for name in delete_in_librenms:
             print("   ", name)
-            librenms_mgr.delete_device(name=name)
+            changes.add("delete_device", f"{name}, delete device", librenms_mgr.delete_device, name=name,
+                        retry=False)
     else:
         print("    None")
 
-    #
-    # Update status on devices and ports in Librenms
-    #
+    if len(changes):
+        print(f"  Applying {len(changes)} changes")
+        errors = changes.run()
+        print(f"    Done, {errors} errors")
+    probe_executor.shutdown()
+
     print("  Updating devices in Librenms")
     if create_in_librenms or delete_in_librenms:
         # devices has been added/deleted, reload list of devices in librenms
@@ -269,14 +276,15 @@ def main():
         if device.location:
             if librenms_device.location != device.location:
                 print(f"    Location, change from '{librenms_device.hostname}' to '{device.location}'")
-                librenms_mgr.set_device_location(librenms_device.device_id, location=device.location)
+                changes.add("set_device_location", f"{name}, set location",
+                            librenms_mgr.set_device_location, librenms_device.device_id, location=device.location)
                 update_data.override_sysLocation = 1
 
         if len(update_data):
-            librenms_mgr.update_device(name, update_data)
+            changes.add("update_device", f"{name}, update device", librenms_mgr.update_device, name, update_data)
 
-        # update parents
-        parents = sorted(device.parents)
+        # update parents, parents closing a cycle or not in librenms are ignored
+        parents = sorted(p for p in topology.acyclic_parents(name) if p in librenms_devices)
         librenms_parents = librenms_device.dependency_parent_hostname
         if librenms_parents:
             librenms_parents = sorted(librenms_parents.split(","))
@@ -284,10 +292,15 @@ def main():
             librenms_parents = []
         if parents != librenms_parents:
             print(f"    Name {name}, setting parents to {parents}")
-            librenms_mgr.set_device_parent(device_id=librenms_device.device_id, parent=parents)
+            changes.add("set_device_parent", f"{name}, set parents",
+                        librenms_mgr.set_device_parent, device_id=librenms_device.device_id, parent=parents)
+
+    print("  Updating interfaces in Librenms")
+    sync_interfaces(librenms, librenms_mgr, librenms_devices, devices, changes)
 
-        sync_interfaces(name, librenms_mgr, librenms_device, device)
-    print("    Done")
+    print(f"  Applying {len(changes)} changes")
+    errors = changes.run()
+    print(f"    Done, {errors} errors")
     
 
 if __name__ == '__main__':
@@ -43,6 +43,7 @@ try:
     from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
 
     import lib.base_common as common
+    from lib.db_loader import Bulk_Loader
 
     netbox = pynetbox.api(url=config.netbox.url, token=config.netbox.token)
 
@@ -57,9 +58,9 @@ def full_name(name):
     return name
 
 
-def parse_netbox_data(src=None, devices=None, interfaces=None, addresses=None, vm=False):
+def parse_netbox_data(loader=None, devices=None, interfaces=None, addresses=None, vm=False):
     """
-    Go through data from netbox API, and save in database
+    Go through data from netbox API, and add rows to the bulk loader
     """
     # Build dict, key is interface.id, value is interface, to quickly lookup interface based on interface.id
     # Build dict, key is device name,  value is interface, to quickly lookup interfaces for a device
@@ -107,9 +108,8 @@ def parse_netbox_data(src=None, devices=None, interfaces=None, addresses=None, v
 
         # print("name", name)
         # ----- Device -----
-        d = Device()
+        d = loader.add_device()
         d.name = name
-        d.field_src = src
         
         try:
             d.manufacturer = device.device_type.manufacturer.name
@@ -217,8 +217,6 @@ def parse_netbox_data(src=None, devices=None, interfaces=None, addresses=None, v
         except (AttributeError, NameError):
             d.backup_oxidized = False
 
-        d.save()
-
         # ----- Parent -----
         try:
             parents = device.custom_fields.get("parents", "")
@@ -228,22 +226,12 @@ def parse_netbox_data(src=None, devices=None, interfaces=None, addresses=None, v
 
         if parents:
             for parent in parents:
-                p = Parent(
-                    device = d,
-                    parent = parent,
-                    field_src = src,
-                )
-                p.save()
+                loader.add_parent(d, parent)
 
         # ----- Tag -----
         if device.tags:
             for tag in device.tags:
-                t = Tag(
-                    device = d,
-                    tag = tag,
-                    field_src = src,
-                )
-                t.save()
+                loader.add_tag(d, tag)
 
         # ----- Interfaces, InterfaceTags, addresses -----
 
@@ -257,25 +245,18 @@ def parse_netbox_data(src=None, devices=None, interfaces=None, addresses=None, v
                     if interface.addresses:
                         # print(" ", ifname, "address:", interface.addresses[0].address)
                         ipv4_prefix = interface.addresses[0].address
-                    i = Interface(
-                        device = d,
+                    i = loader.add_interface(
+                        d,
                         name = ifname,
                         role = "",
                         enabled = interface.enabled,
                         ipv4_prefix = ipv4_prefix,
                         ipv6_prefix = ipv6_prefix,
-                        field_src = src,
                     )
-                    i.save()
 
                     if interface.tags:
                         for tag in interface.tags:
-                            it = InterfaceTag(
-                                interface = i,
-                                tag = tag,
-                                field_src = src,
-                            )
-                            it.save()
+                            loader.add_interface_tag(i, tag)
         except KeyError:
             pass   # no interface
 
@@ -359,23 +340,24 @@ def get_netbox_devices(name=None):
         addresses[d.id] = d
 
     src = "netbox"
-    with transaction.atomic():
-        print("----- Deleting old Netbox data from database (in a transaction) -----")
-        if len(devices):
-            if len(devices) > 1:
-                Device.objects.filter(field_src=src).delete()
-            else:
-                d = list(devices.values())[0]
-                name = full_name(d.name)
-                Device.objects.filter(name=name).delete()
+    if len(devices):
+        loader = Bulk_Loader(src=src)
 
-            # Parse responses from Netbox, virtual machines
-            print("----- Parse and save Netbox virtual machines -----")
-            parse_netbox_data(src=src, devices=vmdevices, interfaces=vminterfaces, addresses=addresses, vm=True)
+        # Parse responses from Netbox, virtual machines
+        print("----- Parse Netbox virtual machines -----")
+        parse_netbox_data(loader=loader, devices=vmdevices, interfaces=vminterfaces, addresses=addresses, vm=True)
 
-            # Parse responses from Netbox, devices
-            print("----- Parse and save Netbox devices -----")
-            parse_netbox_data(src=src, devices=devices, interfaces=interfaces, addresses=addresses)
+        # Parse responses from Netbox, devices
+        print("----- Parse Netbox devices -----")
+        parse_netbox_data(loader=loader, devices=devices, interfaces=interfaces, addresses=addresses)
+
+        print("----- Replace Netbox data in database (in a transaction) -----")
+        if len(devices) > 1:
+            loader.save()
+        else:
+            d = list(devices.values())[0]
+            loader.save(names=[full_name(d.name)])
+        print(f"Saved {loader.count(Device)} devices, {loader.count(Interface)} interfaces")
 
 
 def main(name=None):
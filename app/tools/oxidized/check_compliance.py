@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Compare NetBox intent in the device cache with the oxidized configuration backups
+
+Interfaces, enabled state and addresses are checked for all devices,
+results are stored per device and shown in the device view
+"""
+
+# python standard modules
+import os
+import sys
+import time
+import argparse
+
+if sys.prefix == sys.base_prefix:
+    print("Error: You must run this script in a python virtual environment")
+    sys.exit(1)
+
+if "/opt" not in sys.path:
+    sys.path.insert(0, "/opt")
+try:
+    import ablib.utils as abutils
+except:
+    print("Error: Cannot import ablib.* check PYTHONPATH")
+    sys.exit(1)
+
+try:
+    # modules, django
+    import django
+
+    # Setup django environment
+    sys.path.append(os.getcwd())
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+
+    # Setup django
+    django.setup()
+
+    # Import ORM models
+    from base.models import Cache, Compliance
+
+    from lib.device import Device_Cache
+    from lib.oxidized import Oxidized
+    from lib.config_mirror import Config_Mirror
+    from lib.compliance import Compliance_Checker
+
+except:
+    abutils.send_traceback()    # Error in script, send traceback to developer
+
+
+def main():
+    compliance_config = config.get("compliance", None) or {}
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of processes comparing device configurations")
+    parser.add_argument("--fetch-jobs", type=int, default=compliance_config.get("fetch_jobs", 10),
+                        help="Number of concurrent requests fetching configurations from oxidized")
+    parser.add_argument("--refresh", action="store_true", default=False,
+                        help="Ignore stored results, fetch and check all configurations")
+    args = parser.parse_args()
+
+    if config.oxidized.get("mirror", None):
+        oxidized = Config_Mirror(config=config.oxidized.mirror)
+    else:
+        oxidized = Oxidized(config=config.oxidized, pool_maxsize=args.fetch_jobs)
+
+    print("----- Get devices from device cache -----")
+    t = time.time()
+    device_cache = Device_Cache(config=config, cache_cls=Cache)
+    devices = device_cache.get_devices()
+    if not devices:
+        print("Error: No devices in device cache")
+        sys.exit(1)
+    print(f"Got {len(devices)} devices in {time.time() - t:.1f} s")
+
+    print("----- Check compliance, NetBox vs configuration backups -----")
+    t = time.time()
+    checker = Compliance_Checker(compliance_cls=Compliance, oxidized=oxidized,
+                                 jobs=args.jobs, fetch_jobs=args.fetch_jobs)
+    status = checker.run(devices, refresh=args.refresh)
+    for s, count in sorted(status.items()):
+        print(f"  {s:12s} {count}")
+    print(f"Checked compliance in {time.time() - t:.1f} s")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except:
+        abutils.send_traceback()  # Error in script, send traceback to developer
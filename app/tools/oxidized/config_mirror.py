@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Local mirror of oxidized configuration backups
+
+    config_mirror.py update             pull the oxidized git repository, update search index
+    config_mirror.py search <text>      list devices with configurations containing text
+    config_mirror.py show <name>        print configuration for a device
+
+Configured in "oxidized: mirror:" in /etc/factum/factum.yaml
+"""
+
+# python standard modules
+import os
+import sys
+import time
+import argparse
+
+if sys.prefix == sys.base_prefix:
+    print("Error: You must run this script in a python virtual environment")
+    sys.exit(1)
+
+if "/opt" not in sys.path:
+    sys.path.insert(0, "/opt")
+try:
+    import ablib.utils as abutils
+except:
+    print("Error: Cannot import ablib.* check PYTHONPATH")
+    sys.exit(1)
+
+try:
+    sys.path.append(os.getcwd())
+    from lib.config_mirror import Config_Mirror
+except:
+    abutils.send_traceback()    # Error in script, send traceback to developer
+
+CONFIG_FILE = "/etc/factum/factum.yaml"
+
+# Load configuration
+config = abutils.load_config(CONFIG_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cmd", choices=["update", "search", "show"])
+    parser.add_argument("text", nargs="?")
+    parser.add_argument("-i", "--ignore-case", action="store_true", default=False)
+    parser.add_argument("--rebuild", action="store_true", default=False,
+                        help="Rebuild search index, even if mirror is unchanged")
+    args = parser.parse_args()
+
+    mirror = Config_Mirror(config=config.oxidized.mirror)
+
+    if args.cmd == "update":
+        t = time.time()
+        changed = mirror.update()
+        print(f"Mirror {'updated' if changed else 'unchanged'} in {time.time() - t:.1f} s")
+        t = time.time()
+        index = mirror.build_index(rebuild=args.rebuild)
+        print(f"Index with {len(index.names)} configurations, {len(index.keys)} trigrams, in {time.time() - t:.1f} s")
+
+    elif args.cmd == "search":
+        if not args.text:
+            print("Error: No search text specified")
+            sys.exit(1)
+        t = time.time()
+        result = mirror.search(args.text, ignore_case=args.ignore_case)
+        for match in result:
+            print(match["name"])
+            for lineno, line in match["lines"]:
+                print(f"  {lineno:6d} {line}")
+        print(f"{len(result)} configurations in {(time.time() - t) * 1000:.0f} ms")
+
+    elif args.cmd == "show":
+        conf = mirror.get_device_config(args.text or "")
+        if conf is None:
+            print(f"Error: No configuration for '{args.text}'")
+            sys.exit(1)
+        print(conf, end="")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except:
+        abutils.send_traceback()  # Error in script, send traceback to developer
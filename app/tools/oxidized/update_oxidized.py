@@ -2,13 +2,16 @@
 
 """
 Build list of devices in oxidized, from device-api
-Restart oxidized if configuration has changed
+
+The new router.db is compared with the installed one, node by node.
+If nodes are added, removed or changed, oxidized is asked to reread its
+node list through the web API, and added/changed nodes are backed up next.
+Oxidized is restarted only if the web API fails.
 """
 
 # python standard modules
 import os
 import sys
-from collections import Counter
 
 if sys.prefix == sys.base_prefix:
     print("Error: You must run this script in a python virtual environment")
@@ -26,6 +29,7 @@ except:
 
 try:
     # modules installed with pip
+    import requests
     from orderedattrdict import AttrDict
 
     # modules, django
@@ -43,11 +47,42 @@ try:
     from base.models import Device, Tag, Parent, Interface, InterfaceTag, Cache
 
     import lib.base_common as common
+    from lib.inventory import Inventory
+    from lib.oxidized import Oxidized
 
 except:
     abutils.send_traceback()    # Error in script, send traceback to developer
 
 
+def read_router_db(filename: str, separator: str = ":") -> dict:
+    """
+    Read router.db
+    returns dict, key is node name (first field), value is the line
+    """
+    nodes = {}
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line or line.startswith("#"):
+                    continue
+                nodes[line.split(separator, 1)[0]] = line
+    except FileNotFoundError:
+        pass
+    return nodes
+
+
+def diff_router_db(old: dict, new: dict):
+    """
+    returns list of added, removed and changed node names
+    A node is changed if any field (address, model, credentials etc) differs
+    """
+    added = sorted(name for name in new if name not in old)
+    removed = sorted(name for name in old if name not in new)
+    changed = sorted(name for name in new if name in old and new[name] != old[name])
+    return added, removed, changed
+
+
 def main():
     oxidized_mgr = Oxidized_Mgr(config=config.oxidized)
     
@@ -56,51 +91,17 @@ def main():
     tmp_devices = device_mgr.get_devices()
 
     print("----- Filter devices that do not need backup -----")
-    count = Counter(
-        ignored_not_enabled=0,
-        ignored_backup_oxidized=0,
-        ignored_name=0,
-        ignored_manufacturer=0,
-        ignored_model=0,
-        ignored_source=0,
-        ignored_platform=0,
-    )
-    devices = {}  # Key is name
-    for name, device in tmp_devices.items():
-        if not device.enabled:
-            count["ignored_not_enabled"] += 1
-            continue
-
-        if not device.backup_oxidized:
-            count["ignored_backup_oxidized"] += 1
-            continue
-
-        if name in config.oxidized_sync.ignore_names:
-            count["ignore_name"] += 1
-            continue
-
-        if device.manufacturer in config.oxidized_sync.ignore_manufacturers:
-            count["ignore_manufacturer"] += 1
-            continue
-
-        if device.model in config.oxidized_sync.ignore_models:
-            count["ignore_model"] += 1
-            continue
-
-        # Get all keys that exist in both dict
-        shared_keys = set(device.tags).intersection(config.oxidized_sync.ignore_device_tags)
-        if shared_keys:
-            count["ignore_src"] += 1
-            continue
-
-        if device.platform in config.oxidized_sync.ignore_platforms:
-            count["ignore_platformc"] += 1
-            continue
-    
-        if not device.primary_ip4:
-            continue
-
-        devices[name] = device
+    sync_config = config.oxidized_sync
+    inventory = Inventory(tmp_devices)
+    mask = inventory.true("enabled") & \
+        inventory.true("backup_oxidized") & \
+        ~inventory.name_in(sync_config.ignore_names) & \
+        ~inventory.isin("manufacturer", sync_config.ignore_manufacturers) & \
+        ~inventory.isin("model", sync_config.ignore_models) & \
+        ~inventory.has_any_tag(sync_config.ignore_device_tags) & \
+        ~inventory.isin("platform", sync_config.ignore_platforms) & \
+        inventory.has_primary_ip4
+    devices = inventory.select(mask)  # Key is name
 
     print("Devices    : %5d devices" % len(devices))
     print("Persistent : %5d devices" % len(config.oxidized_sync.persistent_devices))
@@ -108,20 +109,37 @@ def main():
     print()
     
     t = config.oxidized_sync.router_db
+    separator = t.get("separator", ":")
     changed = False
     count = oxidized_mgr.save_devices(t.tmp,
                                       devices,
                                       ignore_models=config.oxidized_sync.ignore_models)
     print("Wrote %d devices to oxidized" % (count))
 
+    added, removed, modified = diff_router_db(read_router_db(t.dst, separator), read_router_db(t.tmp, separator))
+    for title, names in [("Added", added), ("Removed", removed), ("Changed", modified)]:
+        for name in names:
+            print(f"  {title} {name}")
+
     changed = abutils.install_conf_file(src=t.tmp,
                                         dst=t.dst,
                                         changed=changed)
-    if changed:
-        print("----- configuration changed, reloading oxidized")
-        oxidized_mgr.reload()
-    else:
+    if not changed:
         print("----- configuration unchanged")
+        return
+    if not (added or removed or modified):
+        print("----- configuration changed, no node changes")
+        return
+
+    print(f"----- nodes changed, {len(added)} added, {len(removed)} removed, {len(modified)} changed, reloading node list")
+    try:
+        oxidized = Oxidized(config=config.oxidized)
+        oxidized.reload_nodes()
+        for name in added + modified:
+            oxidized.next_node(name)
+    except requests.exceptions.RequestException as err:
+        print(f"Warning: oxidized node reload failed, err {err}, restarting oxidized")
+        oxidized_mgr.reload()
 
 
 if __name__ == '__main__':